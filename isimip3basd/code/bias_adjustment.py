@@ -28,15 +28,26 @@ observation data with the same spatial and temporal resolution.
 
 
 
+import os
 import warnings
 import numpy as np
 import scipy.stats as sps
 import utility_functions as uf
+import threading
 import multiprocessing as mp
+import multiprocessing.dummy
 from netCDF4 import Dataset
-from optparse import OptionParser
+from optparse import OptionParser, Values
 from functools import partial
+from itertools import cycle
 from contextlib import ExitStack
+from collections import OrderedDict, defaultdict
+
+
+
+# index and number of submitted results of the current worker process or
+# thread in multiprocessing applications
+worker = threading.local()
 
 
 
@@ -48,7 +59,8 @@ def map_quantiles_parametric_trend_preserving(
         upper_bound=None, upper_threshold=None,
         unconditional_ccs_transfer=False, trendless_bound_frequency=False,
         n_quantiles=50, p_value_eps=1e-10,
-        max_change_factor=100., max_adjustment_factor=9.):
+        max_change_factor=100., max_adjustment_factor=9.,
+        x_sorted=(None, None, None)):
     """
     Adjusts biases using the trend-preserving parametric quantile mapping method
     described in Lange (2019) <https://doi.org/10.5194/gmd-12-3055-2019>.
@@ -100,6 +112,11 @@ def map_quantiles_parametric_trend_preserving(
     max_adjustment_factor : float, optional
         Maximum adjustment factor applied in non-parametric quantile mapping
         with mixed trend preservation.
+    x_sorted : tuple of arrays or Nones, optional
+        Sorted copies of x_obs_hist, x_sim_hist, and x_sim_fut, where values
+        beyond thresholds may differ from those in the original arrays. Used
+        to compute the quantiles of the values within thresholds without
+        sorting these again wherever they are not None.
 
     Returns
     -------
@@ -125,19 +142,25 @@ def map_quantiles_parametric_trend_preserving(
         i_sim_fut = np.logical_and(i_sim_fut, x_sim_fut < upper_threshold)
     if unconditional_ccs_transfer:
         # use all values
+        if lower or upper: x_sorted = (None, None, None)
         x_target = uf.map_quantiles_non_parametric_trend_preserving(
             x_obs_hist, x_sim_hist, x_sim_fut,
             trend_preservation, n_quantiles,
             max_change_factor, max_adjustment_factor,
-            True, lower_bound, upper_bound)
+            True, lower_bound, upper_bound, x_sorted)
     else:
-        # use only values within thresholds
+        # use only values within thresholds, which remain sorted
+        x_sorted_within = []
+        for x in x_sorted:
+            if x is not None and lower: x = x[x > lower_threshold]
+            if x is not None and upper: x = x[x < upper_threshold]
+            x_sorted_within.append(x)
         x_target = x_obs_hist.copy()
         x_target[i_obs_hist] = uf.map_quantiles_non_parametric_trend_preserving(
             x_obs_hist[i_obs_hist], x_sim_hist[i_sim_hist],
             x_sim_fut[i_sim_fut], trend_preservation, n_quantiles,
             max_change_factor, max_adjustment_factor,
-            True, lower_threshold, upper_threshold)
+            True, lower_threshold, upper_threshold, x_sorted_within)
 
     # determine extreme value probabilities of future obs
     if lower:
@@ -291,6 +314,142 @@ def map_quantiles_parametric_trend_preserving(
 
 
 
+def map_quantiles_parametric_trend_preserving_batch(
+        x_obs_hist, x_sim_hist, x_sim_fut, 
+        distribution=None, trend_preservation='additive',
+        adjust_p_values=False,
+        lower_bound=None, lower_threshold=None,
+        upper_bound=None, upper_threshold=None,
+        unconditional_ccs_transfer=False, trendless_bound_frequency=False,
+        n_quantiles=50, p_value_eps=1e-10,
+        max_change_factor=100., max_adjustment_factor=9.):
+    """
+    Applies map_quantiles_parametric_trend_preserving to every column of the
+    given 2d arrays. Without thresholds and p-value adjustment, quantiles are
+    computed and mapped for all columns at once and only distributions are
+    fitted column by column. Otherwise, every column is adjusted separately.
+    The results are the same in both cases.
+
+    Parameters
+    ----------
+    x_obs_hist : ndarray
+        Time series of observed climate data representing the historical or
+        training time period, one column per location.
+    x_sim_hist : ndarray
+        Time series of simulated climate data representing the historical or
+        training time period, one column per location.
+    x_sim_fut : ndarray
+        Time series of simulated climate data representing the future or
+        application time period, one column per location.
+
+    Returns
+    -------
+    x_sim_fut_ba : ndarray
+        Result of bias adjustment, one column per location.
+
+    Other Parameters
+    ----------------
+    See map_quantiles_parametric_trend_preserving.
+
+    """
+    lower = lower_bound is not None and lower_threshold is not None
+    upper = upper_bound is not None and upper_threshold is not None
+    n_locations = x_sim_fut.shape[1]
+
+    # adjust column by column if values beyond thresholds have to be treated
+    # separately or if p-values are to be adjusted
+    if lower or upper or adjust_p_values:
+        return np.stack([map_quantiles_parametric_trend_preserving(
+            np.ascontiguousarray(x_obs_hist[:,k]),
+            np.ascontiguousarray(x_sim_hist[:,k]),
+            np.ascontiguousarray(x_sim_fut[:,k]),
+            distribution, trend_preservation, adjust_p_values,
+            lower_bound, lower_threshold, upper_bound, upper_threshold,
+            unconditional_ccs_transfer, trendless_bound_frequency,
+            n_quantiles, p_value_eps, max_change_factor,
+            max_adjustment_factor) for k in range(n_locations)], axis=1)
+
+    # use augmented quantile delta mapping to transfer the simulated
+    # climate change signal to the historical observation
+    if unconditional_ccs_transfer:
+        x_target = uf.map_quantiles_non_parametric_trend_preserving(
+            x_obs_hist, x_sim_hist, x_sim_fut,
+            trend_preservation, n_quantiles,
+            max_change_factor, max_adjustment_factor,
+            True, lower_bound, upper_bound)
+    else:
+        x_target = x_obs_hist.copy()
+        x_target[:] = uf.map_quantiles_non_parametric_trend_preserving(
+            x_obs_hist, x_sim_hist, x_sim_fut,
+            trend_preservation, n_quantiles,
+            max_change_factor, max_adjustment_factor,
+            True, lower_threshold, upper_threshold)
+
+    # fit distributions to x_sim_fut and x_target column by column
+    x_source = x_sim_fut
+    y = x_source.copy()
+    spsdotwhat = sps.norm if distribution == 'normal' else \
+                 sps.weibull_min if distribution == 'weibull' else \
+                 sps.gamma if distribution == 'gamma' else \
+                 sps.beta if distribution == 'beta' else \
+                 sps.rice if distribution == 'rice' else \
+                 None
+    fitted = np.zeros(n_locations, dtype=bool)
+    if spsdotwhat is not None:
+        # because sps.rice.fit and sps.weibull_min.fit cannot handle
+        # fscale=None
+        if distribution in ['rice', 'weibull']:
+            fwords = {'floc': None}
+        else:
+            fwords = {'floc': None, 'fscale': None}
+        shape_loc_scale_source = []
+        shape_loc_scale_target = []
+        for k in range(n_locations):
+            s = uf.fit(spsdotwhat, np.ascontiguousarray(x_source[:,k]), fwords)
+            t = uf.fit(spsdotwhat, np.ascontiguousarray(x_target[:,k]), fwords)
+            if s is not None and t is not None:
+                fitted[k] = True
+                shape_loc_scale_source.append(s)
+                shape_loc_scale_target.append(t)
+
+    # do non-parametric quantile mapping where fitting failed
+    if not np.all(fitted):
+        msg = 'unable to do parametric quantile mapping' \
+            + ': doing non-parametric quantile mapping instead'
+        if spsdotwhat is not None: warnings.warn(msg)
+        k = np.logical_not(fitted)
+        p_zeroone = np.linspace(0., 1., n_quantiles + 1)
+        q_source_fit = uf.percentile2d(x_source[:,k], p_zeroone)
+        q_target_fit = uf.percentile2d(x_target[:,k], p_zeroone)
+        y[:,k] = uf.map_quantiles_non_parametric_with_constant_extrapolation(
+            x_source[:,k], q_source_fit, q_target_fit)
+
+    # do parametric quantile mapping where fitting worked
+    if np.any(fitted):
+        # standardize x_source using the data types that are used when the
+        # location and scale parameters are passed on as scalars
+        x_source_fitted = x_source[:,fitted]
+        z_source = np.empty(x_source_fitted.shape)
+        dtypes = [np.result_type(x_source, np.asarray(s[-2]))
+            for s in shape_loc_scale_source]
+        for dtype in set(dtypes):
+            k = np.array([d == dtype for d in dtypes])
+            loc, scale = [np.array(a, dtype=dtype)
+                for a in zip(*shape_loc_scale_source)][-2:]
+            z_source[:,k] = (x_source_fitted[:,k] - loc[k]) / scale[k]
+        shapes_source = [np.array(a)
+            for a in zip(*shape_loc_scale_source)][:-2]
+        shape_loc_scale_target = [np.array(a)
+            for a in zip(*shape_loc_scale_target)]
+        limit_p_values = lambda p : np.maximum(p_value_eps,
+                                    np.minimum(1-p_value_eps, p))
+        p_source = limit_p_values(spsdotwhat.cdf(z_source, *shapes_source))
+        y[:,fitted] = spsdotwhat.ppf(p_source, *shape_loc_scale_target)
+
+    return y
+
+
+
 def adjust_bias_one_month(
         data, years, long_term_mean,
         lower_bound=[None], lower_threshold=[None],
@@ -299,7 +458,8 @@ def adjust_bias_one_month(
         randomization_seed=None, detrend=[False], rotation_matrices=[],
         n_quantiles=50, distribution=[None],
         trend_preservation=['additive'], adjust_p_values=[False],
-        invalid_value_warnings=False, **kwargs):
+        invalid_value_warnings=False, hist_prepared=None,
+        sorted_samples=None, **kwargs):
     """
     1. Replaces invalid values in time series.
     2. Detrends time series if desired.
@@ -313,13 +473,16 @@ def adjust_bias_one_month(
     ----------
     data : dict of str : list of arrays
         Keys : 'obs_hist', 'sim_hist', 'sim_fut'.
-        Values : time series for all climate variables.
+        Values : time series for all climate variables. The time series of
+        several locations can be adjusted at once using 2d arrays with one
+        column per location.
     years : dict of str : array
         Keys : 'obs_hist', 'sim_hist', 'sim_fut'.
         Values : years of time steps of time series, used for detrending.
-    long_term_mean : dict of str: list of floats
+    long_term_mean : dict of str: list of floats or arrays
         Keys : 'obs_hist', 'sim_hist', 'sim_fut'.
-        Values : average of valid values in complete time series.
+        Values : average of valid values in complete time series, one per
+        location if data contains 2d arrays.
     lower_bound : list of floats, optional
         Lower bounds of values in data.
     lower_threshold : list of floats, optional
@@ -361,6 +524,18 @@ def adjust_bias_one_month(
     invalid_value_warnings : boolean, optional
         Raise user warnings when invalid values are replaced bafore bias
         adjustment.
+    hist_prepared : dict of str : list of arrays, optional
+        Keys : 'obs_hist', 'sim_hist'.
+        Values : time series prepared by steps 1 to 3. Used instead of
+        repeating these steps if available, otherwise filled in. This allows
+        to share this preparation between several applications with the same
+        historical data.
+    sorted_samples : dict of str : list of arrays or Nones, optional
+        Keys : 'obs_hist', 'sim_hist', 'sim_fut'.
+        Values : sorted copies of the time series of data, or None where
+        these are not available or contain invalid values. Used during
+        non-parametric quantile mapping of 1d time series that are not
+        changed by steps 2 and 4 instead of sorting these again.
 
     Returns
     -------
@@ -372,16 +547,21 @@ def adjust_bias_one_month(
     **kwargs : Passed on to map_quantiles_parametric_trend_preserving.
     
     """
-    # remove invalid values from masked arrays and store resulting numpy arrays
     x = {}
+    n_variables = len(detrend)
+    trend_sim_fut = [None] * n_variables
     for key, data_list in data.items():
+        if hist_prepared is not None and key in hist_prepared:
+            x[key] = hist_prepared[key]
+            continue
+
+        # remove invalid values from masked arrays and store resulting numpy
+        # arrays
         x[key] = [uf.sample_invalid_values(d, randomization_seed,
             long_term_mean[key][i], invalid_value_warnings)[0]
             for i, d in enumerate(data_list)]
 
-    n_variables = len(detrend)
-    trend_sim_fut = [None] * n_variables
-    for key, y in years.items():
+        y = years[key]
         for i in range(n_variables):
             # subtract trend
             if detrend[i]:
@@ -390,23 +570,43 @@ def adjust_bias_one_month(
             else:
                 x[key][i] = x[key][i].copy()
         
-            # randomize censored values
+            # randomize censored values location by location
             # use low powers to ensure successful transformations of values
             # beyond thresholds to values within thresholds during quantile
             # mapping
-            uf.randomize_censored_values(x[key][i], 
-                lower_bound[i], lower_threshold[i],
-                upper_bound[i], upper_threshold[i],
-                True, False, randomization_seed, 1., 1.)
-
-    # use MBCn to adjust copula
-    if n_variables > 1 and len(rotation_matrices):
-        x['sim_fut'] = uf.adjust_copula_mbcn(x, rotation_matrices, n_quantiles)
+            for k in np.ndindex(x[key][i].shape[1:]):
+                uf.randomize_censored_values(x[key][i][(slice(None),) + k],
+                    lower_bound[i], lower_threshold[i],
+                    upper_bound[i], upper_threshold[i],
+                    True, False, randomization_seed, 1., 1.)
+        if hist_prepared is not None and key != 'sim_fut':
+            hist_prepared[key] = x[key]
+
+    # use MBCn to adjust copula location by location
+    mbcn = n_variables > 1 and len(rotation_matrices)
+    if mbcn:
+        for k in np.ndindex(x['sim_fut'][0].shape[1:]):
+            j = (slice(None),) + k
+            x_sim_fut_mbcn = uf.adjust_copula_mbcn(
+                {key: [xi[j] for xi in x_list] for key, x_list in x.items()},
+                rotation_matrices, n_quantiles)
+            for i in range(n_variables):
+                x['sim_fut'][i][j] = x_sim_fut_mbcn[i]
 
     x_sim_fut_ba = []
     for i in range(n_variables):
         # adjust distribution and de-randomize censored values
-        y = map_quantiles_parametric_trend_preserving(
+        if x['sim_fut'][i].ndim == 1:
+            # sorted samples are only valid as long as the data have not been
+            # detrended or, in case of sim_fut, adjusted by MBCn
+            x_sorted = [None if sorted_samples is None or detrend[i]
+                or mbcn and key == 'sim_fut' else sorted_samples[key][i]
+                for key in ('obs_hist', 'sim_hist', 'sim_fut')]
+            map_quantiles = partial(map_quantiles_parametric_trend_preserving,
+                x_sorted=x_sorted)
+        else:
+            map_quantiles = map_quantiles_parametric_trend_preserving_batch
+        y = map_quantiles(
             x['obs_hist'][i], x['sim_hist'][i], x['sim_fut'][i],
             distribution[i], trend_preservation[i],
             adjust_p_values[i],
@@ -427,21 +627,150 @@ def adjust_bias_one_month(
 
 
 
-def adjust_bias_one_location(
-        i_loc, variable, step_size=0, window_centers=None,
+def adjust_bias_batch(
+        i_locations, variable, step_size=0, window_centers=None,
         months=[1,2,3,4,5,6,7,8,9,10,11,12],
         halfwin_upper_bound_climatology=[0],
         lower_bound=[None], lower_threshold=[None],
         upper_bound=[None], upper_threshold=[None],
         if_all_invalid_use=[np.nan], **kwargs):
     """
-    Adjusts biases in climate data representing one grid cell calendar month by
-    calendar month and stores result in one numpy array per variable.
+    Loads climate data representing a batch of grid cells and adjusts their
+    biases using adjust_bias_targets, where grid cells are adjusted together
+    if the same targets have to be skipped there because of missing values in
+    sim_fut. Grid cells with only missing values in obs_hist or sim_hist, or
+    in sim_fut of all targets, are skipped entirely.
 
     Parameters
     ----------
-    i_loc : tuple
-        Location index.
+    i_locations : list of tuples
+        Location indices.
+    variable : list of strs
+        Names of variable to be bias-adjusted in netcdf files.
+    step_size: int, optional
+        Step size in number of days used for bias adjustment in running-window
+        mode. Setting this to 0 implies that bias adjustment is not done in 
+        this mode but calendar month by calendar month.
+    window_centers : array, optional
+        Window centers for bias adjustment in running-window mode. In
+        day-of-year units.
+    months : list of ints, optional
+        List of ints from {1,...,12} representing calendar months for which 
+        results of bias adjustment are to be returned. Not used if bias 
+        adjustment is done in running-window mode.
+    halfwin_upper_bound_climatology : list of ints, optional
+        Determines the lengths of running windows used in the calculations of
+        climatologies of upper bounds that are used to scale values of obs_hist,
+        sim_hist, and sim_fut to the interval [0,1] before bias adjustment. The
+        window length is set to halfwin_upper_bound_climatology * 2 + 1 time
+        steps. If halfwin_upper_bound_climatology == 0 then no rescaling is
+        done.
+    lower_bound : list of floats, optional
+        Lower bounds of values in data.
+    lower_threshold : list of floats, optional
+        Lower thresholds of values in data.
+    upper_bound : list of floats, optional
+        Upper bounds of values in data.
+    upper_threshold : list of floats, optional
+        Upper thresholds of values in data.
+    if_all_invalid_use : list of floats, optional
+        Used to replace invalid values if there are no valid values.
+
+    Returns
+    -------
+    None.
+
+    Other Parameters
+    ----------------
+    **kwargs : Passed on to adjust_bias_targets.
+
+    """
+    n_variables = len(variable)
+    calendar = doys if step_size else month_numbers
+    n_targets = len(calendar['sim_fut'])
+    keys = calendar.keys()
+    groups = OrderedDict()
+    for i_loc in i_locations:
+        # get local input data, where sim_fut holds the data of all variables
+        # of one target after the other
+        data = {}
+        for key in keys:
+            datasets = eval(key)
+            data[key] = []
+            variables = variable * n_targets if key == 'sim_fut' else variable
+            for i, v in enumerate(variables):
+                 if datasets and tile_caches is None:
+                     x = datasets[i][v][i_loc]
+                 elif datasets:
+                     x = uf.load_via_tile_cache(
+                         datasets[i][v], i_loc, tile_caches[key, i])
+                 else:
+                     from_pool_queue.put((key, i, v, i_loc, worker.i_process))
+                     x = uf.get_from_shared_slot(shared_slots[worker.i_process],
+                         shared_regions[key, i],
+                         to_pool_queues[worker.i_process].get())
+                     # shared memory regions are reused for the next location
+                     if len(i_locations) > 1: x = x.copy()
+                 data[key].append(x)
+
+        # skip location if there are only missing values in obs_hist or
+        # sim_hist or in sim_fut of all targets, otherwise skip only those
+        # targets with only missing values in sim_fut
+        skipped_targets = tuple(t for t in range(n_targets)
+            if uf.only_missing_values_in_at_least_one_dataset({'sim_fut':
+            data['sim_fut'][t * n_variables:(t + 1) * n_variables]}))
+        if uf.only_missing_values_in_at_least_one_dataset({key: data[key]
+            for key in ('obs_hist', 'sim_hist')}) or \
+            len(skipped_targets) == n_targets:
+            print(i_loc, 'skipped due to missing data')
+            save_one_location(i_loc, variable * n_targets, None)
+        else:
+            if skipped_targets:
+                print(i_loc, 'skipped for targets', skipped_targets,
+                    'due to missing data')
+            else:
+                print(i_loc)
+            group = groups.setdefault(skipped_targets, ([], []))
+            group[0].append(i_loc)
+            group[1].append(data)
+
+    # adjust locations with the same skipped targets together
+    for skipped_targets, group in groups.items():
+        targets = [t for t in range(n_targets) if t not in skipped_targets]
+        adjust_bias_targets(*group, targets, variable, step_size,
+            window_centers, months, halfwin_upper_bound_climatology,
+            lower_bound, lower_threshold, upper_bound, upper_threshold,
+            if_all_invalid_use, **kwargs)
+
+
+
+def adjust_bias_targets(
+        i_locations, data_per_location, targets, variable, step_size=0,
+        window_centers=None, months=[1,2,3,4,5,6,7,8,9,10,11,12],
+        halfwin_upper_bound_climatology=[0],
+        lower_bound=[None], lower_threshold=[None],
+        upper_bound=[None], upper_threshold=[None],
+        if_all_invalid_use=[np.nan], **kwargs):
+    """
+    Adjusts biases in climate data representing a batch of grid cells calendar
+    month by calendar month and stores results in one numpy array per variable
+    and grid cell, for the given targets. If more than one grid cell is to be
+    adjusted then the time series of all grid cells are arranged in arrays
+    with one column per grid cell, such that most computations are done for
+    all grid cells at once.
+
+    Parameters
+    ----------
+    i_locations : list of tuples
+        Location indices.
+    data_per_location : list of dicts of str : list of arrays
+        Input data of every location. Keys : 'obs_hist', 'sim_hist',
+        'sim_fut'. Values : one array per variable, for 'sim_fut' per variable
+        and target, with the arrays of all variables of one target listed
+        before those of the next target.
+    targets : list of ints
+        Targets to be adjusted. The results of all other targets are set to
+        missing values.
     variable : list of strs
         Names of variable to be bias-adjusted in netcdf files.
     step_size: int, optional
@@ -482,59 +811,101 @@ def adjust_bias_one_location(
     **kwargs : Passed on to adjust_bias_one_month.
 
     """
-    # get local input data
-    data = {}
-    for key in doys.keys() if step_size else month_numbers.keys():
-        datasets = eval(key)
-        data[key] = []
-        for i, v in enumerate(variable):
-             if datasets:
-                 x = datasets[i][v][i_loc]
-             else:
-                 from_pool_queue.put((key, i, v, i_loc, i_process))
-                 x = to_pool_queues[i_process].get()
-             data[key].append(x)
-
-    # abort here if there are only missing values in at least one dataset
-    if uf.only_missing_values_in_at_least_one_dataset(data):
-        print(i_loc, 'skipped due to missing data')
-        return None
-
-    # otherwise continue
-    print(i_loc)
     n_variables = len(variable)
+    calendar = doys if step_size else month_numbers
+    n_targets = len(calendar['sim_fut'])
+
+    # arrange time series of several locations in arrays with one column per
+    # location
+    n_locations = len(i_locations)
+    if n_locations == 1:
+        data = data_per_location[0]
+    else:
+        data = {key: [np.ma.stack([d[key][i] for d in data_per_location],
+            axis=1) for i in range(len(data_list))]
+            for key, data_list in data_per_location[0].items()}
+
+    # adjust biases
     None_list = [None] * n_variables
     result = [d.data.copy() if isinstance(d, np.ma.MaskedArray) else d.copy()
         for d in data['sim_fut']]
     
+    # arrange data, calendars and results by target
+    data = [data_of_target(data, t, n_variables) for t in range(n_targets)]
+    result = [result[t * n_variables:(t + 1) * n_variables]
+        for t in range(n_targets)]
+    years_, doys_ = [[calendar_of_target(c, t)
+        for t in range(n_targets)] for c in (years, doys)]
+
     # scale to values in [0, 1]
     ubc = {}
-    ubc_doys = {}
-    ubc_result = None_list.copy()
+    ubc_doys = [{} for t in range(n_targets)]
+    ubc_result = [None_list.copy() for t in range(n_targets)]
     msg = 'found nans in upper bound climatology for variable'
     for i, halfwin in enumerate(halfwin_upper_bound_climatology):
         if halfwin:
-            # scale obs_hist, sim_hist, sim_fut
-            for key, data_list in data.items():
-                ubc[key], ubc_doys[key] = uf.get_upper_bound_climatology(
-                    data_list[i], doys[key], halfwin)
-                assert not np.any(np.isnan(ubc[key])), f'{msg} {i} in {key}'
-                uf.scale_by_upper_bound_climatology(data_list[i],
-                    ubc[key], doys[key], ubc_doys[key], divide=True)
+            for t in targets:
+                # scale obs_hist, sim_hist, sim_fut, where obs_hist and
+                # sim_hist are shared by all targets
+                for key, data_list in data[t].items():
+                    if t != targets[0] and key != 'sim_fut':
+                        ubc_doys[t][key] = ubc_doys[targets[0]][key]
+                        continue
+                    if upper_bound_climatologies:
+                        # look up the precomputed upper bound climatology
+                        ubc_doys[t][key] = np.unique(doys_[t][key])
+                        ubc[key] = uf.load_or_compute_statistic(
+                            upper_bound_climatologies[t][i], key,
+                            i_locations,
+                            lambda: uf.get_upper_bound_climatology(
+                            data_list[i], doys_[t][key], halfwin)[0])
+                    elif key == 'obs_hist' and obs_hist_statistics:
+                        # use the store of obs_hist statistics
+                        ubc_doys[t][key] = np.unique(doys_[t][key])
+                        ubc[key] = uf.load_or_compute_statistic(
+                            obs_hist_statistics[i], 'upper_bound_climatology',
+                            i_locations,
+                            lambda: uf.get_upper_bound_climatology(
+                            data_list[i], doys_[t][key], halfwin)[0])
+                    else:
+                        ubc[key], ubc_doys[t][key] = \
+                            uf.get_upper_bound_climatology(
+                            data_list[i], doys_[t][key], halfwin)
+                    assert not np.any(np.isnan(ubc[key])), \
+                        f'{msg} {i} in {key}'
+                    uf.scale_by_upper_bound_climatology(data_list[i],
+                        ubc[key], doys_[t][key], ubc_doys[t][key],
+                        True, calendar_plan[t]['ubc'][key])
     
-            # prepare scaling of result
-            ubc_result[i] = uf.ccs_transfer_sim2obs_upper_bound_climatology(
-                ubc['obs_hist'], ubc['sim_hist'], ubc['sim_fut'])
-
-    # compute mean value over all time steps for invalid value sampling
-    long_term_mean = {}
-    for key, data_list in data.items():
-        long_term_mean[key] = [uf.average_valid_values(d, if_all_invalid_use[i],
-            lower_bound[i], lower_threshold[i],
-            upper_bound[i], upper_threshold[i])
-            for i, d in enumerate(data_list)]
-
-    # do local bias adjustment
+                # prepare scaling of result
+                ubc_result[t][i] = uf.load_or_compute_statistic(
+                    upper_bound_climatologies[t][i]
+                    if upper_bound_climatologies else None, 'sim_fut_ba',
+                    i_locations,
+                    lambda: uf.ccs_transfer_sim2obs_upper_bound_climatology(
+                    ubc['obs_hist'], ubc['sim_hist'], ubc['sim_fut']))
+
+    # compute mean value over all time steps for invalid value sampling, using
+    # the store of obs_hist statistics if available
+    long_term_mean = [{} for t in range(n_targets)]
+    for t in targets:
+        for key, data_list in data[t].items():
+            if t != targets[0] and key != 'sim_fut':
+                long_term_mean[t][key] = long_term_mean[targets[0]][key]
+                continue
+            long_term_mean[t][key] = []
+            for i, d in enumerate(data_list):
+                store = obs_hist_statistics[i] \
+                    if key == 'obs_hist' and obs_hist_statistics else None
+                long_term_mean[t][key].append(uf.load_or_compute_statistic(
+                    store, 'long_term_mean', i_locations,
+                    partial(uf.average_valid_values, d, if_all_invalid_use[i],
+                    lower_bound[i], lower_threshold[i],
+                    upper_bound[i], upper_threshold[i])))
+
+    # do local bias adjustment, target by target within every window or
+    # month, such that the historical data of a window or month only have to
+    # be prepared once
     if step_size:
         # do bias adjustment in running-window mode
         data_this_window = {
@@ -543,35 +914,69 @@ def adjust_bias_one_location(
         'sim_fut': None_list.copy()
         }
         years_this_window = {}
-        for window_center in window_centers:
-            # extract data for 31-day wide window around window_center
-            for key, data_list in data.items():
-                m = uf.window_indices_for_running_bias_adjustment(
-                    doys[key], window_center, 31)
-                years_this_window[key] = years[key][m]
-                for i in range(n_variables):
-                    data_this_window[key][i] = data_list[i][m]
-    
-            # adjust biases and store result as list of masked arrays
-            result_this_window = adjust_bias_one_month(
-                data_this_window, years_this_window, long_term_mean,
-                lower_bound, lower_threshold,
-                upper_bound, upper_threshold, **kwargs)
-    
-            # put central part of bias-adjusted data into result
-            m_ba = uf.window_indices_for_running_bias_adjustment(
-                doys['sim_fut'], window_center, 31)
-            m_keep = uf.window_indices_for_running_bias_adjustment(
-                doys['sim_fut'], window_center, step_size, years['sim_fut'])
-            m_ba_keep = np.in1d(m_ba, m_keep)
-            for i, halfwin in enumerate(halfwin_upper_bound_climatology):
-                # scale from values in [0, 1]
-                if halfwin:
-                   uf.scale_by_upper_bound_climatology(
-                       result_this_window[i], ubc_result[i],
-                       doys['sim_fut'][m_ba], ubc_doys['sim_fut'], divide=False)
-    
-                result[i][m_keep] = result_this_window[i][m_ba_keep]
+
+        # keep sorted copies of the data of every window of a single location
+        # and update these incrementally from window to window, for time
+        # series without invalid values, where obs_hist and sim_hist are
+        # shared by all targets
+        sorted_samples = [None] * n_targets
+        if n_locations == 1:
+            for t in targets:
+                sorted_samples[t] = {}
+                for key, data_list in data[t].items():
+                    if t != targets[0] and key != 'sim_fut':
+                        sorted_samples[t][key] = \
+                            sorted_samples[targets[0]][key]
+                    elif calendar_plan[t]['enter'][key] is None:
+                        sorted_samples[t][key] = None_list.copy()
+                    else:
+                        sorted_samples[t][key] = [np.empty(0, d.dtype)
+                            if not np.ma.is_masked(d)
+                            and np.all(np.isfinite(d)) else None
+                            for d in data_list]
+
+        for k in range(len(window_centers)):
+            hist_prepared = {}
+            for t in targets:
+                # extract data for 31-day wide window around window center
+                plan = calendar_plan[t]
+                for key, data_list in data[t].items():
+                    m = plan['extract'][key][k]
+                    years_this_window[key] = years_[t][key][m]
+                    for i in range(n_variables):
+                        data_this_window[key][i] = data_list[i][m]
+                    if sorted_samples[t] is None or \
+                        t != targets[0] and key != 'sim_fut':
+                        continue
+                    for i, b in enumerate(sorted_samples[t][key]):
+                        if b is not None:
+                            d = np.ma.getdata(data_list[i])
+                            sorted_samples[t][key][i] = uf.update_sorted_sample(
+                                b, d[plan['leave'][key][k]],
+                                d[plan['enter'][key][k]])
+        
+                # adjust biases and store result as list of masked arrays
+                result_this_window = adjust_bias_one_month(
+                    data_this_window, years_this_window, long_term_mean[t],
+                    lower_bound, lower_threshold,
+                    upper_bound, upper_threshold,
+                    hist_prepared=hist_prepared,
+                    sorted_samples=sorted_samples[t], **kwargs)
+        
+                # put central part of bias-adjusted data into result
+                m_ba = plan['extract']['sim_fut'][k]
+                m_keep = plan['keep'][k]
+                m_ba_keep = plan['ba_keep'][k]
+                for i, halfwin in enumerate(halfwin_upper_bound_climatology):
+                    # scale from values in [0, 1]
+                    if halfwin:
+                       uf.scale_by_upper_bound_climatology(
+                           result_this_window[i], ubc_result[t][i],
+                           doys_[t]['sim_fut'][m_ba],
+                           ubc_doys[t]['sim_fut'], False,
+                           plan['ubc']['sim_fut'][m_ba])
+        
+                    result[t][i][m_keep] = result_this_window[i][m_ba_keep]
     else:
         # do bias adjustment calendar month by calendar month
         data_this_month = {
@@ -580,55 +985,110 @@ def adjust_bias_one_location(
         'sim_fut': None_list.copy()
         }
         years_this_month = {}
-        for month in months:
-            # extract data
-            for key, data_list in data.items():
-                m = month_numbers[key] == month
-                assert np.any(m), f'no data found for month {month} in {key}'
-                y = years[key]
-                years_this_month[key] = None if y is None else y[m]
-                for i in range(n_variables):
-                    data_this_month[key][i] = data_list[i][m]
-    
-            # adjust biases and store result as list of masked arrays
-            result_this_month = adjust_bias_one_month(
-                data_this_month, years_this_month, long_term_mean,
-                lower_bound, lower_threshold,
-                upper_bound, upper_threshold, **kwargs)
-    
-            # put bias-adjusted data into result
-            m = month_numbers['sim_fut'] == month
-            for i, halfwin in enumerate(halfwin_upper_bound_climatology):
-                # scale from values in [0, 1]
-                if halfwin:
-                   uf.scale_by_upper_bound_climatology(
-                       result_this_month[i], ubc_result[i],
-                       doys['sim_fut'][m], ubc_doys['sim_fut'], divide=False)
-    
-                result[i][m] = result_this_month[i]
+        for k in range(len(months)):
+            hist_prepared = {}
+            for t in targets:
+                # extract data
+                plan = calendar_plan[t]
+                for key, data_list in data[t].items():
+                    m = plan['extract'][key][k]
+                    y = years_[t][key]
+                    years_this_month[key] = None if y is None else y[m]
+                    for i in range(n_variables):
+                        data_this_month[key][i] = data_list[i][m]
+        
+                # adjust biases and store result as list of masked arrays
+                result_this_month = adjust_bias_one_month(
+                    data_this_month, years_this_month, long_term_mean[t],
+                    lower_bound, lower_threshold,
+                    upper_bound, upper_threshold,
+                    hist_prepared=hist_prepared, **kwargs)
+        
+                # put bias-adjusted data into result
+                m = plan['extract']['sim_fut'][k]
+                for i, halfwin in enumerate(halfwin_upper_bound_climatology):
+                    # scale from values in [0, 1]
+                    if halfwin:
+                       uf.scale_by_upper_bound_climatology(
+                           result_this_month[i], ubc_result[t][i],
+                           doys_[t]['sim_fut'][m], ubc_doys[t]['sim_fut'],
+                           False, plan['ubc']['sim_fut'][m])
+        
+                    result[t][i][m] = result_this_month[i]
+    # set results of skipped targets to missing values
+    for t in range(n_targets):
+        if t not in targets:
+            result[t] = [np.ma.masked_all(r.shape, r.dtype)
+                for r in result[t]]
+    result = [r for result_t in result for r in result_t]
     
-    # save local result of bias adjustment variable by variable
-    for i, v in enumerate(variable):
-        if sim_fut_ba:
-            sim_fut_ba[i][v][i_loc] = result[i]
-            sim_fut_ba[i].sync()
-        else:
-            from_pool_queue.put(('sim_fut_ba', i, v,
-                i_loc, result[i], i_process))
-            # wait for response to ensure that the local result has been saved
-            x = to_pool_queues[i_process].get()
+    # save local results of bias adjustment
+    if n_locations == 1:
+        save_one_location(i_locations[0], variable * n_targets,
+            result)
+    else:
+        for k, i_loc in enumerate(i_locations):
+            save_one_location(i_loc, variable * n_targets,
+                [r[:,k] for r in result])
 
     return None
 
 
 
+def save_one_location(i_loc, variable, result):
+    """
+    Saves local result of bias adjustment, either directly or via the process
+    dedicated to I/O operations. In the latter case, the result is put into
+    one of the result regions of the shared memory slot of this process and
+    submitted without waiting for it to be saved, unless all result regions
+    are still in use, i.e., unless the maximum number of results in flight has
+    been reached.
+
+    Parameters
+    ----------
+    i_loc : tuple
+        Location index.
+    variable : list of strs
+        Names of variables to be bias-adjusted in netcdf files.
+    result : list of arrays or None
+        Result of bias adjustment, one array per variable and target. None
+        indicates that there is no result because the location has been skipped.
+
+    """
+    if sim_fut_ba:
+        nc_variables = [d[v] for d, v in zip(sim_fut_ba, variable)]
+        completed = []
+        if uf.write_via_tile_buffer(nc_variables, i_loc, result,
+            tile_buffer, output_flush_policy, completed):
+            for d in sim_fut_ba: d.sync()
+        uf.append_to_journal(journal, completed)
+    else:
+        # wait for a free result region, regions are used in turn
+        result_semaphores[worker.i_process].acquire()
+        j = worker.n_results_submitted % n_result_regions
+        worker.n_results_submitted += 1
+        if result is not None:
+            result = [uf.put_into_shared_slot(shared_slots[worker.i_process],
+                shared_regions['sim_fut_ba', i, j], x)
+                for i, x in enumerate(result)]
+        from_pool_queue.put(('sim_fut_ba', i_loc, result, worker.i_process, j))
+
+
+
 def load_or_save_one_location(
-        obs_hist_path, sim_hist_path, sim_fut_path, sim_fut_ba_path):
+        obs_hist_path, sim_hist_path, sim_fut_path, sim_fut_ba_path,
+        variable, flush_policy='tile', chunk_cache_size=0,
+        done=None, skipped=None, journal_path=None):
     """
     Gets items from from_pool_queue, then either loads the requested data from
-    one of the input netcdf files and puts that data to the to_pool_queue used
-    by the requesting process or saves the data transmitted via from_pool_queue
-    to the output netcdf file.
+    one of the input netcdf files and puts that data to the shared memory slot
+    of the requesting process or saves the data found in the shared memory slot
+    of the process that sent the item to the output netcdf file. Only small
+    descriptors of these data are transmitted via the queues. Input data are
+    loaded tile by tile, where tiles are aligned with the chunks of the input
+    netcdf files, and kept in memory until all locations of a tile have been
+    served. Output data are written according to flush_policy. Locations are
+    recorded in the journal once their output data have been written.
 
     Parameters
     ----------
@@ -637,38 +1097,349 @@ def load_or_save_one_location(
     sim_hist_path : list of strs
         Paths to input netcdf files with historical simulations.
     sim_fut_path : list of strs
-        Paths to input netcdf files with future simulations.
+        Paths to input netcdf files with future simulations, the paths of all
+        variables of one target after the other.
     sim_fut_ba_path : list of strs
-        Paths to output netcdf files with bias-adjusted future simulations.
+        Paths to output netcdf files with bias-adjusted future simulations,
+        ordered like sim_fut_path.
+    variable : list of strs
+        Names of variables to be bias-adjusted in netcdf files.
+    flush_policy : str, optional
+        When to write bias adjustment results to the output netcdf files:
+        ['location', 'tile'].
+    chunk_cache_size : int, optional
+        Size of chunk cache per input variable in bytes. If 0 then the default
+        chunk cache size is used.
+    done : ndarray of booleans, optional
+        Marks locations that are already complete and will not be processed.
+    skipped : ndarray of booleans, optional
+        Marks locations that will not be processed due to missing data.
+    journal_path : str, optional
+        Path to journal of completed locations.
 
     """
     obs_hist, sim_hist, sim_fut, sim_fut_ba = [], [], [], []
+    tile_caches = defaultdict(OrderedDict)
+    tile_buffer = {}
+    ccs = chunk_cache_size
     with ExitStack() as stack:
-        for a, b, c, d in zip(
-            obs_hist_path, sim_hist_path, sim_fut_path, sim_fut_ba_path):
-            obs_hist.append(stack.enter_context(Dataset(a, 'r')))
-            sim_hist.append(stack.enter_context(Dataset(b, 'r')))
-            sim_fut.append(stack.enter_context(Dataset(c, 'r')))
+        for a, b, v in zip(obs_hist_path, sim_hist_path, variable):
+            obs_hist.append(stack.enter_context(uf.open_input_nc(a, v, ccs)))
+            sim_hist.append(stack.enter_context(uf.open_input_nc(b, v, ccs)))
+        for c, d, v in zip(sim_fut_path, sim_fut_ba_path, cycle(variable)):
+            sim_fut.append(stack.enter_context(uf.open_input_nc(c, v, ccs)))
             sim_fut_ba.append(stack.enter_context(Dataset(d, 'r+')))
+        nc_variables = [d[v] for d, v in zip(sim_fut_ba, cycle(variable))]
+        if flush_policy == 'tile':
+            uf.prefill_tile_buffer(nc_variables, tile_buffer, done, skipped)
+        journal = None if journal_path is None else \
+            stack.enter_context(uf.open_journal(journal_path))
         while True:
             item = from_pool_queue.get()
             if item is None:
                 break
             elif item[0] == 'sim_fut_ba':
-                dataset = sim_fut_ba[item[1]]
-                dataset[item[2]][item[3]] = item[4]
-                dataset.sync()
-                to_pool_queues[item[5]].put('synced')
+                values = item[2]
+                if values is not None:
+                    values = [uf.get_from_shared_slot(shared_slots[item[3]],
+                        shared_regions['sim_fut_ba', i, item[4]], descriptor)
+                        for i, descriptor in enumerate(values)]
+                completed = []
+                if uf.write_via_tile_buffer(nc_variables,
+                    item[1], values, tile_buffer, flush_policy, completed):
+                    for d in sim_fut_ba: d.sync()
+                uf.append_to_journal(journal, completed)
+                # free result region for reuse by the submitting process
+                result_semaphores[item[3]].release()
             else:
                 dataset = eval(item[0])[item[1]]
-                x = dataset[item[2]][item[3]]
-                to_pool_queues[item[4]].put(x)
+                x = uf.load_via_tile_cache(dataset[item[2]], item[3],
+                    tile_caches[item[0], item[1]])
+                to_pool_queues[item[4]].put(uf.put_into_shared_slot(
+                    shared_slots[item[4]], shared_regions[item[0], item[1]], x))
+        if uf.flush_tile_buffer(nc_variables, tile_buffer):
+            for d in sim_fut_ba: d.sync()
+
+
+
+def check_or_store_calendar(calendar, key, t, c, msg):
+    """
+    Stores the calendar c of dataset key of target t in calendar unless a
+    calendar has already been stored there, in which case the stored calendar
+    has to match c.
+
+    Parameters
+    ----------
+    calendar : dict of str : array or list of arrays
+        Keys : 'obs_hist', 'sim_hist', 'sim_fut'.
+        Values : calendars of datasets. One calendar per target for 'sim_fut'.
+        Is changed in-place.
+    key : str
+        Dataset the calendar c belongs to.
+    t : int
+        Target the calendar c belongs to. Only used if key is 'sim_fut'.
+    c : array
+        Calendar, e.g., month numbers of all time steps.
+    msg : str
+        Message of the assertion error raised if the stored calendar does not
+        match c.
+
+    """
+    if key == 'sim_fut':
+        targets = calendar.setdefault(key, [])
+        if t < len(targets): assert np.all(targets[t] == c), msg
+        else: targets.append(c)
+    elif key in calendar:
+        assert np.all(calendar[key] == c), msg
+    else:
+        calendar[key] = c
+
+
+
+def data_of_target(data, t, n_variables):
+    """
+    Returns the data of all datasets of target t.
+
+    Parameters
+    ----------
+    data : dict of str : list
+        Keys : 'obs_hist', 'sim_hist', 'sim_fut'.
+        Values : one item per variable. For 'sim_fut', one item per variable
+        and target, with the items of all variables of one target listed
+        before those of the next target.
+    t : int
+        Target.
+    n_variables : int
+        Number of variables.
+
+    Returns
+    -------
+    data_t : dict of str : list
+        Keys : 'obs_hist', 'sim_hist', 'sim_fut'.
+        Values : one item per variable of target t.
+
+    """
+    return {key: d[t * n_variables:(t + 1) * n_variables]
+        if key == 'sim_fut' else d for key, d in data.items()}
+
+
+
+def calendar_of_target(calendar, t):
+    """
+    Returns the calendars of all datasets of target t.
+
+    Parameters
+    ----------
+    calendar : dict of str : array or list of arrays
+        Keys : 'obs_hist', 'sim_hist', 'sim_fut'.
+        Values : calendars of datasets. One calendar per target for 'sim_fut'.
+    t : int
+        Target.
+
+    Returns
+    -------
+    calendar_t : dict of str : array
+        Keys : 'obs_hist', 'sim_hist', 'sim_fut'.
+        Values : calendars of datasets of target t.
+
+    """
+    return {key: c[t] if key == 'sim_fut' else c
+        for key, c in calendar.items()}
+
+
+
+def get_calendar_plan(step_size, window_centers, months):
+    """
+    Returns the indices used to select the data of every running window or
+    calendar month from the time series of all datasets of every target. These
+    only depend on the time axes and are hence computed once for all
+    locations.
+
+    Parameters
+    ----------
+    step_size: int
+        Step size in number of days used for bias adjustment in running-window
+        mode. If 0 then bias adjustment is done calendar month by calendar
+        month.
+    window_centers : array
+        Window centers for bias adjustment in running-window mode. In
+        day-of-year units.
+    months : list of ints
+        List of ints from {1,...,12} representing calendar months for which 
+        bias adjustment is done if not in running-window mode.
+
+    Returns
+    -------
+    plan : list of dicts
+        One dict per target. Key 'extract' maps every dataset to a list of
+        index arrays, one per running window or calendar month. In
+        running-window mode, key 'keep' holds the indices of the time steps of
+        sim_fut whose bias-adjusted values are kept for every running window,
+        and key 'ba_keep' holds the corresponding boolean masks of the time
+        steps of the running window, and keys 'enter' and 'leave' map every
+        dataset to lists of the indices of the time steps that enter and leave
+        every running window relative to the previous one, or to None if
+        running windows contain time steps more than once. Key 'ubc' maps
+        every dataset to the indices of the upper bound climatology
+        corresponding to its time steps if days of the year are available.
+
+    """
+    plan = []
+    calendar = doys if step_size else month_numbers
+    for t in range(len(calendar['sim_fut'])):
+        doys_t = calendar_of_target(doys, t)
+        plan_t = {'extract': {}}
+        if step_size:
+            years_t = calendar_of_target(years, t)
+            for key, d in doys_t.items():
+                plan_t['extract'][key] = [
+                    uf.window_indices_for_running_bias_adjustment(d, c, 31)
+                    for c in window_centers]
+            plan_t['keep'] = [uf.window_indices_for_running_bias_adjustment(
+                doys_t['sim_fut'], c, step_size, years_t['sim_fut'])
+                for c in window_centers]
+            plan_t['ba_keep'] = [np.isin(m_ba, m_keep) for m_ba, m_keep
+                in zip(plan_t['extract']['sim_fut'], plan_t['keep'])]
+            plan_t['enter'], plan_t['leave'] = {}, {}
+            for key, extract in plan_t['extract'].items():
+                if any(np.unique(m).size < m.size for m in extract):
+                    plan_t['enter'][key] = plan_t['leave'][key] = None
+                    continue
+                previous = [np.empty(0, dtype=int)] + extract[:-1]
+                plan_t['enter'][key] = [np.setdiff1d(m, m_previous, True)
+                    for m, m_previous in zip(extract, previous)]
+                plan_t['leave'][key] = [np.setdiff1d(m_previous, m, True)
+                    for m, m_previous in zip(extract, previous)]
+        else:
+            for key, m in calendar_of_target(month_numbers, t).items():
+                plan_t['extract'][key] = uf.get_month_indices(m, months, key)
+        plan_t['ubc'] = {key: uf.get_upper_bound_climatology_indices(d)
+            for key, d in doys_t.items()}
+        plan.append(plan_t)
+    return plan
+
+
+
+def get_tile_shape(paths, variable, space_shape):
+    """
+    Returns the shape of the smallest tiles that consist of complete chunks of
+    all given netcdf files.
+
+    Parameters
+    ----------
+    paths : list of lists of strs
+        Paths to netcdf files, one list per dataset with one path per
+        variable.
+    variable : list of strs
+        Names of variables in netcdf files.
+    space_shape : tuple
+        Describes the spatial dimensions of the climate data.
+
+    Returns
+    -------
+    tile_shape : tuple of ints
+        Common tile shape.
+
+    """
+    tile_shapes = []
+    for paths_ in paths:
+        for path, v in zip(paths_, cycle(variable)):
+            with Dataset(path, 'r') as dataset:
+                tile_shapes.append(uf.spatial_chunk_shape(dataset[v]))
+    return uf.common_tile_shape(tile_shapes, space_shape)
+
+
+
+def get_upper_bound_climatologies(
+        obs_hist_path, sim_hist_path, sim_fut_path, variable,
+        halfwin_upper_bound_climatology, space_shape, tile_shape,
+        skipped=None, chunk_cache_size=0):
+    """
+    Computes the upper bound climatologies of obs_hist, sim_hist and sim_fut
+    and the results of their climate change signal transfer for all locations
+    of the grid, tile by tile, such that they only need to be looked up during
+    the adjustment of every location. Locations with missing values, infs or
+    nans and locations of tiles that are skipped entirely get nans, which
+    makes adjust_bias_batch compute their upper bound climatologies itself.
+
+    Parameters
+    ----------
+    obs_hist_path : list of strs
+        Paths to input netcdf files with historical observations.
+    sim_hist_path : list of strs
+        Paths to input netcdf files with historical simulations.
+    sim_fut_path : list of strs
+        Paths to input netcdf files with future simulations, the paths of all
+        variables of one target after the other.
+    variable : list of strs
+        Names of variables in netcdf files.
+    halfwin_upper_bound_climatology : list of ints
+        Determines the lengths of running windows used in the calculations of
+        upper bound climatologies. No upper bound climatologies are computed
+        for variables with halfwin_upper_bound_climatology == 0.
+    space_shape : tuple
+        Describes the spatial dimensions of the climate data.
+    tile_shape : tuple of ints
+        Shape of the tiles in which input data are loaded.
+    skipped : ndarray of booleans, optional
+        Marks locations that will not be adjusted.
+    chunk_cache_size : int, optional
+        Size of chunk cache per input variable in bytes. If 0 then the default
+        chunk cache size is used.
+
+    Returns
+    -------
+    ubc : list of lists of dicts of str : ndarray or None
+        Upper bound climatologies by target and variable, or None for
+        variables without upper bound climatology. Keys : 'obs_hist',
+        'sim_hist', 'sim_fut', 'sim_fut_ba'. Values : arrays with the spatial
+        dimensions first and the days of the year last, where those of
+        'obs_hist' and 'sim_hist' are shared by all targets.
+
+    """
+    n_variables = len(variable)
+    n_targets = len(sim_fut_path) // n_variables
+    n_tiles = tuple(-(-n // t) for n, t in zip(space_shape, tile_shape))
+    ubc = [[None] * n_variables for t in range(n_targets)]
+    for i, halfwin in enumerate(halfwin_upper_bound_climatology):
+        if not halfwin:
+            continue
+        ubc_i = {}
+        for key, t, path in [('obs_hist', 0, obs_hist_path[i]),
+            ('sim_hist', 0, sim_hist_path[i])] + [('sim_fut', t, sim_fut_path[
+            t * n_variables + i]) for t in range(n_targets)]:
+            d = calendar_of_target(doys, t)[key]
+            x = np.full(space_shape + np.unique(d).shape, np.nan)
+            with uf.open_input_nc(path, variable[i], chunk_cache_size) as ds:
+                for k in np.ndindex(n_tiles):
+                    tile = uf.tile_slices(tuple(s * j
+                        for s, j in zip(tile_shape, k)), space_shape,
+                        tile_shape)
+                    if skipped is not None and np.all(skipped[tile]):
+                        continue
+                    # move the time axis to the front and back again
+                    y = np.moveaxis(uf.ma2a(ds[variable[i]][tile]), -1, 0)
+                    x[tile] = np.moveaxis(uf.get_upper_bound_climatology(
+                        y, d, halfwin)[0], 0, -1)
+            ubc_i[key, t] = x
+        for t in range(n_targets):
+            u = {key: ubc_i[key, t if key == 'sim_fut' else 0]
+                for key in ('obs_hist', 'sim_hist', 'sim_fut')}
+            u['sim_fut_ba'] = uf.ccs_transfer_sim2obs_upper_bound_climatology(
+                u['obs_hist'], u['sim_hist'], u['sim_fut'])
+            ubc[t][i] = u
+    return ubc
 
 
 
 def adjust_bias(
         obs_hist_path, sim_hist_path, sim_fut_path, sim_fut_ba_path,
-        space_shape, n_processes=1, **kwargs):
+        space_shape, n_processes=1, flush_policy='tile', read_mode='central',
+        max_results_in_flight=2, location_order='chunk', chunk_cache_size=0,
+        journal_path=None, resume_job=False, validity_mask_time_steps=0,
+        batch_size=1, i_shard=0, n_shards=1, worker_type='process',
+        obs_hist_statistics_path=None,
+        precompute_upper_bound_climatology=False, **kwargs):
     """
     Adjusts biases grid cell by grid cell.
 
@@ -679,53 +1450,287 @@ def adjust_bias(
     sim_hist_path : list of strs
         Paths to input netcdf files with historical simulations.
     sim_fut_path : list of strs
-        Paths to input netcdf files with future simulations.
+        Paths to input netcdf files with future simulations, the paths of all
+        variables of one target after the other.
     sim_fut_ba_path : list of strs
-        Paths to output netcdf files with bias-adjusted future simulations.
+        Paths to output netcdf files with bias-adjusted future simulations,
+        ordered like sim_fut_path.
     space_shape : tuple
         Describes the spatial dimensions of the climate data.
     n_processes : int, optional
         Number of processes used for parallel processing.
+    flush_policy : str, optional
+        When to write bias adjustment results to the output netcdf files:
+        ['location', 'tile'].
+    read_mode : str, optional
+        How worker processes access the input netcdf files: ['central',
+        'direct']. If 'central' then all input data are loaded by the process
+        dedicated to I/O operations. If 'direct' then every worker process
+        opens its own read-only handles of the input netcdf files and loads
+        its input data itself, location by location. Results are always saved
+        by the process dedicated to I/O operations.
+    max_results_in_flight : int, optional
+        Maximum number of results per worker process that have been submitted
+        to but not yet saved by the process dedicated to I/O operations.
+    location_order : str, optional
+        Order in which locations are processed: ['chunk', 'cost', 'index'].
+        If 'chunk' then locations are processed tile by tile, where tiles
+        consist of complete chunks of all input and output netcdf files. If
+        'cost' then tiles are processed in descending order of their total
+        processing time in a previous application, and the locations of every
+        tile in descending order of their processing times. If 'index' then
+        locations are processed in the order of their indices.
+    chunk_cache_size : int, optional
+        Size of chunk cache per input variable and file handle in bytes. If 0
+        then the default chunk cache size is used.
+    journal_path : str, optional
+        Path to journal of completed locations. If not specified then no
+        journal is kept.
+    resume_job : boolean, optional
+        Whether to resume an interrupted application by processing only those
+        locations that have not been recorded as completed in the journal.
+    validity_mask_time_steps : int, optional
+        If positive then locations where all variables of at least one input
+        dataset have only missing values at this number of time steps, sampled
+        evenly from the whole time series, are skipped without loading their
+        data. This assumes that missing values do not vary with time.
+    batch_size : int, optional
+        Number of locations that are adjusted together, using arrays with one
+        column per location, and that form one task in multiprocessing
+        applications. Tasks are completed in arbitrary order.
+    i_shard : int, optional
+        Index of the shard of locations to be adjusted. Only locations in the
+        chunk-aligned tiles assigned to this shard are adjusted.
+    n_shards : int, optional
+        Number of shards the grid is split into.
+    worker_type : str, optional
+        What the n_processes - 1 workers of a multiprocessing application are:
+        ['process', 'thread']. If 'thread' then the workers and the worker
+        dedicated to I/O operations are threads of this process, which share
+        its memory. This requires read_mode 'central'.
+    obs_hist_statistics_path : str, optional
+        Path to directory of a store of statistics of obs_hist, namely long-term
+        mean values and upper bound climatologies, which are shared by all
+        applications with the same historical observations and options. Stored
+        statistics are used instead of being computed again, missing ones are
+        computed and stored. If not specified then no store is used.
+    precompute_upper_bound_climatology : boolean, optional
+        Whether to compute the upper bound climatologies of all locations
+        before the adjustment of the first location, where they are then only
+        looked up. This takes precedence over the store of obs_hist
+        statistics.
 
     Other Parameters
     ----------------
-    **kwargs : Passed on to adjust_bias_one_location.
+    **kwargs : Passed on to adjust_bias_batch.
 
     """
     # adjust every location individually
-    global from_pool_queue, to_pool_queues
-    global obs_hist, sim_hist, sim_fut, sim_fut_ba
-    i_locations = np.ndindex(space_shape)
-    abol = partial(adjust_bias_one_location, **kwargs)
+    global from_pool_queue, to_pool_queues, tile_caches
+    global tile_buffer, output_flush_policy, shared_slots, shared_regions
+    global result_semaphores, n_result_regions, journal
+    global obs_hist, sim_hist, sim_fut, sim_fut_ba, obs_hist_statistics
+    global upper_bound_climatologies
+    tile_shape = get_tile_shape((obs_hist_path, sim_hist_path, sim_fut_path,
+        sim_fut_ba_path), kwargs['variable'], space_shape)
+    cost_path = uf.get_cost_path(sim_fut_ba_path[0])
+    if location_order == 'cost':
+        # estimate costs by processing times of a previous application
+        cost = uf.read_cost(cost_path, space_shape)
+        if cost is None:
+            print('found no processing times of a previous application, '
+                'processing locations tile by tile')
+            location_order = 'chunk'
+    if location_order == 'chunk':
+        i_locations = uf.locations_tile_by_tile(space_shape, tile_shape)
+    elif location_order == 'cost':
+        i_locations = uf.locations_by_cost(space_shape, tile_shape, cost)
+    else:
+        i_locations = np.ndindex(space_shape)
+
+    # skip locations in tiles assigned to other shards
+    skipped = None
+    if n_shards > 1:
+        skipped = np.logical_not(uf.shard_mask(
+            space_shape, tile_shape, i_shard, n_shards))
+        print(f'processing shard {i_shard} of {n_shards} with '
+            f'{skipped.size - np.sum(skipped)} of {skipped.size} locations')
+        i_locations = (i for i in i_locations if not skipped[i])
+
+    # skip locations recorded as completed in the journal
+    done = None
+    if journal_path is not None:
+        if resume_job:
+            done = uf.read_journal(journal_path, space_shape)
+            print(f'resuming job with {np.sum(done)} of {done.size} '
+                'locations already completed')
+            i_locations = (i for i in i_locations if not done[i])
+        else:
+            open(journal_path, 'w').close()
+
+    # skip locations with only missing values in obs_hist or sim_hist or in
+    # sim_fut of all targets, targets with only missing values in sim_fut
+    # are skipped by adjust_bias_batch
+    if validity_mask_time_steps:
+        invalid = np.zeros(space_shape, dtype=bool)
+        invalid_sim_fut = np.ones(space_shape, dtype=bool)
+        n_variables = len(kwargs['variable'])
+        for k, paths in enumerate([obs_hist_path, sim_hist_path] + [
+            sim_fut_path[i:i+n_variables]
+            for i in range(0, len(sim_fut_path), n_variables)]):
+            valid = np.zeros(space_shape, dtype=bool)
+            for path, v in zip(paths, kwargs['variable']):
+                with Dataset(path, 'r') as dataset:
+                    valid |= uf.sample_validity(
+                        dataset[v], validity_mask_time_steps)
+            if k < 2:
+                invalid |= np.logical_not(valid)
+            else:
+                invalid_sim_fut &= np.logical_not(valid)
+        invalid |= invalid_sim_fut
+        print(f'skipping {np.sum(invalid)} of {invalid.size} locations due '
+            'to missing data')
+        i_locations = (i for i in i_locations if not invalid[i])
+        # record these locations as completed such that merge_shards can tell
+        # complete from incomplete shards
+        if journal_path is not None:
+            with uf.open_journal(journal_path) as f:
+                uf.append_to_journal(f, list(uf.blocks_of_mask(invalid
+                    if skipped is None else invalid & ~skipped, tile_shape)))
+        skipped = invalid if skipped is None else skipped | invalid
+
+    # memory-map the store of obs_hist statistics, one per variable, keyed by
+    # obs_hist input file and all options the statistics depend on
+    obs_hist_statistics = None
+    if obs_hist_statistics_path:
+        obs_hist_statistics = []
+        for i, (path, v) in enumerate(zip(obs_hist_path, kwargs['variable'])):
+            options = {key: kwargs[key][i] for key in ('if_all_invalid_use',
+                'lower_bound', 'lower_threshold', 'upper_bound',
+                'upper_threshold', 'halfwin_upper_bound_climatology')}
+            fields = {'long_term_mean': ()}
+            if options['halfwin_upper_bound_climatology']:
+                fields['upper_bound_climatology'] = \
+                    np.unique(doys['obs_hist']).shape
+            obs_hist_statistics.append(uf.open_statistics_store(
+                obs_hist_statistics_path,
+                uf.get_statistics_key(path, variable=v, **options),
+                space_shape, fields))
+
+    # compute upper bound climatologies for all locations at once
+    upper_bound_climatologies = None
+    if precompute_upper_bound_climatology and \
+        any(kwargs.get('halfwin_upper_bound_climatology', [0])):
+        print('computing upper bound climatologies ...')
+        upper_bound_climatologies = get_upper_bound_climatologies(
+            obs_hist_path, sim_hist_path, sim_fut_path, kwargs['variable'],
+            kwargs['halfwin_upper_bound_climatology'], space_shape,
+            tile_shape, done if skipped is None else skipped if done is None
+            else skipped | done, chunk_cache_size)
+
+    # record processing times for cost estimates in later applications, where
+    # nan marks unknown processing times, e.g., of locations completed before
+    # an interruption, and locations skipped due to missing data take no time
+    times = uf.read_cost(cost_path, space_shape) if resume_job else None
+    if times is None: times = np.full(space_shape, np.nan, dtype=np.float32)
+    if validity_mask_time_steps: times[invalid] = 0
+    tabob = partial(uf.time_batch, partial(adjust_bias_batch, **kwargs))
+    ccs = chunk_cache_size
     if n_processes > 1:
-        from_pool_queue = mp.Queue()
-        to_pool_queues = [mp.Queue() for i in range(n_processes-1)]
+        # threads share the memory of this process but are otherwise used
+        # like processes
+        mpx = mp.dummy if worker_type == 'thread' else mp
+        from_pool_queue = mpx.Queue()
+        to_pool_queues = [mpx.Queue() for i in range(n_processes-1)]
         obs_hist, sim_hist, sim_fut, sim_fut_ba = None, None, None, None
-        reader_writer = mp.Process(target=load_or_save_one_location,
-            args=(obs_hist_path, sim_hist_path, sim_fut_path, sim_fut_ba_path))
+        # allocate one shared memory slot per worker with one region per
+        # variable and dataset for data exchange with reader_writer
+        region_sizes = {}
+        calendar = doys if kwargs.get('step_size') else month_numbers
+        n_variables = len(kwargs['variable'])
+        for i in range(len(sim_fut_path)):
+            sim_fut_size = calendar['sim_fut'][i // n_variables].size
+            if read_mode == 'central':
+                if i < n_variables:
+                    for key in ['obs_hist', 'sim_hist']:
+                        region_sizes[key, i] = calendar[key].size
+                region_sizes['sim_fut', i] = sim_fut_size
+            for j in range(max_results_in_flight):
+                region_sizes['sim_fut_ba', i, j] = sim_fut_size
+        shared_slots, shared_regions = uf.allocate_shared_slots(
+            n_processes - 1, region_sizes)
+        n_bytes = sum(len(s) for s in shared_slots)
+        print(f'allocated {n_bytes / 2**20:.1f} MiB of shared memory for '
+            'data exchange with the process dedicated to I/O operations')
+        # count free result regions per worker
+        n_result_regions = max_results_in_flight
+        result_semaphores = [mpx.Semaphore(max_results_in_flight)
+            for i in range(n_processes-1)]
+        reader_writer = mpx.Process(target=load_or_save_one_location,
+            args=(obs_hist_path, sim_hist_path, sim_fut_path, sim_fut_ba_path,
+            kwargs['variable'], flush_policy, chunk_cache_size,
+            done, skipped, journal_path))
         reader_writer.start()
-        with mp.Manager() as manager:
-            ipq = manager.Queue()
-            for i in range(n_processes-1):
-                ipq.put(i)
-            def initializer(q):
-                global i_process
-                i_process = q.get()
-            with mp.Pool(n_processes-1, initializer, (ipq,)) as pool:
-                foo = list(pool.imap(abol, i_locations))
-                from_pool_queue.put(None)
-                reader_writer.join()
+        ipq = mpx.Queue()
+        for i in range(n_processes-1):
+            ipq.put(i)
+        def initializer(q):
+            global tile_caches, obs_hist, sim_hist, sim_fut
+            worker.i_process = q.get()
+            worker.n_results_submitted = 0
+            if read_mode == 'direct':
+                # open read-only handles of input netcdf files that stay
+                # open for the lifetime of this worker process, and load
+                # locations individually since the locations of a tile are
+                # scattered over all workers, each of which would otherwise
+                # load and keep the whole tile
+                tile_caches = None
+                obs_hist, sim_hist, sim_fut = [
+                    [uf.open_input_nc(path, v, ccs)
+                    for path, v in zip(paths, cycle(kwargs['variable']))]
+                    for paths in (obs_hist_path, sim_hist_path,
+                    sim_fut_path)]
+        with mpx.Pool(n_processes-1, initializer, (ipq,)) as pool:
+            uf.record_cost(times, pool.imap_unordered(tabob,
+                uf.batches(i_locations, batch_size)))
+            # wait until all results in flight have been saved
+            for s in result_semaphores:
+                for j in range(max_results_in_flight):
+                    s.acquire()
+            from_pool_queue.put(None)
+            reader_writer.join()
     else:
         from_pool_queue, to_pool_queues = None, None
+        tile_caches = defaultdict(OrderedDict)
+        tile_buffer, output_flush_policy = {}, flush_policy
         obs_hist, sim_hist, sim_fut, sim_fut_ba = [], [], [], []
         with ExitStack() as stack:
-            for a, b, c, d in zip(
-                obs_hist_path, sim_hist_path, sim_fut_path, sim_fut_ba_path):
-                obs_hist.append(stack.enter_context(Dataset(a, 'r')))
-                sim_hist.append(stack.enter_context(Dataset(b, 'r')))
-                sim_fut.append(stack.enter_context(Dataset(c, 'r')))
+            for a, b, v in zip(obs_hist_path, sim_hist_path,
+                kwargs['variable']):
+                obs_hist.append(stack.enter_context(
+                    uf.open_input_nc(a, v, ccs)))
+                sim_hist.append(stack.enter_context(
+                    uf.open_input_nc(b, v, ccs)))
+            for c, d, v in zip(sim_fut_path, sim_fut_ba_path,
+                cycle(kwargs['variable'])):
+                sim_fut.append(stack.enter_context(
+                    uf.open_input_nc(c, v, ccs)))
                 sim_fut_ba.append(stack.enter_context(Dataset(d, 'r+')))
-            foo = list(map(abol, i_locations))
+            nc_variables = [d[v]
+                for d, v in zip(sim_fut_ba, cycle(kwargs['variable']))]
+            if flush_policy == 'tile':
+                uf.prefill_tile_buffer(
+                    nc_variables, tile_buffer, done, skipped)
+            journal = None if journal_path is None else \
+                stack.enter_context(uf.open_journal(journal_path))
+            uf.record_cost(times, map(tabob,
+                uf.batches(i_locations, batch_size)))
+            if uf.flush_tile_buffer(nc_variables, tile_buffer):
+                for d in sim_fut_ba: d.sync()
+    np.save(cost_path, times)
+    if obs_hist_statistics:
+        for store in obs_hist_statistics:
+            for x in store.values(): x.flush()
 
 
 
@@ -744,14 +1749,17 @@ def main():
         type='string', dest='sim_hist', default='',
         help=('comma-separated list of paths to input netcdf files with '
              'historical simulations (one file per variable)'))
-    parser.add_option('-f', '--sim-fut', action='store',
-        type='string', dest='sim_fut', default='',
+    parser.add_option('-f', '--sim-fut', action='append',
+        type='string', dest='sim_fut', default=[],
         help=('comma-separated list of paths to input netcdf files with '
-             'future simulations (one file per variable)'))
-    parser.add_option('-b', '--sim-fut-ba', action='store',
-        type='string', dest='sim_fut_ba', default='',
+             'future simulations (one file per variable), can be repeated '
+             'to adjust several targets that share the historical data in '
+             'one application'))
+    parser.add_option('-b', '--sim-fut-ba', action='append',
+        type='string', dest='sim_fut_ba', default=[],
         help=('comma-separated list of paths to output netcdf files with '
-             'bias-adjusted future simulations (one file per variable)'))
+             'bias-adjusted future simulations (one file per variable), '
+             'has to be repeated as often as -f'))
     parser.add_option('-v', '--variable', action='store',
         type='string', dest='variable', default='',
         help=('comma-separated list of names of variables in input '
@@ -852,6 +1860,95 @@ def main():
         help=('comma-separated list of flags to not allow for trends in '
               'relative frequencies of values below lower threshold and '
               'above upper threshold (default: do allow for such trends)'))
+    parser.add_option('--flush-policy', action='store',
+        type='string', dest='flush_policy', default='tile',
+        help=('when to write bias adjustment results to the output netcdf '
+              'files (default: tile, which means once all locations of a '
+              'chunk-aligned tile are complete, alternative: location)'))
+    parser.add_option('--read-mode', action='store',
+        type='string', dest='read_mode', default='central',
+        help=('how worker processes access the input netcdf files in '
+              'multiprocessing applications (default: central, which means '
+              'via the process dedicated to I/O operations, alternative: '
+              'direct, which means every worker process opens its own '
+              'read-only file handles and loads every location individually, '
+              'which relieves the process dedicated to I/O operations but '
+              'decompresses every chunk once per worker process or, if it '
+              'does not fit into the chunk cache, once per location)'))
+    parser.add_option('--max-results-in-flight', action='store',
+        type='int', dest='max_results_in_flight', default=2,
+        help=('maximum number of results per worker process that have been '
+              'submitted to but not yet saved by the process dedicated to '
+              'I/O operations in multiprocessing applications (default: 2)'))
+    parser.add_option('--location-order', action='store',
+        type='string', dest='location_order', default='chunk',
+        help=('order in which locations are processed (default: chunk, which '
+              'means tile by tile, where tiles consist of complete chunks of '
+              'all input and output netcdf files, alternatives: cost, which '
+              'means tile by tile in descending order of the processing times '
+              'recorded by a previous application next to the first output '
+              'netcdf file, and index)'))
+    parser.add_option('--chunk-cache-size', action='store',
+        type='int', dest='chunk_cache_size', default=0,
+        help=('size of chunk cache per input variable and file handle in '
+              'bytes (default: 0, which means that the default chunk cache '
+              'size of the netcdf library is used)'))
+    parser.add_option('--resume-job', action='store',
+        type='string', dest='resume_job', default='False',
+        help=('whether to resume an interrupted application by processing '
+              'only locations that have not been recorded as completed in the '
+              'journal kept next to the first output netcdf file (default: '
+              'False)'))
+    parser.add_option('--validity-mask-time-steps', action='store',
+        type='int', dest='validity_mask_time_steps', default=0,
+        help=('number of time steps, sampled evenly from the whole time '
+              'series, used to identify locations with only missing values '
+              'in at least one input dataset, which are then skipped without '
+              'loading their data, assuming that missing values do not vary '
+              'with time (default: 0, which means that no locations are '
+              'skipped this way)'))
+    parser.add_option('--batch-size', action='store',
+        type='int', dest='batch_size', default=1,
+        help=('number of locations that are adjusted together, using arrays '
+              'with one column per location, and that form one task in '
+              'multiprocessing applications, larger values reduce the '
+              'overhead per location at the cost of memory and coarser load '
+              'balancing (default: 1)'))
+    parser.add_option('--worker-type', action='store',
+        type='string', dest='worker_type', default='process',
+        help=('type of workers in multiprocessing applications (default: '
+              'process, alternative: thread, which means that all workers, '
+              'including the one dedicated to I/O operations, are threads of '
+              'one process that share its memory, which requires --read-mode '
+              'central)'))
+    parser.add_option('--shard', action='store',
+        type='string', dest='shard', default='0/1',
+        help=('shard i/n of an application split into n shards, e.g., the '
+              'tasks of a job array, which adjust disjoint sets of '
+              'chunk-aligned tiles of locations and write to part files next '
+              'to the output netcdf files, to be combined by --merge-shards '
+              '(default: 0/1, which means that all locations are adjusted '
+              'and written to the output netcdf files)'))
+    parser.add_option('--merge-shards', action='store_true',
+        dest='merge_shards', default=False,
+        help=('instead of adjusting biases, combine the part files written by '
+              'the n shards specified by --shard i/n into the output netcdf '
+              'files, for any i, after checking that the journals of all '
+              'shards record their tiles as completed (default: do not)'))
+    parser.add_option('--obs-hist-statistics-store', action='store',
+        type='string', dest='obs_hist_statistics_store', default='',
+        help=('directory of a store of long-term mean values and upper bound '
+              'climatologies of obs_hist, which are computed once and then '
+              'memory-mapped by all applications with the same obs_hist input '
+              'files and options (default: not specified, which means that '
+              'no store is used)'))
+    parser.add_option('--precompute-upper-bound-climatology',
+        action='store_true', dest='precompute_upper_bound_climatology',
+        default=False,
+        help=('compute the upper bound climatologies of all locations before '
+              'adjusting the first one, which takes precedence over '
+              '--obs-hist-statistics-store (default: compute them location '
+              'by location)'))
     parser.add_option('--repeat-warnings', action='store_true',
         dest='repeat_warnings', default=False,
         help='repeat warnings for the same source location (default: do not)')
@@ -869,8 +1966,14 @@ def main():
     n_variables = len(variable)
     obs_hist_path = uf.split(options.obs_hist, n_variables)
     sim_hist_path = uf.split(options.sim_hist, n_variables)
-    sim_fut_path = uf.split(options.sim_fut, n_variables)
-    sim_fut_ba_path = uf.split(options.sim_fut_ba, n_variables)
+    # list the paths of all variables of one target after the other
+    msg = 'found different numbers of options -f and -b'
+    assert len(options.sim_fut) == len(options.sim_fut_ba), msg
+    n_targets = len(options.sim_fut)
+    sim_fut_path = [path for paths in options.sim_fut
+        for path in uf.split(paths, n_variables)]
+    sim_fut_ba_path = [path for paths in options.sim_fut_ba
+        for path in uf.split(paths, n_variables)]
     halfwin_upper_bound_climatology = uf.split(
         options.halfwin_upper_bound_climatology, n_variables, int)
     lower_bound = uf.split(options.lower_bound, n_variables, float)
@@ -897,6 +2000,29 @@ def main():
         months = list(np.sort(np.unique(np.array(
             options.months.split(','), dtype=int))))
         uf.assert_validity_of_months(months)
+    uf.assert_validity_of_flush_policy(options.flush_policy)
+    uf.assert_validity_of_read_mode(options.read_mode)
+    uf.assert_validity_of_max_results_in_flight(options.max_results_in_flight)
+    uf.assert_validity_of_location_order(options.location_order)
+    uf.assert_validity_of_chunk_cache_size(options.chunk_cache_size)
+    uf.assert_validity_of_validity_mask_time_steps(
+        options.validity_mask_time_steps)
+    uf.assert_validity_of_batch_size(options.batch_size)
+    uf.assert_validity_of_worker_type(options.worker_type, options.read_mode)
+    i_shard, n_shards = uf.parse_shard(options.shard)
+    if n_shards > 1 and not options.merge_shards:
+        # write to the part files of this shard instead of the output files
+        output_path = [uf.get_shard_path(path, i_shard, n_shards)
+            for path in sim_fut_ba_path]
+    else:
+        output_path = sim_fut_ba_path
+    resume_job = uf.string_to_bool(options.resume_job) and \
+        not options.merge_shards
+    journal_path = uf.get_journal_path(output_path[0])
+    if resume_job and not (os.path.isfile(journal_path)
+        and all(os.path.isfile(path) for path in output_path)):
+        print('found no job to resume, starting from scratch')
+        resume_job = False
     for i in range(n_variables):
         uf.assert_consistency_of_bounds_and_thresholds(
             lower_bound[i], lower_threshold[i],
@@ -906,21 +2032,23 @@ def main():
             upper_bound[i], upper_threshold[i])
 
     # check input data and and make some information globally accessible
-    global month_numbers, years, doys
+    global month_numbers, years, doys, calendar_plan
     month_numbers, years, doys = {}, {}, {}
     space_shape = None
     window_centers = None
     for i, v in enumerate(variable):
-        with Dataset(obs_hist_path[i], 'r') as obs_hist, \
-            Dataset(sim_hist_path[i], 'r') as sim_hist, \
-            Dataset(sim_fut_path[i], 'r') as sim_fut:
-            for key in ('obs_hist', 'sim_hist', 'sim_fut'):
-                msg_ = f' {key} {v}'
+        # the paths to the future simulations of all targets
+        paths = [('obs_hist', 0, obs_hist_path[i]),
+            ('sim_hist', 0, sim_hist_path[i])] + [('sim_fut', t, path)
+            for t, path in enumerate(sim_fut_path[i::n_variables])]
+        for key, t, path in paths:
+            with Dataset(path, 'r') as dataset:
+                msg_ = f' {key} {v}' + (f' of target {t}' if t else '')
                 msg0 = 'found input data spatial shapes mismatch in' + msg_
                 msg1 = 'found input data months mismatch in' + msg_
                 msg2 = 'found input data years mismatch in' + msg_
                 msg3 = 'found input data days of year mismatch in' + msg_
-                coords = uf.analyze_input_nc(eval(key), v)
+                coords = uf.analyze_input_nc(dataset, v)
                 # make sure that all inputs have identical spatial dimensions
                 s = tuple(v.size for k, v in coords.items() if k != 'time')
                 if space_shape is None: space_shape = s
@@ -928,34 +2056,53 @@ def main():
                 # prepare bias adjustment calendar month by calendar month
                 if not options.step_size:
                     j = uf.convert_datetimes(coords['time'], 'month_number')
-                    if i: assert np.all(month_numbers[key] == j), msg1
-                    else: month_numbers[key] = j
+                    check_or_store_calendar(month_numbers, key, t, j, msg1)
                 # prepare bias adjustment in running-window mode and detrending
                 if options.step_size or detrend[i]:
                     j = uf.convert_datetimes(coords['time'], 'year')
-                    if i: assert np.all(years[key] == j), msg2
-                    else: years[key] = j
+                    check_or_store_calendar(years, key, t, j, msg2)
                 # prepare bias adjustment in running-window mode
                 # and scaling by upper bound climatology
                 if options.step_size or halfwin_upper_bound_climatology[i]:
                     j = uf.convert_datetimes(coords['time'], 'day_of_year')
-                    if i: assert np.all(doys[key] == j), msg3
-                    else: doys[key] = j
+                    check_or_store_calendar(doys, key, t, j, msg3)
                 # make sure that a full period is continuously covered
                 if not i and options.step_size:
-                    uf.assert_full_period_coverage(years[key], doys[key], key)
-
-            # prepare bias adjustment in running-window mode
-            if not i and options.step_size:
-                # make sure all input data cover the same number of doys
-                uf.assert_uniform_number_of_doys(doys)
-                # get application window centers
-                window_centers = uf.window_centers_for_running_bias_adjustment(
-                    doys['sim_fut'], options.step_size)
-
-            # create empty output netcdf file
-            uf.setup_output_nc(sim_fut_ba_path[i], sim_fut, v,
-                options, 'ba_', i, None)
+                    uf.assert_full_period_coverage(
+                        calendar_of_target(years, t)[key],
+                        calendar_of_target(doys, t)[key], key)
+
+                # create empty output netcdf file unless resuming a job
+                # and record the options of this target only
+                if key == 'sim_fut' and not resume_job:
+                    options_t = Values(dict(vars(options),
+                        sim_fut=options.sim_fut[t],
+                        sim_fut_ba=options.sim_fut_ba[t]))
+                    uf.setup_output_nc(output_path[t * n_variables + i],
+                        dataset, v, options_t, 'ba_', i, None)
+
+        # prepare bias adjustment in running-window mode
+        if not i and options.step_size:
+            # make sure all input data cover the same number of doys
+            for t in range(n_targets):
+                uf.assert_uniform_number_of_doys(calendar_of_target(doys, t))
+            # get application window centers
+            window_centers = uf.window_centers_for_running_bias_adjustment(
+                doys['sim_fut'][0], options.step_size)
+
+    # combine the part files written by all shards
+    if options.merge_shards:
+        print(f'merging {n_shards} shards ...')
+        tile_shape = get_tile_shape((obs_hist_path, sim_hist_path,
+            sim_fut_path, sim_fut_ba_path), variable, space_shape)
+        uf.assert_completeness_of_shards(
+            sim_fut_ba_path, space_shape, tile_shape, n_shards)
+        for path, v in zip(sim_fut_ba_path, cycle(variable)):
+            uf.merge_shards(path, v, tile_shape, n_shards)
+        return
+
+    # compute the indices used to select data once for all locations
+    calendar_plan = get_calendar_plan(options.step_size, window_centers, months)
 
     # get list of rotation matrices to be used for all locations and months
     if options.randomization_seed is not None:
@@ -967,8 +2114,14 @@ def main():
     spatial_dimensions_str = ', '.join(tuple(coords.keys())[:-1])
     print(f'adjusting at location ({spatial_dimensions_str}) ...')
     adjust_bias(
-        obs_hist_path, sim_hist_path, sim_fut_path, sim_fut_ba_path,
-        space_shape, options.n_processes,
+        obs_hist_path, sim_hist_path, sim_fut_path, output_path,
+        space_shape, options.n_processes, options.flush_policy,
+        options.read_mode, options.max_results_in_flight,
+        options.location_order, options.chunk_cache_size,
+        journal_path, resume_job, options.validity_mask_time_steps,
+        options.batch_size, i_shard, n_shards, options.worker_type,
+        options.obs_hist_statistics_store,
+        options.precompute_upper_bound_climatology,
         step_size=options.step_size,
         window_centers=window_centers,
         months=months,
@@ -28,14 +28,25 @@ climate observation data with the same temporal and higher spatial resolution.
 
 
 
+import os
 import warnings
 import numpy as np
 import utility_functions as uf
+import threading
 import multiprocessing as mp
+import multiprocessing.dummy
 from netCDF4 import Dataset
-from optparse import OptionParser
+from optparse import OptionParser, Values
 from functools import partial
-from itertools import product
+from contextlib import ExitStack
+from collections import OrderedDict, defaultdict
+from math import gcd
+
+
+
+# index and number of submitted results of the current worker process or
+# thread in multiprocessing applications
+worker = threading.local()
 
 
 
@@ -59,9 +70,11 @@ def weighted_sum_preserving_mbcn(
         resolution, derived from x_sim_coarse by bilinear interpolation.
     sum_weights : (N,) array
         Array of N grid cell-area weights.
-    rotation_matrices : list of (N,N) ndarrays, optional
-        List of orthogonal matrices defining a sequence of rotations in the  
-        second dimension of x_obs and x_sim.
+    rotation_matrices : list of (N,N) ndarrays or lists of dicts, optional
+        List of orthogonal matrices or structured orthogonal transformations
+        defining a sequence of rotations in the second dimension of x_obs and
+        x_sim. If structured transformations are given then the rotation to
+        the sum axis is done by a Householder reflection.
     n_quantiles : int, optional
         Number of quantile-quantile pairs used for non-parametric quantile
         mapping.
@@ -72,12 +85,14 @@ def weighted_sum_preserving_mbcn(
         Result of application of the modified MBCn algorithm.
 
     """
-    # initialize total rotation matrix
+    # initialize total rotation
     n_variables = sum_weights.size
-    o_total = np.diag(np.ones(n_variables))
+    structured = any(isinstance(o, list) for o in rotation_matrices)
+    o_total = [] if structured else np.diag(np.ones(n_variables))
 
     # p-values in percent for non-parametric quantile mapping
     p = np.linspace(0., 1., n_quantiles+1)
+    columns = np.arange(n_variables)
 
     # normalise the sum weights vector to length 1
     sum_weights = sum_weights / np.sqrt(np.sum(np.square(sum_weights)))
@@ -89,19 +104,21 @@ def weighted_sum_preserving_mbcn(
     n_loops = len(rotation_matrices) + 2
     for i in range(n_loops):
         if not i:  # rotate to the sum axis
-            o = uf.generate_rotation_matrix_fixed_first_axis(sum_weights)
+            o = uf.generate_householder_reflection_fixed_first_axis(
+                sum_weights) if structured else \
+                uf.generate_rotation_matrix_fixed_first_axis(sum_weights)
         elif i == n_loops - 1:  # rotate back to original axes for last qm
-            o = o_total.T
+            o = uf.transpose_rotation(o_total)
         else:  # do random rotation
             o = rotation_matrices[i-1]
 
         # compute total rotation
-        o_total = np.dot(o_total, o)
+        o_total = uf.compose_rotations(o_total, o)
 
         # rotate data
-        x_sim = np.dot(x_sim, o)
-        x_obs = np.dot(x_obs, o)
-        sum_weights = np.dot(sum_weights, o)
+        x_sim = uf.rotate(x_sim, o)
+        x_obs = uf.rotate(x_obs, o)
+        sum_weights = uf.rotate(sum_weights, o)
 
         if not i:
             # restore simulated values at coarse grid scale
@@ -114,14 +131,19 @@ def weighted_sum_preserving_mbcn(
                 uf.map_quantiles_non_parametric_with_constant_extrapolation(
                 x_obs[:,0], q_obs, q_sim)
         else:
-            # do univariate non-parametric quantile mapping for every variable
+            # do univariate non-parametric quantile mapping with one column
+            # per variable, where sorting and quantiles are computed for all
+            # variables at once but the interpolation still calls np.interp
+            # once per variable, mapping values in ascending order, which
+            # makes the searches done by np.interp considerably faster
             x_sim_previous = x_sim.copy()
-            for j in range(n_variables):
-                q_sim = uf.percentile1d(x_sim[:,j], p)
-                q_obs = uf.percentile1d(x_obs[:,j], p)
-                x_sim[:,j] = \
-                    uf.map_quantiles_non_parametric_with_constant_extrapolation(
-                    x_sim[:,j], q_sim, q_obs)
+            i_ascending = (np.argsort(x_sim, axis=0), columns)
+            x_sim_ascending = x_sim[i_ascending]
+            q_sim = uf.percentile2d(x_sim_ascending, p, True)
+            q_obs = uf.percentile2d(x_obs, p)
+            x_sim[i_ascending] = \
+                uf.map_quantiles_non_parametric_with_constant_extrapolation(
+                x_sim_ascending, q_sim, q_obs)
 
             # preserve weighted sum of original variables
             if i < n_loops - 1:
@@ -136,7 +158,7 @@ def downscale_one_month(
         data, long_term_mean,
         lower_bound=None, lower_threshold=None,
         upper_bound=None, upper_threshold=None,
-        randomization_seed=None, **kwargs):
+        randomization_seed=None, obs_prepared=None, **kwargs):
     """
     1. Replaces invalid values in time series.
     2. Replaces values beyond thresholds by random numbers.
@@ -168,6 +190,12 @@ def downscale_one_month(
     randomization_seed : int, optional
         Used to seed the random number generator before replacing values beyond
         the specified thresholds.
+    obs_prepared : dict of str : array, optional
+        Keys : 'obs_fine'.
+        Values : time series prepared by steps 1 and 2. Used instead of
+        repeating these steps if available, otherwise filled in. This allows
+        to share this preparation between several applications with the same
+        observation.
 
     Returns
     -------
@@ -181,6 +209,11 @@ def downscale_one_month(
     """
     x = {}
     for key, d in data.items():
+        # reuse prepared observation if available
+        if obs_prepared is not None and key in obs_prepared:
+            x[key] = obs_prepared[key]
+            continue
+
         # remove invalid values from masked array and store resulting data array
         x[key] = uf.sample_invalid_values(
             d, randomization_seed, long_term_mean[key])[0]
@@ -190,6 +223,8 @@ def downscale_one_month(
         x[key] = uf.randomize_censored_values(x[key], 
             lower_bound, lower_threshold, upper_bound, upper_threshold,
             False, False, randomization_seed, 10., 10.)
+        if obs_prepared is not None and key == 'obs_fine':
+            obs_prepared[key] = x[key]
 
     # downscale
     x_sim_coarse_remapbil = x['sim_coarse_remapbil'].copy()
@@ -216,7 +251,10 @@ def downscale_one_location(
         if_all_invalid_use=np.nan, **kwargs):
     """
     Applies the modified MBCn algorithm for statistical downscaling calendar
-    month by calendar month to climate data within one coarse grid cell.
+    month by calendar month to climate data within one coarse grid cell, for
+    all targets, i.e., simulations at coarse resolution, one after the other.
+    The observation at fine resolution is loaded and prepared only once for
+    all targets.
 
     Parameters
     ----------
@@ -256,142 +294,430 @@ def downscale_one_location(
 
     """
     # get local input data
+    n_targets = len(month_numbers['sim_coarse'])
     i_loc_fine = tuple(slice(df * i_loc_coarse[i], df * (i_loc_coarse[i] + 1))
         for i, df in enumerate(downscaling_factors))
-    j_loc_fine = tuple(np.arange(s.start, s.stop) for s in i_loc_fine)
-    oshape = lambda key: (np.prod(downscaling_factors), month_numbers[key].size)
-    data = {}
+    oshape = lambda c: (np.prod(downscaling_factors), c.size)
     key = 'obs_fine'
     if obs_fine:
         x = obs_fine[variable][i_loc_fine]
     else:
-        from_pool_queue.put((key, variable, i_loc_fine, i_process))
-        x = to_pool_queues[i_process].get()
-    data[key] = x.reshape(oshape(key)).T
+        from_pool_queue.put((key, variable, i_loc_fine, worker.i_process))
+        x = uf.get_from_shared_slot(shared_slots[worker.i_process],
+            shared_regions[key], to_pool_queues[worker.i_process].get())
+    x_obs_fine = x.reshape(oshape(month_numbers[key])).T
     key = 'sim_coarse'
-    if sim_coarse:
-        x = uf.extended_load(sim_coarse[variable],
-            i_loc_coarse, space_shapes[key], circular)
-    else:
-        from_pool_queue.put((key, variable,
-            i_loc_coarse, space_shapes[key], circular, i_process))
-        x = to_pool_queues[i_process].get()
-    ivalues_central, ivalues = x
     igrid = tuple(uf.xipm1(x, i) for x, i in zip(grids[key], i_loc_coarse))
-    data[key] = ivalues_central
-    key = 'sim_coarse_remapbil'
-    ogrid = tuple(x[i] for x, i in zip(grids[key], i_loc_fine))
-    ovalues = uf.remapbil(ivalues, igrid, ogrid, ascending)
-    data[key] = np.ma.masked_invalid(ovalues.reshape(oshape(key)).T)
+    ogrid = tuple(x[i] for x, i in zip(grids['sim_coarse_remapbil'],
+        i_loc_fine))
+    remapbil_operator = uf.get_remapbil_operator(igrid, ogrid, ascending)
+    data = []
+    for t in range(n_targets):
+        if sim_coarse:
+            x = uf.extended_load(sim_coarse[t][variable],
+                i_loc_coarse, space_shapes[key], circular,
+                None if band_caches is None else band_caches[t])
+        else:
+            from_pool_queue.put((key, t, variable,
+                i_loc_coarse, space_shapes[key], circular, worker.i_process))
+            x = tuple(uf.get_from_shared_slot(shared_slots[worker.i_process],
+                shared_regions[k, t], descriptor) for k, descriptor in zip(
+                (key, 'sim_coarse_extended'),
+                to_pool_queues[worker.i_process].get()))
+        ivalues_central, ivalues = x
+        ovalues = uf.remapbil(ivalues, igrid, ogrid, ascending,
+            remapbil_operator)
+        data.append({'obs_fine': x_obs_fine, 'sim_coarse': ivalues_central,
+            'sim_coarse_remapbil': np.ma.masked_invalid(ovalues.reshape(
+            oshape(month_numbers['sim_coarse_remapbil'][t])).T)})
 
     # abort here if there are only missing values in at least one time series
-    # do not abort though if the if_all_invalid_use option has been specified
+    # of the observation or of all targets, otherwise skip only those targets
+    # with only missing values in at least one time series
+    # do not skip anything though if the if_all_invalid_use option has been
+    # specified
+    targets = list(range(n_targets))
     if np.isnan(if_all_invalid_use):
-        if uf.only_missing_values_in_at_least_one_time_series(data):
+        targets = [t for t, data_t in enumerate(data)
+            if not uf.only_missing_values_in_at_least_one_time_series({
+            key: data_t[key] for key in ('sim_coarse', 'sim_coarse_remapbil')})]
+        if not targets or uf.only_missing_values_in_at_least_one_time_series(
+            {'obs_fine': x_obs_fine}):
             print(i_loc_coarse, 'skipped due to missing data')
+            save_one_location(i_loc_fine, variable, None)
             return None
 
     # otherwise continue
-    print(i_loc_coarse)
-
-    # compute mean value over all time steps for invalid value sampling
-    long_term_mean = {}
-    for key, d in data.items():
-        long_term_mean[key] = uf.average_valid_values(d, if_all_invalid_use,
-            lower_bound, lower_threshold, upper_bound, upper_threshold)
-
-    # do statistical downscaling calendar month by calendar month
-    result = data['sim_coarse_remapbil'].copy()
+    if len(targets) < n_targets:
+        print(i_loc_coarse, 'skipped for targets', tuple(t
+            for t in range(n_targets) if t not in targets),
+            'due to missing data')
+    else:
+        print(i_loc_coarse)
+
+    # compute mean value over all time steps for invalid value sampling, the
+    # observation is shared by all targets
+    long_term_mean = [{} for t in range(n_targets)]
+    for t in targets:
+        for key, d in data[t].items():
+            if t != targets[0] and key == 'obs_fine':
+                long_term_mean[t][key] = long_term_mean[targets[0]][key]
+            else:
+                long_term_mean[t][key] = uf.average_valid_values(d,
+                    if_all_invalid_use, lower_bound, lower_threshold,
+                    upper_bound, upper_threshold)
+
+    # do statistical downscaling calendar month by calendar month, where the
+    # results of skipped targets are set to missing values
+    result = [data_t['sim_coarse_remapbil'].copy() if t in targets
+        else np.ma.masked_all(data_t['sim_coarse_remapbil'].shape,
+        data_t['sim_coarse_remapbil'].dtype) for t, data_t in enumerate(data)]
     sum_weights_loc = sum_weights[i_loc_fine].flatten()
     data_this_month = {}
-    for month in months:
-        # extract data
-        for key, d in data.items():
-            m = month_numbers[key] == month
-            assert np.any(m), f'no data found for month {month} in {key}'
-            data_this_month[key] = d[m]
-
-        # do statistical downscaling
-        result_this_month = downscale_one_month(data_this_month, long_term_mean,
-            lower_bound, lower_threshold, upper_bound, upper_threshold,
-            sum_weights=sum_weights_loc, **kwargs)
-    
-        # put downscaled data into result
-        m = month_numbers['sim_coarse_remapbil'] == month
-        result[m] = result_this_month
+    for k in range(len(months)):
+        obs_prepared = {}
+        for t in targets:
+            plan = calendar_plan[t]
+
+            # extract data
+            for key, d in data[t].items():
+                data_this_month[key] = d[plan[key][k]]
+
+            # do statistical downscaling
+            result_this_month = downscale_one_month(data_this_month,
+                long_term_mean[t], lower_bound, lower_threshold,
+                upper_bound, upper_threshold, sum_weights=sum_weights_loc,
+                obs_prepared=obs_prepared, **kwargs)
+        
+            # put downscaled data into result
+            result[t][plan['sim_coarse_remapbil'][k]] = result_this_month
 
     # save local result of statistical downscaling
-    for i, i_loc in enumerate(product(*j_loc_fine)):
-        if sim_fine:
-            sim_fine[variable][i_loc] = result[:,i]
-            sim_fine.sync()
-        else:
-            from_pool_queue.put(('sim_fine', variable,
-                i_loc, result[:,i], i_process))
-            # wait for response to ensure that the local result has been saved
-            x = to_pool_queues[i_process].get()
+    save_one_location(i_loc_fine, variable, [r.T.reshape(
+        tuple(downscaling_factors) + r.shape[:1]) for r in result])
 
     return None
 
 
 
-def load_or_save_one_location(obs_fine_path, sim_coarse_path, sim_fine_path):
+def month_numbers_of_target(t):
+    """
+    Returns the month numbers of all time steps of all datasets of target t.
+
+    Parameters
+    ----------
+    t : int
+        Target.
+
+    Returns
+    -------
+    month_numbers_t : dict of str : array
+        Keys : 'obs_fine', 'sim_coarse', 'sim_coarse_remapbil'.
+        Values : month numbers of all time steps of datasets of target t.
+
+    """
+    return {key: c if key == 'obs_fine' else c[t]
+        for key, c in month_numbers.items()}
+
+
+
+def get_calendar_plan(months):
+    """
+    Returns the indices of the time steps of every calendar month in all
+    datasets of every target. These only depend on the time axes and are
+    hence computed once for all coarse locations.
+
+    Parameters
+    ----------
+    months : list of ints
+        List of ints from {1,...,12} representing calendar months for which
+        statistical downscaling is done.
+
+    Returns
+    -------
+    plan : list of dicts of str : list of arrays
+        One dict per target.
+        Keys : 'obs_fine', 'sim_coarse', 'sim_coarse_remapbil'.
+        Values : indices of the time steps of every calendar month in months.
+
+    """
+    return [{key: uf.get_month_indices(c, months, key)
+        for key, c in month_numbers_of_target(t).items()}
+        for t in range(len(month_numbers['sim_coarse']))]
+
+
+
+def downscale_batch(i_locations_coarse, **kwargs):
+    """
+    Applies the modified MBCn algorithm for statistical downscaling to climate
+    data within a batch of coarse grid cells, one coarse grid cell after the
+    other.
+
+    Parameters
+    ----------
+    i_locations_coarse : list of tuples
+        Coarse location indices.
+
+    Returns
+    -------
+    None.
+
+    Other Parameters
+    ----------------
+    **kwargs : Passed on to downscale_one_location.
+
+    """
+    for i_loc_coarse in i_locations_coarse:
+        downscale_one_location(i_loc_coarse, **kwargs)
+
+    return None
+
+
+
+def save_one_location(i_loc_fine, variable, result):
+    """
+    Saves local result of statistical downscaling, either directly or via the
+    process dedicated to I/O operations. In the latter case, the result is put
+    into one of the result slots shared by all worker processes and submitted
+    without waiting for it to be saved, unless all result slots are still in
+    use, i.e., unless the maximum number of results in flight has been
+    reached.
+
+    Parameters
+    ----------
+    i_loc_fine : tuple of slices
+        Fine location indices covered by one coarse location.
+    variable : str
+        Name of variable to be downscaled in netcdf files.
+    result : list of ndarrays or None
+        Result of statistical downscaling, one array per target, with the time
+        axis being the last axis. None indicates that there is no result
+        because the coarse location has been skipped.
+
+    """
+    if sim_fine:
+        nc_variables = [d[variable] for d in sim_fine]
+        completed = []
+        if uf.write_via_tile_buffer(nc_variables, i_loc_fine, result,
+            tile_buffer, output_flush_policy, completed):
+            for d in sim_fine: d.sync()
+        uf.append_to_journal(journal, completed)
+    else:
+        # wait for a free result slot
+        j = free_result_slots.get()
+        if result is not None:
+            result = [uf.put_into_shared_slot(result_slots[j],
+                result_regions['sim_fine', t], x)
+                for t, x in enumerate(result)]
+        from_pool_queue.put(('sim_fine', i_loc_fine, result, j))
+
+
+
+def load_or_save_one_location(
+        obs_fine_path, sim_coarse_path, sim_fine_path,
+        variable, flush_policy='tile', chunk_cache_size=0,
+        done_fine=None, skipped_fine=None, journal_path=None):
     """
     Gets items from from_pool_queue, then either loads the requested data from
-    one of the input netcdf files and puts that data to the to_pool_queue used
-    by the requesting process or saves the data transmitted via from_pool_queue
-    to the output netcdf file.
+    one of the input netcdf files and puts that data to the shared memory slot
+    of the requesting process or saves the data found in the shared memory slot
+    of the process that sent the item to the output netcdf file. Only small
+    descriptors of these data are transmitted via the queues. Output data are
+    written according to flush_policy. Fine locations are recorded in the
+    journal once their output data have been written.
 
     Parameters
     ----------
     obs_fine_path : str
         Path to input netcdf file with observation at fine resolution.
-    sim_coarse_path : str
-        Path to input netcdf file with simulation at coarse resolution.
-    sim_fine_path : str
-        Path to output netcdf file with simulation statistically downscaled to
-        fine resolution.
+    sim_coarse_path : list of strs
+        Paths to input netcdf files with simulations at coarse resolution, one
+        per target.
+    sim_fine_path : list of strs
+        Paths to output netcdf files with simulations statistically downscaled
+        to fine resolution, one per target.
+    variable : str
+        Name of variable to be downscaled in netcdf files.
+    flush_policy : str, optional
+        When to write statistical downscaling results to the output netcdf
+        file: ['location', 'tile'].
+    chunk_cache_size : int, optional
+        Size of chunk cache per input variable in bytes. If 0 then the default
+        chunk cache size is used.
+    done_fine : ndarray of booleans, optional
+        Marks fine locations that are already complete and will not be
+        processed.
+    skipped_fine : ndarray of booleans, optional
+        Marks fine locations that will not be processed due to missing data.
+    journal_path : str, optional
+        Path to journal of completed fine locations.
 
     """
-    with Dataset(obs_fine_path, 'r') as obs_fine, \
-        Dataset(sim_coarse_path, 'r') as sim_coarse, \
-        Dataset(sim_fine_path, 'r+') as sim_fine:
+    tile_buffer = {}
+    band_caches = defaultdict(OrderedDict)
+    ccs = chunk_cache_size
+    with uf.open_input_nc(obs_fine_path, variable, ccs) as obs_fine, \
+        ExitStack() as stack:
+        sim_coarse = [stack.enter_context(uf.open_input_nc(path, variable, ccs))
+            for path in sim_coarse_path]
+        sim_fine = [stack.enter_context(Dataset(path, 'r+'))
+            for path in sim_fine_path]
+        nc_variables = [d[variable] for d in sim_fine]
+        if flush_policy == 'tile':
+            uf.prefill_tile_buffer(
+                nc_variables, tile_buffer, done_fine, skipped_fine)
+        journal = None if journal_path is None else \
+            stack.enter_context(uf.open_journal(journal_path))
         while True:
             item = from_pool_queue.get()
             if item is None:
                 break
             elif item[0] == 'obs_fine':
                 x = obs_fine[item[1]][item[2]]
-                to_pool_queues[item[3]].put(x)
+                to_pool_queues[item[3]].put(uf.put_into_shared_slot(
+                    shared_slots[item[3]], shared_regions[item[0]], x))
             elif item[0] == 'sim_coarse':
-                x = uf.extended_load(
-                    sim_coarse[item[1]], item[2], item[3], item[4])
-                to_pool_queues[item[5]].put(x)
+                x = uf.extended_load(sim_coarse[item[1]][item[2]],
+                    item[3], item[4], item[5], band_caches[item[1]])
+                to_pool_queues[item[6]].put(tuple(uf.put_into_shared_slot(
+                    shared_slots[item[6]], shared_regions[key, item[1]], y)
+                    for key, y in zip((item[0], 'sim_coarse_extended'), x)))
             elif item[0] == 'sim_fine':
-                sim_fine[item[1]][item[2]] = item[3]
-                sim_fine.sync()
-                to_pool_queues[item[4]].put('synced')
+                values = item[2]
+                if values is not None:
+                    values = [uf.get_from_shared_slot(result_slots[item[3]],
+                        result_regions['sim_fine', t], descriptor)
+                        for t, descriptor in enumerate(values)]
+                completed = []
+                if uf.write_via_tile_buffer(nc_variables,
+                    item[1], values, tile_buffer, flush_policy, completed):
+                    for d in sim_fine: d.sync()
+                uf.append_to_journal(journal, completed)
+                # free result slot for reuse by any worker process
+                free_result_slots.put(item[3])
+        if uf.flush_tile_buffer(nc_variables, tile_buffer):
+            for d in sim_fine: d.sync()
+
+
+
+def get_tile_shape(obs_fine_path, sim_coarse_path, sim_fine_path,
+        variable, downscaling_factors):
+    """
+    Returns the shape of the smallest tiles of the coarse grid that consist of
+    complete chunks of all given netcdf files.
+
+    Parameters
+    ----------
+    obs_fine_path : str
+        Path to input netcdf file with observation at fine resolution.
+    sim_coarse_path : list of strs
+        Paths to input netcdf files with simulations at coarse resolution, one
+        per target.
+    sim_fine_path : list of strs
+        Paths to output netcdf files with simulations statistically downscaled
+        to fine resolution, one per target.
+    variable : str
+        Name of variable in netcdf files.
+    downscaling_factors : array of ints
+        Downscaling factors for all grid dimensions.
+
+    Returns
+    -------
+    tile_shape : tuple of ints
+        Common tile shape in coarse grid units.
+
+    """
+    tile_shapes = []
+    for path in [obs_fine_path] + sim_fine_path + sim_coarse_path:
+        with Dataset(path, 'r') as dataset:
+            tile_shape = uf.spatial_chunk_shape(dataset[variable])
+        if path not in sim_coarse_path:
+            # convert to coarse grid units, rounding up to complete chunks
+            tile_shape = tuple(t // gcd(t, df)
+                for t, df in zip(tile_shape, downscaling_factors))
+        tile_shapes.append(tile_shape)
+    return uf.common_tile_shape(tile_shapes, space_shapes['sim_coarse'])
 
 
 
 def downscale(
         obs_fine_path, sim_coarse_path, sim_fine_path,
-        n_processes=1, **kwargs):
+        n_processes=1, flush_policy='tile', read_mode='central',
+        max_results_in_flight=2, location_order='chunk', chunk_cache_size=0,
+        journal_path=None, resume_job=False, validity_mask_time_steps=0,
+        batch_size=1, i_shard=0, n_shards=1, worker_type='process', **kwargs):
     """
     Applies the modified MBCn algorithm for statistical downscaling calendar
-    month by calendar month and coarse grid cell by coarse grid cell.
+    month by calendar month and coarse grid cell by coarse grid cell, for one
+    or several targets that share the observation at fine resolution.
 
     Parameters
     ----------
     obs_fine_path : str
         Path to input netcdf file with observation at fine resolution.
-    sim_coarse_path : str
-        Path to input netcdf file with simulation at coarse resolution.
-    sim_fine_path : str
-        Path to output netcdf file with simulation statistically downscaled to
-        fine resolution.
+    sim_coarse_path : list of strs
+        Paths to input netcdf files with simulations at coarse resolution, one
+        per target.
+    sim_fine_path : list of strs
+        Paths to output netcdf files with simulations statistically downscaled
+        to fine resolution, one per target.
     n_processes : int, optional
         Number of processes used for parallel processing.
+    flush_policy : str, optional
+        When to write statistical downscaling results to the output netcdf
+        file: ['location', 'tile'].
+    read_mode : str, optional
+        How worker processes access the input netcdf files: ['central',
+        'direct']. If 'central' then all input data are loaded by the process
+        dedicated to I/O operations. If 'direct' then every worker process
+        opens its own read-only handles of the input netcdf files and loads
+        its input data itself, location by location. Results are always saved
+        by the process dedicated to I/O operations.
+    max_results_in_flight : int, optional
+        Maximum number of results of all worker processes together that have
+        been submitted to but not yet saved by the process dedicated to I/O
+        operations.
+    location_order : str, optional
+        Order in which coarse locations are processed: ['chunk', 'cost',
+        'index']. If 'chunk' then coarse locations are processed tile by tile,
+        where tiles consist of complete chunks of all input and output netcdf
+        files. If 'cost' then tiles are processed in descending order of their
+        total processing time in a previous application, and the coarse
+        locations of every tile in descending order of their processing
+        times. If 'index' then coarse locations are processed in the order of
+        their indices.
+    chunk_cache_size : int, optional
+        Size of chunk cache per input variable and file handle in bytes. If 0
+        then the default chunk cache size is used.
+    journal_path : str, optional
+        Path to journal of completed fine locations. If not specified then no
+        journal is kept.
+    resume_job : boolean, optional
+        Whether to resume an interrupted application by processing only those
+        coarse locations whose fine locations have not all been recorded as
+        completed in the journal.
+    validity_mask_time_steps : int, optional
+        If positive and if_all_invalid_use has not been specified then coarse
+        locations where the simulation or the observation at any of the
+        corresponding fine locations has only missing values at this number of
+        time steps, sampled evenly from the whole time series, are skipped
+        without loading their data. This assumes that missing values do not
+        vary with time.
+    batch_size : int, optional
+        Number of coarse locations per task in multiprocessing applications.
+        Every worker process processes the coarse locations of a task one
+        after the other. Tasks are completed in arbitrary order.
+    i_shard : int, optional
+        Index of the shard of coarse locations to be downscaled. Only coarse
+        locations in the chunk-aligned tiles assigned to this shard are
+        downscaled.
+    n_shards : int, optional
+        Number of shards the coarse grid is split into.
+    worker_type : str, optional
+        What the n_processes - 1 workers of a multiprocessing application are:
+        ['process', 'thread']. If 'thread' then the workers and the worker
+        dedicated to I/O operations are threads of this process, which share
+        its memory. This requires read_mode 'central'.
 
     Other Parameters
     ----------------
@@ -400,32 +726,178 @@ def downscale(
     """
     # downscale every location individually
     global from_pool_queue, to_pool_queues, obs_fine, sim_coarse, sim_fine
-    i_locations_coarse = np.ndindex(space_shapes['sim_coarse'])
-    sdol = partial(downscale_one_location, **kwargs)
+    global tile_buffer, output_flush_policy, shared_slots, shared_regions
+    global result_slots, result_regions, free_result_slots, journal
+    global band_caches
+    variable = kwargs['variable']
+    space_shape = space_shapes['sim_coarse']
+    tile_shape = get_tile_shape(obs_fine_path, sim_coarse_path, sim_fine_path,
+        variable, kwargs['downscaling_factors'])
+    cost_path = uf.get_cost_path(sim_fine_path[0])
+    if location_order == 'cost':
+        # estimate costs by processing times of a previous application
+        cost = uf.read_cost(cost_path, space_shape)
+        if cost is None:
+            print('found no processing times of a previous application, '
+                'processing coarse locations tile by tile')
+            location_order = 'chunk'
+    if location_order == 'chunk':
+        i_locations_coarse = uf.locations_tile_by_tile(space_shape, tile_shape)
+    elif location_order == 'cost':
+        i_locations_coarse = uf.locations_by_cost(
+            space_shape, tile_shape, cost)
+    else:
+        i_locations_coarse = np.ndindex(space_shape)
+
+    # skip coarse locations in tiles assigned to other shards
+    skipped_fine = None
+    if n_shards > 1:
+        skipped = np.logical_not(uf.shard_mask(
+            space_shape, tile_shape, i_shard, n_shards))
+        skipped_fine = uf.refine_mask(skipped, kwargs['downscaling_factors'])
+        print(f'processing shard {i_shard} of {n_shards} with '
+            f'{skipped.size - np.sum(skipped)} of {skipped.size} coarse '
+            'locations')
+        i_locations_coarse = (i for i in i_locations_coarse if not skipped[i])
+
+    # skip coarse locations whose fine locations have all been recorded as
+    # completed in the journal
+    done_fine = None
+    if journal_path is not None:
+        if resume_job:
+            done_fine = uf.read_journal(journal_path, space_shapes['obs_fine'])
+            done = uf.coarsen_mask(done_fine, kwargs['downscaling_factors'])
+            print(f'resuming job with {np.sum(done)} of {done.size} '
+                'coarse locations already completed')
+            i_locations_coarse = (i for i in i_locations_coarse if not done[i])
+        else:
+            open(journal_path, 'w').close()
+
+    # skip coarse locations with only missing values in at least one time
+    # series of obs_fine or of sim_coarse of all targets unless these are to
+    # be replaced, targets with only missing values in at least one time
+    # series of sim_coarse are skipped by downscale_one_location
+    if validity_mask_time_steps and \
+        np.isnan(kwargs.get('if_all_invalid_use', np.nan)):
+        with Dataset(obs_fine_path, 'r') as dataset:
+            valid = uf.coarsen_mask(uf.sample_validity(
+                dataset[variable], validity_mask_time_steps),
+                kwargs['downscaling_factors'])
+        valid_sim_coarse = np.zeros_like(valid)
+        for path in sim_coarse_path:
+            with Dataset(path, 'r') as dataset:
+                valid_sim_coarse |= uf.sample_validity(
+                    dataset[variable], validity_mask_time_steps)
+        valid &= valid_sim_coarse
+        invalid = np.logical_not(valid)
+        invalid_fine = uf.refine_mask(invalid, kwargs['downscaling_factors'])
+        print(f'skipping {np.sum(invalid)} of {invalid.size} coarse '
+            'locations due to missing data')
+        i_locations_coarse = (i for i in i_locations_coarse if not invalid[i])
+        # record the fine locations of these as completed such that
+        # merge_shards can tell complete from incomplete shards
+        if journal_path is not None:
+            tile_shape_fine = tuple(t * df for t, df in zip(
+                tile_shape, kwargs['downscaling_factors']))
+            with uf.open_journal(journal_path) as f:
+                uf.append_to_journal(f, list(uf.blocks_of_mask(invalid_fine
+                    if skipped_fine is None else invalid_fine & ~skipped_fine,
+                    tile_shape_fine)))
+        skipped_fine = invalid_fine if skipped_fine is None \
+            else skipped_fine | invalid_fine
+
+    # record processing times for cost estimates in later applications, where
+    # nan marks unknown processing times, e.g., of locations completed before
+    # an interruption, and locations skipped due to missing data take no time
+    times = uf.read_cost(cost_path, space_shape) if resume_job else None
+    if times is None: times = np.full(space_shape, np.nan, dtype=np.float32)
+    if validity_mask_time_steps and \
+        np.isnan(kwargs.get('if_all_invalid_use', np.nan)):
+        times[invalid] = 0
+    tsdob = partial(uf.time_batch, partial(downscale_batch, **kwargs))
+    ccs = chunk_cache_size
     if n_processes > 1:
-        from_pool_queue = mp.Queue()
-        to_pool_queues = [mp.Queue() for i in range(n_processes-1)]
+        # threads share the memory of this process but are otherwise used
+        # like processes
+        mpx = mp.dummy if worker_type == 'thread' else mp
+        from_pool_queue = mpx.Queue()
+        to_pool_queues = [mpx.Queue() for i in range(n_processes-1)]
         obs_fine, sim_coarse, sim_fine = None, None, None
-        reader_writer = mp.Process(target=load_or_save_one_location,
-            args=(obs_fine_path, sim_coarse_path, sim_fine_path))
+        # workers that read directly load coarse locations individually since
+        # they process locations that are scattered over the grid
+        band_caches = None
+        # allocate one shared memory slot per worker with one region per
+        # dataset for data exchange with reader_writer
+        n_fine = int(np.prod(kwargs['downscaling_factors']))
+        n_extended = 3 ** len(space_shapes['sim_coarse'])
+        region_sizes = {}
+        if read_mode == 'central':
+            region_sizes['obs_fine'] = n_fine * month_numbers['obs_fine'].size
+        for t, c in enumerate(month_numbers['sim_coarse']):
+            if read_mode == 'central':
+                region_sizes['sim_coarse', t] = c.size
+                region_sizes['sim_coarse_extended', t] = n_extended * c.size
+        shared_slots, shared_regions = uf.allocate_shared_slots(
+            n_processes - 1, region_sizes)
+        # allocate max_results_in_flight shared memory slots for results,
+        # which are used by all workers since results of the whole block of
+        # fine locations of all targets are large
+        result_slots, result_regions = uf.allocate_shared_slots(
+            max_results_in_flight, {('sim_fine', t): n_fine * c.size
+            for t, c in enumerate(month_numbers['sim_coarse'])})
+        free_result_slots = mpx.Queue()
+        for j in range(max_results_in_flight):
+            free_result_slots.put(j)
+        n_bytes = sum(len(s) for s in shared_slots + result_slots)
+        print(f'allocated {n_bytes / 2**20:.1f} MiB of shared memory for '
+            'data exchange with the process dedicated to I/O operations')
+        reader_writer = mpx.Process(target=load_or_save_one_location,
+            args=(obs_fine_path, sim_coarse_path, sim_fine_path,
+            variable, flush_policy, chunk_cache_size,
+            done_fine, skipped_fine, journal_path))
         reader_writer.start()
-        with mp.Manager() as manager:
-            ipq = manager.Queue()
-            for i in range(n_processes-1):
-                ipq.put(i)
-            def initializer(q):
-                global i_process
-                i_process = q.get()
-            with mp.Pool(n_processes-1, initializer, (ipq,)) as pool:
-                foo = list(pool.imap(sdol, i_locations_coarse))
-                from_pool_queue.put(None)
-                reader_writer.join()
+        ipq = mpx.Queue()
+        for i in range(n_processes-1):
+            ipq.put(i)
+        def initializer(q):
+            global obs_fine, sim_coarse
+            worker.i_process = q.get()
+            if read_mode == 'direct':
+                # open read-only handles of input netcdf files that stay
+                # open for the lifetime of this worker process
+                obs_fine = uf.open_input_nc(obs_fine_path, variable, ccs)
+                sim_coarse = [uf.open_input_nc(path, variable, ccs)
+                    for path in sim_coarse_path]
+        with mpx.Pool(n_processes-1, initializer, (ipq,)) as pool:
+            uf.record_cost(times, pool.imap_unordered(tsdob,
+                uf.batches(i_locations_coarse, batch_size)))
+            # wait until all results in flight have been saved
+            for j in range(max_results_in_flight):
+                free_result_slots.get()
+            from_pool_queue.put(None)
+            reader_writer.join()
     else:
         from_pool_queue, to_pool_queues = None, None
-        with Dataset(obs_fine_path, 'r') as obs_fine, \
-            Dataset(sim_coarse_path, 'r') as sim_coarse, \
-            Dataset(sim_fine_path, 'r+') as sim_fine:
-            foo = list(map(sdol, i_locations_coarse))
+        tile_buffer, output_flush_policy = {}, flush_policy
+        band_caches = defaultdict(OrderedDict)
+        with uf.open_input_nc(obs_fine_path, variable, ccs) as obs_fine, \
+            ExitStack() as stack:
+            sim_coarse = [stack.enter_context(
+                uf.open_input_nc(path, variable, ccs))
+                for path in sim_coarse_path]
+            sim_fine = [stack.enter_context(Dataset(path, 'r+'))
+                for path in sim_fine_path]
+            nc_variables = [d[variable] for d in sim_fine]
+            if flush_policy == 'tile':
+                uf.prefill_tile_buffer(
+                    nc_variables, tile_buffer, done_fine, skipped_fine)
+            journal = None if journal_path is None else \
+                stack.enter_context(uf.open_journal(journal_path))
+            uf.record_cost(times, map(tsdob,
+                uf.batches(i_locations_coarse, batch_size)))
+            if uf.flush_tile_buffer(nc_variables, tile_buffer):
+                for d in sim_fine: d.sync()
+    np.save(cost_path, times)
 
 
 
@@ -440,13 +912,16 @@ def main():
     parser.add_option('-o', '--obs-fine', action='store',
         type='string', dest='obs_fine', default=None,
         help='path to input netcdf file with observation at fine resolution')
-    parser.add_option('-s', '--sim-coarse', action='store',
-        type='string', dest='sim_coarse', default=None,
-        help='path to input netcdf file with simulation at coarse resolution')
-    parser.add_option('-f', '--sim-fine', action='store',
-        type='string', dest='sim_fine', default=None,
+    parser.add_option('-s', '--sim-coarse', action='append',
+        type='string', dest='sim_coarse', default=[],
+        help=('path to input netcdf file with simulation at coarse '
+              'resolution, can be repeated to downscale several targets that '
+              'share the observation in one application'))
+    parser.add_option('-f', '--sim-fine', action='append',
+        type='string', dest='sim_fine', default=[],
         help=('path to output netcdf file with simulation statistically '
-              'downscaled to fine resolution'))
+              'downscaled to fine resolution, has to be repeated as often as '
+              '-s'))
     parser.add_option('-v', '--variable', action='store',
         type='string', dest='variable', default=None,
         help=('name of variable to be downscaled in netcdf files '
@@ -462,6 +937,16 @@ def main():
         type='int', dest='n_iterations', default=20,
         help=('number of iterations used for statistical downscaling (default: '
               '20)'))
+    parser.add_option('--rotation-type', action='store',
+        type='string', dest='rotation_type', default='dense',
+        help=('kind of random rotations used for statistical downscaling '
+              '(default: dense, which means random orthogonal matrices whose '
+              'application costs O(N^2) operations per time step for N fine '
+              'grid cells per coarse grid cell, alternative: structured, '
+              'which means sequences of random permutations, sign changes, '
+              'and discrete cosine transforms whose application costs '
+              'O(N log N) operations per time step, recommended for large '
+              'downscaling factors)'))
     parser.add_option('--lower-bound', action='store',
         type='float', dest='lower_bound', default=None,
         help=('lower bound of variable that has to be respected during '
@@ -491,6 +976,85 @@ def main():
         help=('replace missing values, infs and nans by this value before '
               'statistical downscaling if there are no other values available '
               'in a time series (default: not specified)'))
+    parser.add_option('--flush-policy', action='store',
+        type='string', dest='flush_policy', default='tile',
+        help=('when to write statistical downscaling results to the output '
+              'netcdf file (default: tile, which means once all locations of '
+              'a chunk-aligned tile are complete, alternative: location)'))
+    parser.add_option('--read-mode', action='store',
+        type='string', dest='read_mode', default='central',
+        help=('how worker processes access the input netcdf files in '
+              'multiprocessing applications (default: central, which means '
+              'via the process dedicated to I/O operations and shared memory '
+              'of about 9 bytes per fine location of a coarse location and '
+              'time step of obs_fine per worker process, alternative: '
+              'direct, which means every worker process opens its own '
+              'read-only file handles and loads every location individually, '
+              'which relieves the process dedicated to I/O operations but '
+              'decompresses every chunk once per worker process or, if it '
+              'does not fit into the chunk cache, once per location)'))
+    parser.add_option('--max-results-in-flight', action='store',
+        type='int', dest='max_results_in_flight', default=2,
+        help=('maximum number of results of all worker processes together '
+              'that have been submitted to but not yet saved by the process '
+              'dedicated to I/O operations in multiprocessing applications, '
+              'each of which occupies about 9 bytes of shared memory per fine '
+              'location of a coarse location, time step, and target '
+              '(default: 2)'))
+    parser.add_option('--location-order', action='store',
+        type='string', dest='location_order', default='chunk',
+        help=('order in which coarse locations are processed (default: '
+              'chunk, which means tile by tile, where tiles consist of '
+              'complete chunks of all input and output netcdf files, '
+              'alternatives: cost, which means tile by tile in descending '
+              'order of the processing times recorded by a previous '
+              'application next to the output netcdf file, and index)'))
+    parser.add_option('--chunk-cache-size', action='store',
+        type='int', dest='chunk_cache_size', default=0,
+        help=('size of chunk cache per input variable and file handle in '
+              'bytes (default: 0, which means that the default chunk cache '
+              'size of the netcdf library is used)'))
+    parser.add_option('--resume-job', action='store',
+        type='string', dest='resume_job', default='False',
+        help=('whether to resume an interrupted application by processing '
+              'only coarse locations whose fine locations have not all been '
+              'recorded as completed in the journal kept next to the output '
+              'netcdf file (default: False)'))
+    parser.add_option('--validity-mask-time-steps', action='store',
+        type='int', dest='validity_mask_time_steps', default=0,
+        help=('number of time steps, sampled evenly from the whole time '
+              'series, used to identify coarse locations with only missing '
+              'values in at least one time series, which are then skipped '
+              'without loading their data, assuming that missing values do '
+              'not vary with time (default: 0, which means that no locations '
+              'are skipped this way)'))
+    parser.add_option('--batch-size', action='store',
+        type='int', dest='batch_size', default=1,
+        help=('number of coarse locations per task in multiprocessing '
+              'applications, larger values reduce the overhead per coarse '
+              'location at the cost of coarser load balancing (default: 1)'))
+    parser.add_option('--worker-type', action='store',
+        type='string', dest='worker_type', default='process',
+        help=('type of workers in multiprocessing applications (default: '
+              'process, alternative: thread, which means that all workers, '
+              'including the one dedicated to I/O operations, are threads of '
+              'one process that share its memory, which requires --read-mode '
+              'central)'))
+    parser.add_option('--shard', action='store',
+        type='string', dest='shard', default='0/1',
+        help=('shard i/n of an application split into n shards, e.g., the '
+              'tasks of a job array, which downscale disjoint sets of '
+              'chunk-aligned tiles of coarse locations and write to a part '
+              'file next to the output netcdf file, to be combined by '
+              '--merge-shards (default: 0/1, which means that all coarse '
+              'locations are downscaled and written to the output netcdf '
+              'file)'))
+    parser.add_option('--merge-shards', action='store_true',
+        dest='merge_shards', default=False,
+        help=('instead of downscaling, combine the part files written by the '
+              'n shards specified by --shard i/n into the output netcdf file, '
+              'for any i, after checking that the journals of all shards '
+              'record their tiles as completed (default: do not)'))
     parser.add_option('--repeat-warnings', action='store_true',
         dest='repeat_warnings', default=False,
         help='repeat warnings for the same source location (default: do not)')
@@ -500,60 +1064,127 @@ def main():
     # do some preliminary checks
     print('checking inputs ...')
     assert options.n_iterations > 0, 'invalid number of iterations'
+    uf.assert_validity_of_rotation_type(options.rotation_type)
     months = list(np.sort(np.unique(np.array(
         options.months.split(','), dtype=int))))
     uf.assert_validity_of_months(months)
+    uf.assert_validity_of_flush_policy(options.flush_policy)
+    uf.assert_validity_of_read_mode(options.read_mode)
+    uf.assert_validity_of_max_results_in_flight(options.max_results_in_flight)
+    uf.assert_validity_of_location_order(options.location_order)
+    uf.assert_validity_of_chunk_cache_size(options.chunk_cache_size)
+    uf.assert_validity_of_validity_mask_time_steps(
+        options.validity_mask_time_steps)
+    uf.assert_validity_of_batch_size(options.batch_size)
+    uf.assert_validity_of_worker_type(options.worker_type, options.read_mode)
+    msg = 'found different numbers of options -s and -f'
+    assert len(options.sim_coarse) == len(options.sim_fine), msg
+    i_shard, n_shards = uf.parse_shard(options.shard)
+    if n_shards > 1 and not options.merge_shards:
+        # write to the part files of this shard instead of the output files
+        output_path = [uf.get_shard_path(path, i_shard, n_shards)
+            for path in options.sim_fine]
+    else:
+        output_path = options.sim_fine
+    resume_job = uf.string_to_bool(options.resume_job) and \
+        not options.merge_shards
+    journal_path = uf.get_journal_path(output_path[0])
+    if resume_job and not (os.path.isfile(journal_path)
+        and all(os.path.isfile(path) for path in output_path)):
+        print('found no job to resume, starting from scratch')
+        resume_job = False
     uf.assert_consistency_of_bounds_and_thresholds(
         options.lower_bound, options.lower_threshold,
         options.upper_bound, options.upper_threshold)
 
     # check input data and and make some information globally accessible
-    global grids, month_numbers, space_shapes
+    global grids, month_numbers, space_shapes, calendar_plan
     grids, space_shapes, month_numbers = {}, {}, {}
     data_variable_dimensions = None
     msg = 'data variable dimensions differ between obs_fine and sim_coarse'
-    with Dataset(options.obs_fine, 'r') as obs_fine, \
-        Dataset(options.sim_coarse, 'r') as sim_coarse:
-        for key in ('sim_coarse', 'obs_fine', 'sim_coarse_remapbil'):
-            if key == 'sim_coarse_remapbil':
-                grids[key] = grids['obs_fine']
-                month_numbers[key] = month_numbers['sim_coarse']
-                space_shapes[key] = space_shapes['obs_fine']
-                continue
-            coords = uf.analyze_input_nc(eval(key), options.variable)
-            if data_variable_dimensions is None:
-                data_variable_dimensions = tuple(coords.keys())
-            else:
-                assert tuple(coords.keys()) == data_variable_dimensions, msg
-            grids[key] = list(coords.values())[:-1]
-            month_numbers[key] = uf.convert_datetimes(
-                coords['time'], 'month_number')
-            space_shapes[key] = tuple(c.size for c in grids[key])
-
-        # make sure the grids meet the requirements of the downscaling algorithm
-        print("-----------------------------",grids['sim_coarse'],grids['obs_fine'])
-        downscaling_factors, ascending, circular = uf.analyze_input_grids(
-            grids['sim_coarse'], grids['obs_fine'])
-
-        # create empty output netcdf file
-        uf.setup_output_nc(options.sim_fine, sim_coarse, options.variable,
-            options, 'sd_', None, obs_fine)
+    paths = [('sim_coarse', t, path)
+        for t, path in enumerate(options.sim_coarse)]
+    for key, t, path in paths + [('obs_fine', 0, options.obs_fine)]:
+        with Dataset(path, 'r') as dataset:
+            coords = uf.analyze_input_nc(dataset, options.variable)
+        if data_variable_dimensions is None:
+            data_variable_dimensions = tuple(coords.keys())
+        else:
+            assert tuple(coords.keys()) == data_variable_dimensions, msg
+        grid = list(coords.values())[:-1]
+        c = uf.convert_datetimes(coords['time'], 'month_number')
+        if key == 'obs_fine':
+            month_numbers[key] = c
+        elif t:
+            # all targets have to share the coarse grid
+            assert all(np.array_equal(x, y) for x, y in zip(
+                grid, grids[key])), f'coarse grid mismatch in target {t}'
+            month_numbers[key].append(c)
+            continue
+        else:
+            month_numbers[key] = [c]
+        grids[key] = grid
+        space_shapes[key] = tuple(x.size for x in grid)
+    key = 'sim_coarse_remapbil'
+    grids[key] = grids['obs_fine']
+    month_numbers[key] = month_numbers['sim_coarse']
+    space_shapes[key] = space_shapes['obs_fine']
+
+    # make sure the grids meet the requirements of the downscaling algorithm
+    print("-----------------------------",grids['sim_coarse'],grids['obs_fine'])
+    downscaling_factors, ascending, circular = uf.analyze_input_grids(
+        grids['sim_coarse'], grids['obs_fine'])
+
+    # create empty output netcdf files unless resuming a job
+    # and record the options of the respective target only
+    if not resume_job:
+        with Dataset(options.obs_fine, 'r') as obs_fine:
+            for t, path in enumerate(options.sim_coarse):
+                options_t = Values(dict(vars(options),
+                    sim_coarse=path, sim_fine=options.sim_fine[t]))
+                with Dataset(path, 'r') as sim_coarse:
+                    uf.setup_output_nc(output_path[t], sim_coarse,
+                        options.variable, options_t, 'sd_', None, obs_fine)
+
+    # combine the part files written by all shards
+    if options.merge_shards:
+        print(f'merging {n_shards} shards ...')
+        tile_shape = get_tile_shape(options.obs_fine, options.sim_coarse,
+            options.sim_fine, options.variable, downscaling_factors)
+        tile_shape_fine = tuple(
+            t * df for t, df in zip(tile_shape, downscaling_factors))
+        uf.assert_completeness_of_shards(options.sim_fine,
+            space_shapes['obs_fine'], tile_shape_fine, n_shards)
+        for path in options.sim_fine:
+            uf.merge_shards(
+                path, options.variable, tile_shape_fine, n_shards)
+        return
+
+    # compute the indices used to select data once for all coarse locations
+    calendar_plan = get_calendar_plan(months)
 
     # compute grid cell weights at fine resolution
     sum_weights = uf.grid_cell_weights(coords)
 
-    # get list of rotation matrices to be used for all locations and months
+    # get list of rotation matrices or structured rotations to be used for
+    # all locations and months
     if options.randomization_seed is not None:
         np.random.seed(options.randomization_seed)
-    rotation_matrices = [uf.generateCREmatrix(np.prod(downscaling_factors))
+    generate_rotation = uf.generate_structured_rotation \
+        if options.rotation_type == 'structured' else uf.generateCREmatrix
+    rotation_matrices = [generate_rotation(np.prod(downscaling_factors))
         for i in range(options.n_iterations)]
 
     # do statistical downscaling
     spatial_dimensions_str = ', '.join(data_variable_dimensions[:-1])
     print(f'downscaling at coarse location ({spatial_dimensions_str}) ...')
     downscale(
-        options.obs_fine, options.sim_coarse, options.sim_fine,
-        options.n_processes,
+        options.obs_fine, options.sim_coarse, output_path,
+        options.n_processes, options.flush_policy, options.read_mode,
+        options.max_results_in_flight, options.location_order,
+        options.chunk_cache_size, journal_path, resume_job,
+        options.validity_mask_time_steps, options.batch_size,
+        i_shard, n_shards, options.worker_type,
         downscaling_factors=downscaling_factors,
         ascending=ascending,
         circular=circular,
@@ -29,20 +29,33 @@ statistical_downscaling.
 
 
 import os
+import time
+import hashlib
 import warnings
+import threading
 import numpy as np
+import multiprocessing as mp
 import datetime as dt
 import scipy.stats as sps
 import scipy.linalg as spl
 import scipy.interpolate as spi
+import scipy.fftpack as spfft
 from pandas import Series
 from netCDF4 import Dataset, default_fillvals
 from cf_units import num2date
 from itertools import product
+from math import gcd
+from functools import lru_cache
 from scipy.signal import convolve
 
 
 
+# serializes seeding and using the global random number generator such that
+# results stay reproducible if several threads do this at the same time
+random_lock = threading.Lock()
+
+
+
 def assert_uniform_number_of_doys(doys):
     """
     Raises an assertion error if the arrays in the input dict do not have the
@@ -140,6 +153,202 @@ def assert_validity_of_months(months):
 
 
 
+def assert_validity_of_flush_policy(flush_policy):
+    """
+    Raises an assertion error if flush_policy is not supported.
+
+    Parameters
+    ----------
+    flush_policy : str
+        When to write results to output netcdf files.
+
+    """
+    flush_policies_allowed = ['location', 'tile']
+    msg = f'flush_policy has to be one of {flush_policies_allowed}'
+    assert flush_policy in flush_policies_allowed, msg
+
+
+
+def assert_validity_of_read_mode(read_mode):
+    """
+    Raises an assertion error if read_mode is not supported.
+
+    Parameters
+    ----------
+    read_mode : str
+        How worker processes access input netcdf files.
+
+    """
+    read_modes_allowed = ['central', 'direct']
+    msg = f'read_mode has to be one of {read_modes_allowed}'
+    assert read_mode in read_modes_allowed, msg
+
+
+
+def assert_validity_of_max_results_in_flight(max_results_in_flight):
+    """
+    Raises an assertion error if max_results_in_flight is not a positive
+    integer.
+
+    Parameters
+    ----------
+    max_results_in_flight : int
+        Maximum number of results per worker process that have been submitted
+        to but not yet saved by the process dedicated to I/O operations.
+
+    """
+    msg = 'max_results_in_flight has to be a positive integer'
+    assert max_results_in_flight > 0, msg
+
+
+
+def assert_validity_of_location_order(location_order):
+    """
+    Raises an assertion error if location_order is not supported.
+
+    Parameters
+    ----------
+    location_order : str
+        Order in which locations are processed.
+
+    """
+    location_orders_allowed = ['chunk', 'cost', 'index']
+    msg = f'location_order has to be one of {location_orders_allowed}'
+    assert location_order in location_orders_allowed, msg
+
+
+
+def assert_validity_of_batch_size(batch_size):
+    """
+    Raises an assertion error if batch_size is not a positive integer.
+
+    Parameters
+    ----------
+    batch_size : int
+        Number of locations per task in multiprocessing applications.
+
+    """
+    msg = 'batch_size has to be a positive integer'
+    assert batch_size > 0, msg
+
+
+
+def assert_validity_of_worker_type(worker_type, read_mode):
+    """
+    Raises an assertion error if worker_type is not supported or cannot be
+    combined with read_mode.
+
+    Parameters
+    ----------
+    worker_type : str
+        Type of workers in multiprocessing applications.
+    read_mode : str
+        How workers access the input netcdf files.
+
+    """
+    worker_types_allowed = ['process', 'thread']
+    msg = f'worker_type has to be one of {worker_types_allowed}'
+    assert worker_type in worker_types_allowed, msg
+    msg = 'worker_type thread requires read_mode central'
+    assert worker_type != 'thread' or read_mode == 'central', msg
+
+
+
+def assert_validity_of_rotation_type(rotation_type):
+    """
+    Raises an assertion error if rotation_type is not supported.
+
+    Parameters
+    ----------
+    rotation_type : str
+        Kind of random rotations used for statistical downscaling.
+
+    """
+    rotation_types_allowed = ['dense', 'structured']
+    msg = f'rotation_type has to be one of {rotation_types_allowed}'
+    assert rotation_type in rotation_types_allowed, msg
+
+
+
+def parse_shard(shard):
+    """
+    Converts a string of the form 'i/n' to the index i of a shard and the
+    number n of shards. Raises an assertion error unless 0 <= i < n.
+
+    Parameters
+    ----------
+    shard : str
+        Shard specification.
+
+    Returns
+    -------
+    i_shard : int
+        Index of shard.
+    n_shards : int
+        Number of shards.
+
+    """
+    msg = f'shard has to be of the form i/n with 0 <= i < n but got {shard}'
+    parts = shard.split('/')
+    assert len(parts) == 2 and all(p.isdigit() for p in parts), msg
+    i_shard, n_shards = int(parts[0]), int(parts[1])
+    assert i_shard < n_shards, msg
+    return i_shard, n_shards
+
+
+
+def string_to_bool(s):
+    """
+    Converts 'True' or 'False', in any capitalization, to a boolean.
+
+    Parameters
+    ----------
+    s : str
+        String to convert.
+
+    Returns
+    -------
+    b : boolean
+        Converted string.
+
+    """
+    msg = f'expected True or False but got {s}'
+    assert s.lower() in ['true', 'false'], msg
+    return s.lower() == 'true'
+
+
+
+def assert_validity_of_chunk_cache_size(chunk_cache_size):
+    """
+    Raises an assertion error if chunk_cache_size is negative.
+
+    Parameters
+    ----------
+    chunk_cache_size : int
+        Size of chunk cache in bytes.
+
+    """
+    msg = 'chunk_cache_size has to be a non-negative integer'
+    assert chunk_cache_size >= 0, msg
+
+
+
+def assert_validity_of_validity_mask_time_steps(validity_mask_time_steps):
+    """
+    Raises an assertion error if validity_mask_time_steps is negative.
+
+    Parameters
+    ----------
+    validity_mask_time_steps : int
+        Number of time steps sampled to determine locations with only missing
+        values.
+
+    """
+    msg = 'validity_mask_time_steps has to be a non-negative integer'
+    assert validity_mask_time_steps >= 0, msg
+
+
+
 def assert_consistency_of_bounds_and_thresholds(
         lower_bound=None, lower_threshold=None,
         upper_bound=None, upper_threshold=None):
@@ -572,214 +781,1438 @@ def setup_output_nc(
 
 
 
-def extended_load(nc_variable, i_loc, space_shape, circular):
+def spatial_chunk_shape(nc_variable):
     """
-    Loads data from nc_variable for grid window of width 3 by 3 by 3 by ...
-    around i_loc. Data beyond the grid boundaries, defined by space_shape, are
-    set to nan unless circular indicates that for a given dimension data from
-    the other end of the grid can be used. Missing values and infs in the input
-    data are replaced by nans.
+    Returns the chunk shape of nc_variable in all but the last dimension, which
+    is assumed to be time.
 
     Parameters
     ----------
     nc_variable : Dataset.variable
-        Variable of netcdf dataset from which to load.
-    i_loc : n-tuple of ints
-        Index around which to do the extended load.
-    space_shape : n-tuple of ints
-        Shape of grid from which to do the extended load.
-    circular : n-tuple of booleans
-        Whether coordinates are circular.
+        Variable of netcdf dataset.
 
     Returns
     -------
-    x : masked array
-        Original data at i_loc.
-    x_extended : ndarray
-        Data for grid window of width 3 by 3 by 3 by ...
+    chunk_shape : tuple of ints
+        Chunk shape in spatial dimensions. Consists of ones only if nc_variable
+        is stored contiguously.
 
     """
-    ndim = len(i_loc)
-    msg = 'input tuples must have uniform length'
-    assert ndim == len(space_shape) == len(circular), msg
-    x = nc_variable[i_loc]
-    x_extended_space_shape = (3,) * ndim
-    x_extended = np.empty(x_extended_space_shape + x.shape, dtype=x.dtype)
-    for i in np.ndindex(x_extended_space_shape):
-        j_raw = np.array(i_loc) + np.array(i) - 1
-        j = np.where(circular, j_raw % np.array(space_shape), j_raw)
-        if np.any(j < 0) or np.any(j > np.array(space_shape) - 1):
-            x_extended[i] = np.nan
-        else:
-            x_extended[i] = ma2a(nc_variable[tuple(j)])
-    return x, x_extended
+    c = nc_variable.chunking()
+    ndim = len(nc_variable.shape) - 1
+    return (1,) * ndim if c == 'contiguous' else tuple(c[:-1])
 
 
 
-def xipm1(x, i):
+def tile_slices(i_loc, space_shape, tile_shape):
     """
-    Extract points from x at position i +- 1, linearly extrapolating beyond
-    the limits of x.
+    Returns the slices that define the tile containing i_loc, where tiles are
+    obtained by partitioning a grid into blocks of shape tile_shape, starting
+    at index 0 in every dimension.
 
     Parameters
     ----------
-    x : array
-        Array from which to do the extraction.
-    i : int
-        Index around which to do the extraction.
+    i_loc : n-tuple of ints
+        Location index.
+    space_shape : n-tuple of ints
+        Shape of grid.
+    tile_shape : n-tuple of ints
+        Shape of tiles. Tiles at the upper grid boundaries may be smaller.
 
     Returns
     -------
-    y : array
-        Extracted points.
+    tile : n-tuple of slices
+        Tile containing i_loc.
 
     """
-    n = x.size
-    assert n > 1, 'x too short'
-    y0 = 2 * x[0] - x[1] if i == 0 else x[i-1]
-    y1 = x[i]
-    y2 = 2 * x[-1] - x[-2] if i == n - 1 else x[i+1]
-    y = np.array([y0, y1, y2])
-    return y
+    return tuple(slice(t * (i // t), min(t * (i // t + 1), n))
+        for i, n, t in zip(i_loc, space_shape, tile_shape))
 
 
 
-def remapbil(ivalues, igrid, ogrid, ascending):
+def common_tile_shape(tile_shapes, space_shape):
     """
-    Remaps ivalues from igrid to ogrid using multilinear interpolation on a
-    regular grid in arbitrary dimensions. NaNs resulting from the interpolation
-    are replaced by ivalues from the central grid cell of igrid, with the
-    following background. Where multilinear interpolation is not possible due to
-    missing values in neighbouring coarse grid cells, values obtained with
-    nearest neighbour interpolation are filled in. In the end, every fine grid
-    cell fully contained in a coarse grid cell with available data should also
-    have available data.
-
-    This code was inspired by scipy.interpolate.RegularGridInterpolator.
+    Returns the shape of the smallest tiles that consist of complete tiles of
+    all given tile shapes, limited by the shape of the grid.
 
     Parameters
     ----------
-    ivalues : ndarray
-        Values on input grid. This ndarray can have more dimensions than igrid,
-        ogrid, and ascending. If this is the case then remapping is broadcasted
-        to the additional, trailing dimensions.
-    igrid : list of arrays
-        Input grid coordinates. It is expected that all arrays have length 3.
-    ogrid : list of arrays
-        Output grid coordinates.
-    ascending : tuple of booleans
-        A tuple of the same length as igrid and ogrid. For every dimension, it
-        specifies whether the coordinates in igrid are monotonically increasing
-        (True) or decreasing (False).
+    tile_shapes : list of n-tuples of ints
+        Shapes of tiles.
+    space_shape : n-tuple of ints
+        Shape of grid.
 
     Returns
     -------
-    ovalues : ndarray
-        Interpolated values on output grid.
+    tile_shape : n-tuple of ints
+        Common tile shape, i.e., the least common multiple of all tile_shapes
+        in every dimension, limited by space_shape.
 
     """
-    # find lower edge of every point in ogrid
-    indices = []
-    # compute distance to lower edge in unity units
-    norm_distances = []
-    # lower edge index functions
-    i_ascending = lambda x, y: np.searchsorted(y, x) - 1
-    i_descending = lambda x, y: y.size - 1 - np.searchsorted(
-        y, x, 'right', np.arange(y.size - 1,-1,-1))
-    # loop over dimensions
-    for a, x, y in zip(ascending, ogrid, igrid):
-        i = i_ascending(x, y) if a else i_descending(x, y)
-        indices.append(i)
-        norm_distances.append((x - y[i]) / (y[i + 1] - y[i]))
+    tile_shape = []
+    for t, n in zip(zip(*tile_shapes), space_shape):
+        lcm = 1
+        for t_ in t:
+            lcm = lcm * t_ // gcd(lcm, t_)
+        tile_shape.append(min(lcm, n))
+    return tuple(tile_shape)
 
-    # interpolate using weights
-    ndim = len(igrid)
-    ndim_trailing = ivalues.ndim - ndim
-    wshape_trailing = (2,) * ndim + (1,) * ndim_trailing
-    gshape = tuple(len(grid) for grid in ogrid)
-    oshape = gshape + ivalues.shape[ndim:]
-    ovalues = np.empty(oshape, dtype=ivalues.dtype)
-    # loop over interpolation points
-    for oind in np.ndindex(gshape):
-        weights = np.ones((2,)*ndim, dtype=ivalues.dtype)
-        # each i and i+1 represents a edge
-        edges = tuple(np.array([index[oind[i]], index[oind[i]]+1])
-            for i, index in enumerate(indices))
-        # loop over dimensions
-        for i, edge in enumerate(edges):
-            index = indices[i][oind[i]]
-            w = norm_distances[i][oind[i]]
-            wshape = (1,) * i + (2,) + (1,) * (ndim - 1 - i)
-            weights *= np.where(edge == index, 1 - w, w).reshape(wshape)
-        result = np.sum(
-            ivalues[np.ix_(*edges)] * weights.reshape(wshape_trailing),
-            axis=tuple(np.arange(ndim))
-        )
-        # replace nans by ivalues from central grid cell of igrid
-        i_nan = np.isnan(result)
-        result[i_nan] = ivalues[(1,) * ndim][i_nan]
-        ovalues[oind] = result
-
-    return ovalues
 
 
+def locations_tile_by_tile(space_shape, tile_shape):
+    """
+    Yields all location indices of a grid tile by tile, where tiles are
+    obtained by partitioning the grid into blocks of shape tile_shape.
+
+    Parameters
+    ----------
+    space_shape : n-tuple of ints
+        Shape of grid.
+    tile_shape : n-tuple of ints
+        Shape of tiles.
+
+    Yields
+    ------
+    i_loc : n-tuple of ints
+        Location index.
 
-def window_centers_for_running_bias_adjustment(doys, step_size):
     """
-    Returns window centers for bias adjustment in running-window mode.
+    n_tiles = tuple(-(-n // t) for n, t in zip(space_shape, tile_shape))
+    for k in np.ndindex(n_tiles):
+        tile = tile_slices(tuple(t * j for t, j in zip(tile_shape, k)),
+            space_shape, tile_shape)
+        for i_loc in product(*(range(s.start, s.stop) for s in tile)):
+            yield i_loc
+
+
+
+def locations_by_cost(space_shape, tile_shape, cost):
+    """
+    Yields all location indices of a grid tile by tile, where tiles are
+    obtained by partitioning the grid into blocks of shape tile_shape. Tiles
+    are yielded in descending order of their total estimated cost and the
+    locations of every tile in descending order of their estimated cost.
+    Unknown costs are replaced by the mean known cost of their tile or, if
+    there is none, of the grid.
 
     Parameters
     ----------
-    doys : array
-        Day-of-year time series of historical input data.
-    step_size : int
-        Step size in number of days used for bias adjustment in running-window
-        mode.
+    space_shape : n-tuple of ints
+        Shape of grid.
+    tile_shape : n-tuple of ints
+        Shape of tiles.
+    cost : ndarray
+        Estimated cost of every location, nan if unknown.
+
+    Yields
+    ------
+    i_loc : n-tuple of ints
+        Location index.
+
+    """
+    n_tiles = tuple(-(-n // t) for n, t in zip(space_shape, tile_shape))
+    tiles = [tile_slices(tuple(t * j for t, j in zip(tile_shape, k)),
+        space_shape, tile_shape) for k in np.ndindex(n_tiles)]
+    cost = np.array(cost, dtype=float)
+    unknown = np.isnan(cost)
+    if np.any(unknown):
+        mean = 0. if np.all(unknown) else np.mean(cost[~unknown])
+        for tile in tiles:
+            c, u = cost[tile], unknown[tile]
+            c[u] = mean if np.all(u) else np.mean(c[~u])
+    tile_cost = np.array([np.sum(cost[tile]) for tile in tiles])
+    for j in np.argsort(-tile_cost, kind='mergesort'):
+        i_locs = list(product(*(range(s.start, s.stop) for s in tiles[j])))
+        location_cost = np.array([cost[i_loc] for i_loc in i_locs])
+        for k in np.argsort(-location_cost, kind='mergesort'):
+            yield i_locs[k]
 
-    Returns
-    -------
-    doys_center : array
-        Window centers for bias adjustment in running-window mode. In 
-        day-of-year units.
 
+
+def tiles_of_shard(space_shape, tile_shape, i_shard, n_shards):
     """
-    doy_max = np.max(doys)
-    doy_mod = doy_max % step_size
-    doys_center_first = 1 + step_size // 2
-    # make sure first and last window have the same length +- 1
-    if doy_mod: doys_center_first -= (step_size - doy_mod) // 2
-    doys_center = np.arange(doys_center_first, doy_max+1, step_size)
-    return doys_center
+    Yields the tiles assigned to shard i_shard of n_shards, where tiles are
+    obtained by partitioning the grid into blocks of shape tile_shape and
+    assigned to the shards in turn in the order of their indices.
 
+    Parameters
+    ----------
+    space_shape : n-tuple of ints
+        Shape of grid.
+    tile_shape : n-tuple of ints
+        Shape of tiles.
+    i_shard : int
+        Index of shard.
+    n_shards : int
+        Number of shards.
 
+    Yields
+    ------
+    tile : n-tuple of slices
+        Tile assigned to shard i_shard.
 
-def window_indices_for_running_bias_adjustment(
-        doys, window_center, window_width, years=None):
     """
-    Returns window indices for data selection for bias adjustment in
-    running-window mode.
+    n_tiles = tuple(-(-n // t) for n, t in zip(space_shape, tile_shape))
+    for j, k in enumerate(np.ndindex(n_tiles)):
+        if j % n_shards == i_shard:
+            yield tile_slices(tuple(t * j_ for t, j_ in zip(tile_shape, k)),
+                space_shape, tile_shape)
+
+
+
+def shard_mask(space_shape, tile_shape, i_shard, n_shards):
+    """
+    Marks the locations in the tiles assigned to shard i_shard of n_shards.
 
     Parameters
     ----------
-    doys : array
-        Day-of-year time series associated to data array from which data shall
-        be selected using the resulting indices.
-    window_center : int
-        Day of year at the center of each window.
-    window_width : int
-        Width of each window in days.
-    years : array, optional
-        Year time series associated to data array from which data shall
-        be selected using the resulting indices. If provided, it is ensured
-        that windows do not extend into the following or previous year.
+    space_shape : n-tuple of ints
+        Shape of grid.
+    tile_shape : n-tuple of ints
+        Shape of tiles.
+    i_shard : int
+        Index of shard.
+    n_shards : int
+        Number of shards.
 
     Returns
     -------
-    i_window : array
-        Window indices.
+    mask : ndarray of booleans
+        True at the locations in the tiles assigned to shard i_shard.
 
     """
-    i_center = np.where(doys == 365)[0] + 1 \
+    mask = np.zeros(space_shape, dtype=bool)
+    for tile in tiles_of_shard(space_shape, tile_shape, i_shard, n_shards):
+        mask[tile] = True
+    return mask
+
+
+
+def blocks_of_mask(mask, tile_shape):
+    """
+    Yields blocks of locations that together cover all marked locations,
+    namely whole tiles if all their locations are marked and single locations
+    otherwise.
+
+    Parameters
+    ----------
+    mask : ndarray of booleans
+        Marks locations.
+    tile_shape : n-tuple of ints
+        Shape of tiles.
+
+    Yields
+    ------
+    block : n-tuple of slices
+        Block of marked locations.
+
+    """
+    for tile in tiles_of_shard(mask.shape, tile_shape, 0, 1):
+        if np.all(mask[tile]):
+            yield tile
+        else:
+            for i in zip(*np.nonzero(mask[tile])):
+                yield tuple(slice(s.start + j, s.start + j + 1)
+                    for s, j in zip(tile, i))
+
+
+
+def batches(iterable, batch_size):
+    """
+    Yields consecutive items of iterable in lists of length batch_size. The
+    last list may be shorter.
+
+    Parameters
+    ----------
+    iterable : iterable
+        Items to be batched.
+    batch_size : int
+        Number of items per batch.
+
+    Yields
+    ------
+    batch : list
+        Consecutive items of iterable.
+
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+
+def open_input_nc(path, variable, chunk_cache_size=0):
+    """
+    Opens netcdf file for reading and sets the size of the chunk cache of the
+    data variable.
+
+    Parameters
+    ----------
+    path : str
+        Path to netcdf file.
+    variable : str
+        Name of data variable.
+    chunk_cache_size : int, optional
+        Size of chunk cache of data variable in bytes. If 0 then the default
+        chunk cache size is used.
+
+    Returns
+    -------
+    dataset : Dataset
+        Netcdf dataset opened for reading.
+
+    """
+    dataset = Dataset(path, 'r')
+    if chunk_cache_size:
+        dataset[variable].set_var_chunk_cache(size=chunk_cache_size)
+    return dataset
+
+
+
+def load_via_tile_cache(nc_variable, i_loc, tile_cache):
+    """
+    Loads data from nc_variable at i_loc. Instead of loading these data
+    directly, the complete chunk-aligned tile containing i_loc is loaded for all
+    time steps and kept in tile_cache, such that data for the other locations
+    in this tile can later be served from memory. Thereby, every chunk of a
+    compressed netcdf file is decompressed only once. A tile is removed from
+    tile_cache as soon as data for all of its locations have been served. The
+    least recently used tile is removed if tile_cache grows larger than the
+    number of tiles needed to cover the grid for one index value of the first
+    dimension.
+
+    Parameters
+    ----------
+    nc_variable : Dataset.variable
+        Variable of netcdf dataset from which to load.
+    i_loc : n-tuple of ints
+        Location index.
+    tile_cache : OrderedDict
+        Maps the first indices of cached tiles to lists containing the data of
+        these tiles and the number of locations served from them. Is changed
+        in-place.
+
+    Returns
+    -------
+    x : masked array
+        Data at i_loc.
+
+    """
+    space_shape = nc_variable.shape[:-1]
+    tile_shape = spatial_chunk_shape(nc_variable)
+    if not np.prod(tile_shape) > 1:
+        return nc_variable[i_loc]
+
+    # load tile if necessary and mark it as the most recently used one
+    tile = tile_slices(i_loc, space_shape, tile_shape)
+    key = tuple(s.start for s in tile)
+    if key not in tile_cache:
+        tile_cache[key] = [nc_variable[tile], 0]
+        n_tiles_max = 1 + np.prod([-(-n // t)
+            for n, t in zip(space_shape[1:], tile_shape[1:])], dtype=int)
+        while len(tile_cache) > n_tiles_max:
+            tile_cache.popitem(last=False)
+    else:
+        tile_cache.move_to_end(key)
+    entry = tile_cache[key]
+
+    # serve data at i_loc and forget tile once all its data have been served
+    x = entry[0][tuple(i - s.start for i, s in zip(i_loc, tile))].copy()
+    entry[1] += 1
+    if entry[1] == np.prod([s.stop - s.start for s in tile]):
+        del tile_cache[key]
+    return x
+
+
+
+def write_via_tile_buffer(
+        nc_variables, i_block, values, tile_buffer, flush_policy='tile',
+        completed=None):
+    """
+    Writes values to nc_variables at i_block. If flush_policy is 'location'
+    then values are written immediately. If flush_policy is 'tile' then values
+    are collected in tile_buffer until all locations of a tile are complete,
+    where tiles are aligned with the chunks of nc_variables, and then written
+    for the whole tile at once.
+
+    Parameters
+    ----------
+    nc_variables : list of Dataset.variables
+        Variables of netcdf datasets to which to write. Must all have the same
+        shape and chunk shape.
+    i_block : n-tuple of ints or slices
+        Location index or block of location indices at which to write.
+    values : list of arrays or None
+        Values to be written to nc_variables, with the time axis being the last
+        axis. None indicates that there are no values to be written at i_block
+        but that the locations in i_block are complete nonetheless.
+    tile_buffer : dict
+        Maps the first indices of buffered tiles to lists containing the data
+        buffered for these tiles and the number of complete locations in them.
+        Is changed in-place.
+    flush_policy : str, optional
+        When to write values: ['location', 'tile'].
+    completed : list, optional
+        If specified, blocks of locations, given as n-tuples of slices, that
+        have been written to nc_variables or need not be written because they
+        are complete without values are appended to this list.
+
+    Returns
+    -------
+    written : boolean
+        Whether anything has been written to nc_variables, in which case the
+        associated datasets should be synced.
+
+    """
+    block = tuple(s if isinstance(s, slice) else slice(s, s + 1)
+        for s in i_block)
+    if flush_policy == 'location':
+        if completed is not None:
+            completed.append(block)
+        if values is None:
+            return False
+        for nc_variable, x in zip(nc_variables, values):
+            nc_variable[i_block] = x
+        return True
+    elif flush_policy != 'tile':
+        raise ValueError(f'flush_policy {flush_policy} not supported')
+
+    # reshape values to block shape
+    block_shape = tuple(s.stop - s.start for s in block)
+    if values is not None:
+        values = [x.reshape(block_shape + x.shape[-1:]) for x in values]
+
+    # put values into all tiles that overlap with block
+    written = False
+    space_shape = nc_variables[0].shape[:-1]
+    tile_shape = spatial_chunk_shape(nc_variables[0])
+    tile_ranges = [range(s.start // t, (s.stop - 1) // t + 1)
+        for s, t in zip(block, tile_shape)]
+    for k in product(*tile_ranges):
+        tile = tile_slices(tuple(t * j for t, j in zip(tile_shape, k)),
+            space_shape, tile_shape)
+        overlap = tuple(slice(max(s.start, t.start), min(s.stop, t.stop))
+            for s, t in zip(block, tile))
+        key = tuple(t.start for t in tile)
+        entry = tile_buffer.setdefault(key, [None, 0])
+        if values is not None:
+            if entry[0] is None:
+                entry[0] = [np.ma.masked_all(
+                    tuple(t.stop - t.start for t in tile) + v.shape[-1:],
+                    dtype=v.dtype) for v in nc_variables]
+            i_tile = tuple(slice(o.start - t.start, o.stop - t.start)
+                for o, t in zip(overlap, tile))
+            i_values = tuple(slice(o.start - s.start, o.stop - s.start)
+                for o, s in zip(overlap, block))
+            for d, x in zip(entry[0], values):
+                d[i_tile] = x[i_values]
+        entry[1] += np.prod([o.stop - o.start for o in overlap])
+
+        # write tile once it is complete
+        if entry[1] == np.prod([t.stop - t.start for t in tile]):
+            if entry[0] is not None:
+                for nc_variable, d in zip(nc_variables, entry[0]):
+                    nc_variable[tile] = d
+                written = True
+            if completed is not None:
+                completed.append(tile)
+            del tile_buffer[key]
+
+    return written
+
+
+
+def flush_tile_buffer(nc_variables, tile_buffer):
+    """
+    Writes all data remaining in tile_buffer to nc_variables, including data of
+    incomplete tiles, and empties tile_buffer.
+
+    Parameters
+    ----------
+    nc_variables : list of Dataset.variables
+        Variables of netcdf datasets to which to write.
+    tile_buffer : dict
+        Maps the first indices of buffered tiles to lists containing the data
+        buffered for these tiles and the number of complete locations in them.
+        Is changed in-place.
+
+    Returns
+    -------
+    written : boolean
+        Whether anything has been written to nc_variables, in which case the
+        associated datasets should be synced.
+
+    """
+    written = False
+    space_shape = nc_variables[0].shape[:-1]
+    tile_shape = spatial_chunk_shape(nc_variables[0])
+    for key, entry in tile_buffer.items():
+        if entry[0] is not None:
+            tile = tile_slices(key, space_shape, tile_shape)
+            for nc_variable, d in zip(nc_variables, entry[0]):
+                nc_variable[tile] = d
+            written = True
+    tile_buffer.clear()
+    return written
+
+
+
+def prefill_tile_buffer(nc_variables, tile_buffer, done=None, skipped=None):
+    """
+    Prepares tile_buffer for an application in which the locations marked in
+    done or skipped are not processed. Tiles that contain both such locations
+    and others are marked as partially complete. Tiles that contain locations
+    marked in done are moreover filled with the data already stored in
+    nc_variables such that these data are preserved once the tiles are complete
+    and written.
+
+    Parameters
+    ----------
+    nc_variables : list of Dataset.variables
+        Variables of netcdf datasets to which to write.
+    tile_buffer : dict
+        Maps the first indices of buffered tiles to lists containing the data
+        buffered for these tiles and the number of complete locations in them.
+        Is changed in-place.
+    done : ndarray of booleans, optional
+        Marks locations that are complete and not processed again.
+    skipped : ndarray of booleans, optional
+        Marks locations that are not processed because there are no data to be
+        written at these locations.
+
+    """
+    masks = [m for m in (done, skipped) if m is not None]
+    if not masks:
+        return
+    not_processed = np.logical_or.reduce(masks)
+    space_shape = not_processed.shape
+    tile_shape = spatial_chunk_shape(nc_variables[0])
+    n_tiles = tuple(-(-n // t) for n, t in zip(space_shape, tile_shape))
+    for k in np.ndindex(n_tiles):
+        key = tuple(t * j for t, j in zip(tile_shape, k))
+        tile = tile_slices(key, space_shape, tile_shape)
+        n_not_processed = np.sum(not_processed[tile])
+        if 0 < n_not_processed < not_processed[tile].size:
+            data = None
+            if done is not None and np.any(done[tile]):
+                data = [v[tile] for v in nc_variables]
+            tile_buffer[key] = [data, n_not_processed]
+
+
+
+def sample_validity(nc_variable, n_time_steps):
+    """
+    Determines at which locations nc_variable has valid values in at least one
+    of n_time_steps time steps sampled evenly from the whole time series.
+
+    Parameters
+    ----------
+    nc_variable : Dataset.variable
+        Variable of netcdf dataset, with time being the last dimension.
+    n_time_steps : int
+        Number of time steps to sample.
+
+    Returns
+    -------
+    valid : ndarray of booleans
+        Marks locations with valid values in at least one sampled time step.
+
+    """
+    n_times = nc_variable.shape[-1]
+    i_times = np.unique(np.linspace(
+        0, n_times - 1, min(n_time_steps, n_times)).astype(int))
+    x = nc_variable[..., list(i_times)]
+    return np.logical_not(np.all(np.ma.getmaskarray(x), axis=-1))
+
+
+
+def coarsen_mask(mask_fine, downscaling_factors):
+    """
+    Coarsens a mask defined on a fine grid to the corresponding coarse grid.
+
+    Parameters
+    ----------
+    mask_fine : ndarray of booleans
+        Mask on fine grid.
+    downscaling_factors : array of ints
+        Downscaling factors for all grid dimensions.
+
+    Returns
+    -------
+    mask : ndarray of booleans
+        Mask on coarse grid, true where mask_fine is true at all fine grid
+        cells within a coarse grid cell.
+
+    """
+    shape = []
+    for n, df in zip(mask_fine.shape, downscaling_factors):
+        shape += [n // df, df]
+    return np.all(mask_fine.reshape(shape), axis=tuple(range(1, len(shape), 2)))
+
+
+
+def refine_mask(mask, downscaling_factors):
+    """
+    Refines a mask defined on a coarse grid to the corresponding fine grid.
+
+    Parameters
+    ----------
+    mask : ndarray of booleans
+        Mask on coarse grid.
+    downscaling_factors : array of ints
+        Downscaling factors for all grid dimensions.
+
+    Returns
+    -------
+    mask_fine : ndarray of booleans
+        Mask on fine grid, true at all fine grid cells within coarse grid cells
+        where mask is true.
+
+    """
+    mask_fine = mask
+    for axis, df in enumerate(downscaling_factors):
+        mask_fine = np.repeat(mask_fine, df, axis=axis)
+    return mask_fine
+
+
+
+def get_journal_path(path):
+    """
+    Returns the path to the journal of locations that have been completed and
+    written to the output netcdf file at path.
+
+    Parameters
+    ----------
+    path : str
+        Path to output netcdf file.
+
+    Returns
+    -------
+    journal_path : str
+        Path to journal.
+
+    """
+    return path + '.journal'
+
+
+
+def get_shard_path(path, i_shard, n_shards):
+    """
+    Returns the path to the part file to which shard i_shard of n_shards writes
+    instead of the output netcdf file at path.
+
+    Parameters
+    ----------
+    path : str
+        Path to output netcdf file.
+    i_shard : int
+        Index of shard.
+    n_shards : int
+        Number of shards.
+
+    Returns
+    -------
+    shard_path : str
+        Path to part file.
+
+    """
+    root, ext = os.path.splitext(path)
+    return f'{root}_shard{i_shard}of{n_shards}{ext}'
+
+
+
+def get_cost_path(path):
+    """
+    Returns the path to the file with the processing times of all locations
+    whose results are written to the output netcdf file at path.
+
+    Parameters
+    ----------
+    path : str
+        Path to output netcdf file.
+
+    Returns
+    -------
+    cost_path : str
+        Path to npy file with processing times.
+
+    """
+    return path + '.cost.npy'
+
+
+
+def read_cost(cost_path, space_shape):
+    """
+    Reads the processing times of all locations recorded by a previous
+    application.
+
+    Parameters
+    ----------
+    cost_path : str
+        Path to npy file with processing times.
+    space_shape : tuple of ints
+        Shape of grid.
+
+    Returns
+    -------
+    cost : ndarray or None
+        Processing time of every location in seconds, nan where it has not
+        been recorded. None if there is no such file or if its shape does not
+        match space_shape.
+
+    """
+    if not os.path.isfile(cost_path):
+        return None
+    cost = np.load(cost_path)
+    return cost if cost.shape == tuple(space_shape) else None
+
+
+
+def time_batch(function, batch):
+    """
+    Applies function to batch and measures how long this takes.
+
+    Parameters
+    ----------
+    function : function
+        Function to be applied to batch.
+    batch : list of tuples
+        Location indices.
+
+    Returns
+    -------
+    batch : list of tuples
+        Location indices.
+    seconds : float
+        Wall-clock time spent in function.
+
+    """
+    t0 = time.perf_counter()
+    function(batch)
+    return batch, time.perf_counter() - t0
+
+
+
+def record_cost(cost, timed_batches):
+    """
+    Records the processing times of batches of locations, dividing the time
+    spent on a batch evenly among its locations.
+
+    Parameters
+    ----------
+    cost : ndarray
+        Processing time of every location in seconds. Is changed in-place.
+    timed_batches : iterable of tuples
+        Batches of location indices with the time spent on them, as returned
+        by time_batch.
+
+    """
+    for batch, seconds in timed_batches:
+        for i_loc in batch:
+            cost[i_loc] = seconds / len(batch)
+
+
+
+def get_statistics_key(path, **options):
+    """
+    Returns a key that identifies statistics computed from the input netcdf
+    file at path with the given options. The file is identified by its real
+    path, size, and modification time, such that the key changes whenever the
+    file is replaced or modified, without reading all its data.
+
+    Parameters
+    ----------
+    path : str
+        Path to input netcdf file.
+    **options : Options the statistics depend on.
+
+    Returns
+    -------
+    key : str
+        Hexadecimal hash of file identity and options.
+
+    """
+    s = os.stat(path)
+    items = [os.path.realpath(path), s.st_size, s.st_mtime_ns]
+    items += sorted(options.items())
+    return hashlib.sha1(repr(items).encode()).hexdigest()
+
+
+
+def open_statistics_store(path, key, space_shape, fields):
+    """
+    Opens the memory-mapped npy files with statistics of all locations stored
+    in the directory key within the directory path, creating them as needed.
+    Statistics that have not been computed yet are nan. New files are created
+    under a temporary name and then renamed, such that several applications
+    may open and fill the same store concurrently. Since the stored values
+    are deterministic, the worst that can happen then is that some values
+    are computed more than once.
+
+    Parameters
+    ----------
+    path : str
+        Path to directory of statistics store.
+    key : str
+        Key of statistics, as returned by get_statistics_key.
+    space_shape : tuple of ints
+        Shape of grid.
+    fields : dict of str : tuple of ints
+        Keys : names of statistics.
+        Values : shapes of statistics per location.
+
+    Returns
+    -------
+    store : dict of str : numpy.memmap
+        Keys : names of statistics.
+        Values : memory-mapped arrays of shape space_shape + fields[name].
+
+    """
+    directory = os.path.join(path, key)
+    os.makedirs(directory, exist_ok=True)
+    store = {}
+    for name, shape in fields.items():
+        field_path = os.path.join(directory, name + '.npy')
+        shape = tuple(space_shape) + tuple(shape)
+        if os.path.isfile(field_path):
+            x = np.load(field_path, mmap_mode='r+')
+            if x.shape == shape:
+                store[name] = x
+                continue
+        tmp_path = f'{field_path}.{os.getpid()}.tmp'
+        x = np.lib.format.open_memmap(tmp_path, 'w+', np.float64, shape)
+        x[...] = np.nan
+        x.flush()
+        del x
+        os.replace(tmp_path, field_path)
+        store[name] = np.load(field_path, mmap_mode='r+')
+    return store
+
+
+
+def load_or_compute_statistic(store, name, i_locations, compute):
+    """
+    Returns a statistic of several locations from a statistics store if it
+    has been stored for all of them, otherwise computes it and stores it.
+
+    Parameters
+    ----------
+    store : dict of str : numpy.memmap or None
+        Statistics store as returned by open_statistics_store. If None then
+        the statistic is computed.
+    name : str
+        Name of statistic.
+    i_locations : list of tuples
+        Location indices.
+    compute : function
+        Computes the statistic without arguments. Its result has the
+        locations in the last axis if there is more than one location.
+
+    Returns
+    -------
+    x : scalar or array
+        Statistic of all locations.
+
+    """
+    if store is not None and name in store:
+        x = np.stack([store[name][i_loc] for i_loc in i_locations], axis=-1)
+        if not np.any(np.isnan(x)):
+            return np.take(x, 0, -1) if len(i_locations) == 1 else x
+    x = compute()
+    # masked values cannot be stored
+    if store is not None and name in store and not np.ma.is_masked(x):
+        x_ = np.ma.getdata(x)
+        for k, i_loc in enumerate(i_locations):
+            store[name][i_loc] = x_ if len(i_locations) == 1 else x_[...,k]
+    return x
+
+
+
+def assert_completeness_of_shards(paths, space_shape, tile_shape, n_shards):
+    """
+    Raises an AssertionError if the part file of any shard is missing for any
+    output netcdf file or if the journal of any shard, which is kept next to
+    the part file of the first output netcdf file, does not record all tiles
+    assigned to that shard as completed.
+
+    Parameters
+    ----------
+    paths : list of strs
+        Paths to output netcdf files.
+    space_shape : n-tuple of ints
+        Shape of grid of output netcdf files.
+    tile_shape : tuple of ints
+        Shape of the tiles assigned to shards, in units of locations of the
+        output netcdf files.
+    n_shards : int
+        Number of shards.
+
+    """
+    for i_shard in range(n_shards):
+        for path in paths:
+            shard_path = get_shard_path(path, i_shard, n_shards)
+            msg = f'shard {i_shard} of {n_shards} is incomplete: found no ' \
+                f'part file {shard_path}'
+            assert os.path.isfile(shard_path), msg
+        journal_path = get_journal_path(
+            get_shard_path(paths[0], i_shard, n_shards))
+        done = read_journal(journal_path, space_shape)
+        n_missing = sum(np.sum(np.logical_not(done[tile])) for tile in
+            tiles_of_shard(space_shape, tile_shape, i_shard, n_shards))
+        msg = f'shard {i_shard} of {n_shards} is incomplete: {n_missing} ' \
+            f'locations are not recorded as completed in {journal_path}'
+        assert not n_missing, msg
+
+
+
+def merge_shards(path, variable, tile_shape, n_shards):
+    """
+    Copies the tiles assigned to each of n_shards from the part file of that
+    shard to the output netcdf file at path. Data are copied without masking
+    and scaling, i.e., as stored in the part files.
+
+    Parameters
+    ----------
+    path : str
+        Path to output netcdf file.
+    variable : str
+        Name of variable to be copied.
+    tile_shape : tuple of ints
+        Shape of the tiles assigned to shards, in units of locations of the
+        output netcdf file.
+    n_shards : int
+        Number of shards.
+
+    """
+    with Dataset(path, 'r+') as dst:
+        v_dst = dst[variable]
+        v_dst.set_auto_maskandscale(False)
+        space_shape = v_dst.shape[:-1]
+        for i_shard in range(n_shards):
+            shard_path = get_shard_path(path, i_shard, n_shards)
+            with Dataset(shard_path, 'r') as src:
+                v_src = src[variable]
+                v_src.set_auto_maskandscale(False)
+                msg = f'found shape mismatch in {shard_path}'
+                assert v_src.shape == v_dst.shape, msg
+                for tile in tiles_of_shard(
+                    space_shape, tile_shape, i_shard, n_shards):
+                    v_dst[tile] = v_src[tile]
+
+
+
+def read_journal(journal_path, space_shape):
+    """
+    Reads the journal of completed locations. Lines that have not been written
+    completely, for example because the application writing the journal has
+    been interrupted, are ignored.
+
+    Parameters
+    ----------
+    journal_path : str
+        Path to journal.
+    space_shape : n-tuple of ints
+        Shape of grid.
+
+    Returns
+    -------
+    done : ndarray of booleans
+        Marks completed locations.
+
+    """
+    done = np.zeros(space_shape, dtype=bool)
+    if not os.path.isfile(journal_path):
+        return done
+    with open(journal_path, 'r') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                continue
+            try:
+                bounds = [[int(i) for i in b.split(':')]
+                    for b in line.strip().split(',')]
+            except ValueError:
+                continue
+            if len(bounds) == len(space_shape) and \
+                all(len(b) == 2 for b in bounds):
+                done[tuple(slice(*b) for b in bounds)] = True
+    return done
+
+
+
+def open_journal(journal_path):
+    """
+    Opens the journal of completed locations for appending. If the last line of
+    the journal has not been written completely then it is terminated such that
+    it is ignored by read_journal.
+
+    Parameters
+    ----------
+    journal_path : str
+        Path to journal.
+
+    Returns
+    -------
+    journal : file object
+        Journal opened for appending.
+
+    """
+    terminated = True
+    if os.path.isfile(journal_path) and os.path.getsize(journal_path):
+        with open(journal_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            terminated = f.read(1) == b'\n'
+    journal = open(journal_path, 'a')
+    if not terminated:
+        journal.write('\n')
+    return journal
+
+
+
+def append_to_journal(journal, blocks):
+    """
+    Appends completed blocks of locations to the journal and makes sure they
+    are written to disk.
+
+    Parameters
+    ----------
+    journal : file object or None
+        Journal opened for appending. Nothing is done if journal is None.
+    blocks : list of n-tuples of slices
+        Completed blocks of locations.
+
+    """
+    if journal is None or not blocks:
+        return
+    for block in blocks:
+        journal.write(','.join(f'{s.start}:{s.stop}' for s in block) + '\n')
+    journal.flush()
+    os.fsync(journal.fileno())
+
+
+
+def allocate_shared_slots(n_slots, region_sizes):
+    """
+    Allocates one block of shared memory per slot, every block being divided
+    into regions that can hold up to a given number of array elements of up to
+    8 bytes each plus the corresponding mask. Slots are meant to be allocated
+    before processes are forked such that all processes can access them.
+
+    Parameters
+    ----------
+    n_slots : int
+        Number of slots to allocate.
+    region_sizes : dict
+        Maps region keys to the maximum number of array elements to be stored
+        in these regions.
+
+    Returns
+    -------
+    slots : list of multiprocessing.RawArrays
+        Blocks of shared memory, one per slot.
+    regions : dict
+        Maps region keys to tuples containing the byte offsets of these regions
+        within slots and the maximum number of array elements to be stored in
+        these regions.
+
+    """
+    regions = {}
+    n_bytes = 0
+    for key, n in region_sizes.items():
+        regions[key] = (n_bytes, n)
+        n_bytes += 8 * ((9 * n + 7) // 8)
+    slots = [mp.RawArray('B', max(n_bytes, 1)) for i in range(n_slots)]
+    return slots, regions
+
+
+
+def put_into_shared_slot(slot, region, x):
+    """
+    Copies x into region of slot.
+
+    Parameters
+    ----------
+    slot : multiprocessing.RawArray
+        Block of shared memory.
+    region : tuple
+        Byte offset of region within slot and maximum number of array elements
+        to be stored in region.
+    x : array or masked array
+        Array to copy.
+
+    Returns
+    -------
+    descriptor : tuple
+        Data type, shape, and whether x is a masked array, to be passed on to
+        get_from_shared_slot together with slot and region.
+
+    """
+    offset, n = region
+    msg = 'array does not fit into shared memory region'
+    assert x.size <= n and x.dtype.itemsize <= 8, msg
+    descriptor = (x.dtype.str, x.shape, isinstance(x, np.ma.MaskedArray))
+    d, m = shared_slot_views(slot, region, descriptor)
+    d[...] = np.ma.getdata(x)
+    if descriptor[2]:
+        m[...] = np.ma.getmaskarray(x)
+    return descriptor
+
+
+
+def get_from_shared_slot(slot, region, descriptor):
+    """
+    Returns array stored in region of slot without copying it.
+
+    Parameters
+    ----------
+    slot : multiprocessing.RawArray
+        Block of shared memory.
+    region : tuple
+        Byte offset of region within slot and maximum number of array elements
+        to be stored in region.
+    descriptor : tuple
+        Data type, shape, and whether the array is a masked array, as returned
+        by put_into_shared_slot.
+
+    Returns
+    -------
+    x : array or masked array
+        View of the array stored in region of slot.
+
+    """
+    d, m = shared_slot_views(slot, region, descriptor)
+    return np.ma.MaskedArray(d, mask=m, copy=False) if descriptor[2] else d
+
+
+
+def shared_slot_views(slot, region, descriptor):
+    """
+    Returns data and mask views of region of slot.
+
+    Parameters
+    ----------
+    slot : multiprocessing.RawArray
+        Block of shared memory.
+    region : tuple
+        Byte offset of region within slot and maximum number of array elements
+        to be stored in region.
+    descriptor : tuple
+        Data type, shape, and whether the array is a masked array.
+
+    Returns
+    -------
+    d : ndarray
+        Data view.
+    m : ndarray
+        Mask view.
+
+    """
+    offset, n = region
+    dtype, shape, masked = descriptor
+    size = int(np.prod(shape))
+    d = np.frombuffer(slot, dtype=dtype, count=size, offset=offset)
+    m = np.frombuffer(slot, dtype=bool, count=size, offset=offset + 8 * n)
+    return d.reshape(shape), m.reshape(shape)
+
+
+
+def extended_load(nc_variable, i_loc, space_shape, circular, band_cache=None):
+    """
+    Loads data from nc_variable for grid window of width 3 by 3 by 3 by ...
+    around i_loc. Data beyond the grid boundaries, defined by space_shape, are
+    set to nan unless circular indicates that for a given dimension data from
+    the other end of the grid can be used. Missing values and infs in the input
+    data are replaced by nans. If band_cache is given then complete rows, i.e.,
+    all data for one index value of the first dimension, are loaded instead of
+    single locations and kept in band_cache, such that the windows around
+    neighbouring locations can be assembled from memory. The least recently
+    used row is removed if band_cache grows larger than the number of rows
+    needed to cover one chunk-aligned band of the grid plus its two
+    neighbouring rows.
+
+    Parameters
+    ----------
+    nc_variable : Dataset.variable
+        Variable of netcdf dataset from which to load.
+    i_loc : n-tuple of ints
+        Index around which to do the extended load.
+    space_shape : n-tuple of ints
+        Shape of grid from which to do the extended load.
+    circular : n-tuple of booleans
+        Whether coordinates are circular.
+    band_cache : OrderedDict, optional
+        Maps the first indices of cached rows to the data of these rows. Is
+        changed in-place.
+
+    Returns
+    -------
+    x : masked array
+        Original data at i_loc.
+    x_extended : ndarray
+        Data for grid window of width 3 by 3 by 3 by ...
+
+    """
+    ndim = len(i_loc)
+    msg = 'input tuples must have uniform length'
+    assert ndim == len(space_shape) == len(circular), msg
+    if band_cache is None:
+        load = lambda j: nc_variable[j]
+    else:
+        n_rows_max = min(space_shape[0],
+            spatial_chunk_shape(nc_variable)[0] + 2)
+        def load(j):
+            # load row if necessary and mark it as the most recently used one
+            if j[0] not in band_cache:
+                band_cache[j[0]] = nc_variable[j[0]]
+                while len(band_cache) > n_rows_max:
+                    band_cache.popitem(last=False)
+            else:
+                band_cache.move_to_end(j[0])
+            return band_cache[j[0]][j[1:]]
+    x = load(tuple(i_loc))
+    if band_cache is not None:
+        x = x.copy()
+    x_extended_space_shape = (3,) * ndim
+    x_extended = np.empty(x_extended_space_shape + x.shape, dtype=x.dtype)
+    for i in np.ndindex(x_extended_space_shape):
+        j_raw = np.array(i_loc) + np.array(i) - 1
+        j = np.where(circular, j_raw % np.array(space_shape), j_raw)
+        if np.any(j < 0) or np.any(j > np.array(space_shape) - 1):
+            x_extended[i] = np.nan
+        else:
+            x_extended[i] = ma2a(load(tuple(int(k) for k in j)))
+    return x, x_extended
+
+
+
+def xipm1(x, i):
+    """
+    Extract points from x at position i +- 1, linearly extrapolating beyond
+    the limits of x.
+
+    Parameters
+    ----------
+    x : array
+        Array from which to do the extraction.
+    i : int
+        Index around which to do the extraction.
+
+    Returns
+    -------
+    y : array
+        Extracted points.
+
+    """
+    n = x.size
+    assert n > 1, 'x too short'
+    y0 = 2 * x[0] - x[1] if i == 0 else x[i-1]
+    y1 = x[i]
+    y2 = 2 * x[-1] - x[-2] if i == n - 1 else x[i+1]
+    y = np.array([y0, y1, y2])
+    return y
+
+
+
+def get_remapbil_operator(igrid, ogrid, ascending):
+    """
+    Computes the indices and weights used by remapbil to remap values from
+    igrid to ogrid, such that these can be used to remap any number of arrays
+    of values with the same grids.
+
+    Parameters
+    ----------
+    igrid : list of arrays
+        Input grid coordinates. It is expected that all arrays have length 3.
+    ogrid : list of arrays
+        Output grid coordinates.
+    ascending : tuple of booleans
+        A tuple of the same length as igrid and ogrid. For every dimension, it
+        specifies whether the coordinates in igrid are monotonically increasing
+        (True) or decreasing (False).
+
+    Returns
+    -------
+    operator : dict
+        Key 'shape' holds the shape of ogrid. Key 'corners' holds one tuple
+        per corner of the cells of igrid, which consists of the indices of the
+        values at this corner for all points of ogrid and the factors of their
+        weights per dimension.
+
+    """
+    # find lower edge of every point in ogrid
+    indices = []
+    # compute distance to lower edge in unity units
+    norm_distances = []
+    # lower edge index functions
+    i_ascending = lambda x, y: np.searchsorted(y, x) - 1
+    i_descending = lambda x, y: y.size - 1 - np.searchsorted(
+        y, x, 'right', np.arange(y.size - 1,-1,-1))
+    # loop over dimensions
+    for a, x, y in zip(ascending, ogrid, igrid):
+        i = i_ascending(x, y) if a else i_descending(x, y)
+        indices.append(i)
+        norm_distances.append((x - y[i]) / (y[i + 1] - y[i]))
+
+    # compute indices and weight factors for every corner
+    ndim = len(igrid)
+    corners = []
+    for corner in product((0, 1), repeat=ndim):
+        factors = []
+        for i, (c, w) in enumerate(zip(corner, norm_distances)):
+            wshape = (1,) * i + (w.size,) + (1,) * (ndim - 1 - i)
+            factors.append(np.where(c, w, 1 - w).reshape(wshape))
+        corners.append((np.ix_(*(index + c
+            for index, c in zip(indices, corner))), factors))
+    return {'shape': tuple(len(grid) for grid in ogrid), 'corners': corners}
+
+
+
+def remapbil(ivalues, igrid, ogrid, ascending, operator=None):
+    """
+    Remaps ivalues from igrid to ogrid using multilinear interpolation on a
+    regular grid in arbitrary dimensions. NaNs resulting from the interpolation
+    are replaced by ivalues from the central grid cell of igrid, with the
+    following background. Where multilinear interpolation is not possible due to
+    missing values in neighbouring coarse grid cells, values obtained with
+    nearest neighbour interpolation are filled in. In the end, every fine grid
+    cell fully contained in a coarse grid cell with available data should also
+    have available data.
+
+    This code was inspired by scipy.interpolate.RegularGridInterpolator.
+
+    Parameters
+    ----------
+    ivalues : ndarray
+        Values on input grid. This ndarray can have more dimensions than igrid,
+        ogrid, and ascending. If this is the case then remapping is broadcasted
+        to the additional, trailing dimensions.
+    igrid : list of arrays
+        Input grid coordinates. It is expected that all arrays have length 3.
+    ogrid : list of arrays
+        Output grid coordinates.
+    ascending : tuple of booleans
+        A tuple of the same length as igrid and ogrid. For every dimension, it
+        specifies whether the coordinates in igrid are monotonically increasing
+        (True) or decreasing (False).
+    operator : dict, optional
+        Result of get_remapbil_operator for igrid, ogrid, and ascending. Used
+        instead of computing it again if not None.
+
+    Returns
+    -------
+    ovalues : ndarray
+        Interpolated values on output grid.
+
+    """
+    if operator is None:
+        operator = get_remapbil_operator(igrid, ogrid, ascending)
+
+    # interpolate using weights, for all points of ogrid at once
+    ndim = len(operator['shape'])
+    ndim_trailing = ivalues.ndim - ndim
+    ovalues = None
+    for index, factors in operator['corners']:
+        weights = np.ones(operator['shape'], dtype=ivalues.dtype)
+        for factor in factors:
+            weights *= factor
+        term = ivalues[index] * weights.reshape(
+            weights.shape + (1,) * ndim_trailing)
+        if ovalues is None: ovalues = term
+        else: ovalues += term
+
+    # replace nans by ivalues from central grid cell of igrid
+    return np.where(np.isnan(ovalues), ivalues[(1,) * ndim], ovalues)
+
+
+
+def window_centers_for_running_bias_adjustment(doys, step_size):
+    """
+    Returns window centers for bias adjustment in running-window mode.
+
+    Parameters
+    ----------
+    doys : array
+        Day-of-year time series of historical input data.
+    step_size : int
+        Step size in number of days used for bias adjustment in running-window
+        mode.
+
+    Returns
+    -------
+    doys_center : array
+        Window centers for bias adjustment in running-window mode. In 
+        day-of-year units.
+
+    """
+    doy_max = np.max(doys)
+    doy_mod = doy_max % step_size
+    doys_center_first = 1 + step_size // 2
+    # make sure first and last window have the same length +- 1
+    if doy_mod: doys_center_first -= (step_size - doy_mod) // 2
+    doys_center = np.arange(doys_center_first, doy_max+1, step_size)
+    return doys_center
+
+
+
+def get_month_indices(month_numbers, months, key=''):
+    """
+    Returns the indices of the time steps of every given calendar month.
+
+    Parameters
+    ----------
+    month_numbers : array
+        Month number time series.
+    months : list of ints
+        List of ints from {1,...,12} representing calendar months.
+    key : str, optional
+        Name of the dataset, used in the error message.
+
+    Returns
+    -------
+    i_months : list of arrays
+        Indices of the time steps of every calendar month in months.
+
+    """
+    i_months = []
+    for month in months:
+        i = np.flatnonzero(month_numbers == month)
+        assert i.size, f'no data found for month {month} in {key}'
+        i_months.append(i)
+    return i_months
+
+
+
+def window_indices_for_running_bias_adjustment(
+        doys, window_center, window_width, years=None):
+    """
+    Returns window indices for data selection for bias adjustment in
+    running-window mode.
+
+    Parameters
+    ----------
+    doys : array
+        Day-of-year time series associated to data array from which data shall
+        be selected using the resulting indices.
+    window_center : int
+        Day of year at the center of each window.
+    window_width : int
+        Width of each window in days.
+    years : array, optional
+        Year time series associated to data array from which data shall
+        be selected using the resulting indices. If provided, it is ensured
+        that windows do not extend into the following or previous year.
+
+    Returns
+    -------
+    i_window : array
+        Window indices.
+
+    """
+    i_center = np.where(doys == 365)[0] + 1 \
                if window_center == 366 else \
                np.where(doys == window_center)[0]
     h = window_width // 2
@@ -809,7 +2242,8 @@ def window_indices_for_running_bias_adjustment(
 def aggregate_periodic(a, halfwin, aggregator='mean'):
     """
     Aggregates a using the given aggregator and a running window of length
-    2 * halfwin + 1 assuming that a is periodic.
+    2 * halfwin + 1 assuming that a is periodic. If a has more than one
+    dimension then it is aggregated along axis 0, location by location.
 
     Parameters
     ----------
@@ -830,27 +2264,25 @@ def aggregate_periodic(a, halfwin, aggregator='mean'):
     if not halfwin: return a
 
     # extend a periodically
-    n = a.size
+    n = a.shape[0]
     assert n >= halfwin, 'length of a along axis 0 less than halfwin'
     b = np.concatenate((a[-halfwin:], a, a[:halfwin]))
 
-    # aggregate using algorithm for max inspired by
-    # <http://p-nand-q.com/python/algorithms/searching/max-sliding-window.html>
+    # aggregate all windows at once by taking the elementwise maximum of the
+    # window-length shifted copies of b, which is exact
     window = 2 * halfwin + 1
     if aggregator == 'max':
-        c = list(np.maximum.accumulate(b[:window][::-1]))
-        rm = np.empty_like(a)
-        rm[0] = c[-1]
-        for i in range(n-1):
-            c_new = b[i+window]
-            del c[-1]
-            for j in range(window-1):
-                if c_new > c[j]: c[j] = c_new
-                else: break
-            c.insert(0, c_new)
-            rm[i+1] = c[-1]
+        rm = np.array(b[:n])
+        for i in range(1, window):
+            np.maximum(rm, b[i:i+n], out=rm)
     elif aggregator == 'mean':
-        rm = convolve(b, np.repeat(1./window, window), 'valid')
+        kernel = np.repeat(1./window, window)
+        if a.ndim == 1:
+            rm = convolve(b, kernel, 'valid')
+        else:
+            rm = np.stack([convolve(b[(slice(None),) + i], kernel, 'valid')
+                for i in np.ndindex(a.shape[1:])], axis=1).reshape(
+                (n,) + a.shape[1:])
     else:
         raise ValueError(f'aggregator {aggregator} not supported')
 
@@ -867,6 +2299,8 @@ def get_upper_bound_climatology(d, doys, halfwin):
     ----------
     d : array
         Time series for which annual cycles of upper bounds shall be estimated.
+        If d has more than one dimension then axis 0 is the time axis and
+        annual cycles are estimated location by location.
     doys : array
         Day of the year time series corresponding to d.
     halfwin : int
@@ -875,12 +2309,12 @@ def get_upper_bound_climatology(d, doys, halfwin):
     Returns
     -------
     ubc : array
-        Upper bound climatology.
+        Upper bound climatology. Has the same dimensions as d.
     doys_unique : array
         Days of the year of upper bound climatology.
 
     """
-    assert d.shape == doys.shape, 'd and doys differ in shape' 
+    assert d.shape[0] == doys.size, 'd and doys differ in length'
 
     # check length of time axis of resulting array
     doys_unique, counts = np.unique(doys, return_counts=True)
@@ -892,22 +2326,24 @@ def get_upper_bound_climatology(d, doys, halfwin):
 
     # compute multi year daily maximum
     d_sorted = d[np.argsort(doys)]
-    mydm = np.empty(n, dtype=d.dtype)
+    space_shape = d.shape[1:]
+    mydm = np.empty((n,) + space_shape, dtype=d.dtype)
     if np.unique(counts[:-1]).size == 1:
         # fast version which applies in the usual case
         if counts[0] == counts[-1]:
-            d_stacked = d_sorted.reshape(n, counts[0])
+            d_stacked = d_sorted.reshape((n, counts[0]) + space_shape)
             mydm = np.max(d_stacked, axis=1) 
         else:
-            mydm[-1] =  np.max(d_sorted[-counts[-1]:])
-            d_stacked = d_sorted[:-counts[-1]].reshape(n-1, counts[0])
+            mydm[-1] =  np.max(d_sorted[-counts[-1]:], axis=0)
+            d_stacked = d_sorted[:-counts[-1]].reshape(
+                (n-1, counts[0]) + space_shape)
             mydm[:-1] = np.max(d_stacked, axis=1) 
     else:
         # slow version which always works
         j = 0
         for i in range(n):
             k = j + counts[i]
-            mydm[i] = np.max(d_sorted[j:k])
+            mydm[i] = np.max(d_sorted[j:k], axis=0)
             j = k
 
     # smooth multi year daily maximum
@@ -941,27 +2377,49 @@ def ccs_transfer_sim2obs_upper_bound_climatology(obs_hist, sim_hist, sim_fut):
         Result of climate change signal transfer.
 
     """
-    assert obs_hist.shape == sim_hist.shape == sim_fut.shape, \
-        'obs_hist, sim_hist, sim_fut differ in shape'
-    with np.errstate(divide='ignore', invalid='ignore'):
-        change_factor = np.where(sim_hist == 0, 1, sim_fut / sim_hist)
-    change_factor = np.maximum(.1, np.minimum(10., change_factor))
-    sim_fut_ba = obs_hist * change_factor
-    return sim_fut_ba
+    assert obs_hist.shape == sim_hist.shape == sim_fut.shape, \
+        'obs_hist, sim_hist, sim_fut differ in shape'
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change_factor = np.where(sim_hist == 0, 1, sim_fut / sim_hist)
+    change_factor = np.maximum(.1, np.minimum(10., change_factor))
+    sim_fut_ba = obs_hist * change_factor
+    return sim_fut_ba
+
+
+
+def get_upper_bound_climatology_indices(doys):
+    """
+    Returns the indices of the elements of an upper bound climatology computed
+    by get_upper_bound_climatology that correspond to doys.
+
+    Parameters
+    ----------
+    doys : array
+        Day of the year time series.
+
+    Returns
+    -------
+    i_ubc : array
+        Indices of the elements of the upper bound climatology, one per
+        element of doys.
+
+    """
+    return np.unique(doys, return_inverse=True)[1].reshape(doys.shape)
 
 
 
 def scale_by_upper_bound_climatology(
-        d, ubc, d_doys, ubc_doys, divide=True):
+        d, ubc, d_doys, ubc_doys, divide=True, i_ubc=None):
     """
     Scales all values in d using the annual cycle of upper bounds.
 
     Parameters
     ----------
     d : array
-        Time series to be scaled. Is changed in-place.
+        Time series to be scaled. Is changed in-place. If d has more than one
+        dimension then axis 0 is the time axis.
     ubc : array
-        Upper bound climatology used for scaling.
+        Upper bound climatology used for scaling. Has the same dimensions as d.
     d_doys : array
         Days of the year corresponding to d.
     ubc_doys : array
@@ -969,10 +2427,14 @@ def scale_by_upper_bound_climatology(
     divide : boolean, optional
         If True then d is divided by upper_bound_climatology, otherwise they
         are multiplied.
+    i_ubc : array, optional
+        Indices of the elements of ubc that correspond to d_doys, e.g.,
+        precomputed by get_upper_bound_climatology_indices. Computed from
+        d_doys and ubc_doys if not provided.
 
     """
-    assert d.shape == d_doys.shape, 'd and d_doys differ in shape' 
-    assert ubc.shape == ubc_doys.shape, 'ubc and ubc_doys differ in shape' 
+    assert d.shape[0] == d_doys.size, 'd and d_doys differ in length' 
+    assert ubc.shape[0] == ubc_doys.size, 'ubc and ubc_doys differ in length' 
 
     if divide:
         with np.errstate(divide='ignore', invalid='ignore'):
@@ -982,8 +2444,9 @@ def scale_by_upper_bound_climatology(
 
     # use fast solution if ubc covers all days of the year
     # this fast solution assumes that ubc_doys is sorted
-    scaling_factors_broadcasted = scaling_factors[d_doys-1] \
-        if ubc.size == 366 else \
+    scaling_factors_broadcasted = scaling_factors[i_ubc] \
+        if i_ubc is not None else scaling_factors[d_doys-1] \
+        if ubc_doys.size == 366 else \
         np.array([scaling_factors[ubc_doys == doy][0] for doy in d_doys])
 
     d *= scaling_factors_broadcasted
@@ -1006,7 +2469,9 @@ def subtract_or_add_trend(x, years, trend=None):
     Parameters
     ----------
     x : array
-        Time series.
+        Time series. If x has more than one dimension then axis 0 is the time
+        axis and trends are computed and subtracted or added location by
+        location.
     years : array
         Years of time points of x used to subtract or add trend at annual
         temporal resolution.
@@ -1022,6 +2487,8 @@ def subtract_or_add_trend(x, years, trend=None):
         Trend line. Is only returned if the parameter trend is None.
 
     """
+    if x.ndim > 1:
+        return subtract_or_add_trend_2d(x, years, trend)
     assert x.size == years.size, 'size of x != size of years'
     unique_years = np.unique(years)
 
@@ -1057,7 +2524,68 @@ def subtract_or_add_trend(x, years, trend=None):
 
 
 
-def percentile1d(a, p):
+def subtract_or_add_trend_2d(x, years, trend=None):
+    """
+    Column-wise version of subtract_or_add_trend for 2d arrays. Annual means
+    and trend lines are computed for all columns at once and only the linear
+    regressions are done column by column. The results are the same as those
+    of subtract_or_add_trend applied to every column.
+
+    Parameters
+    ----------
+    x : ndarray
+        Time series, one per column.
+    years : array
+        Years of time points of x used to subtract or add trend at annual
+        temporal resolution.
+    trend : ndarray, optional
+        Trend lines, one per column. If provided then these are the trend lines
+        added to x. Otherwise, trend lines are computed and subtracted from x.
+
+    Returns
+    -------
+    y : ndarray
+        Result of trend subtraction or addition from or to x.
+    trend : ndarray, optional
+        Trend lines. Are only returned if the parameter trend is None.
+
+    """
+    assert x.shape[0] == years.size, 'length of x != size of years'
+    unique_years, i_years = np.unique(years, return_inverse=True)
+
+    # compute trend
+    if trend is None:
+        # average over contiguous rows to get the same annual means as for 1d
+        # arrays
+        annual_means = np.stack([np.mean(np.ascontiguousarray(
+            x[years == y].T), axis=1) for y in unique_years], axis=1)
+        trend = np.zeros((unique_years.size, x.shape[1]))
+        for j in range(x.shape[1]):
+            r = sps.linregress(unique_years, annual_means[j])
+            if r.pvalue < .05:  # detrend preserving multi-year mean value
+                trend[:,j] = r.slope * (unique_years - np.mean(unique_years))
+        return_trend = True
+    else:
+        msg = 'size of trend array != number of unique years'
+        assert trend.shape[0] == unique_years.size, msg
+        trend = -trend
+        return_trend = False
+
+    # subtract or add trend, casting trend values to the data type that is
+    # used when they are subtracted as scalars from 1d arrays
+    trend_cast = trend.astype(np.result_type(x, trend.dtype.type(0)))
+    y = np.empty_like(x)
+    y[:] = x - trend_cast[i_years.ravel()]
+
+    # return result(s)
+    if return_trend:
+        return y, trend
+    else:
+        return y
+
+
+
+def percentile1d(a, p, is_sorted=False):
     """
     Fast version of np.percentile with linear interpolation for 1d arrays
     inspired by
@@ -1070,6 +2598,8 @@ def percentile1d(a, p):
     p : array
         Percentages expressed as real numbers in [0, 1] for which percentiles
         are computed.
+    is_sorted : boolean, optional
+        If True then a is assumed to be sorted already.
 
     Returns
     -------
@@ -1078,7 +2608,7 @@ def percentile1d(a, p):
 
     """
     n = a.size - 1
-    b = np.sort(a)
+    b = a if is_sorted else np.sort(a)
     i = n * p
     i_below = np.floor(i).astype(int)
     w_above = i - i_below
@@ -1086,11 +2616,197 @@ def percentile1d(a, p):
 
 
 
+def update_sorted_sample(b, x_leave, x_enter):
+    """
+    Removes values from and adds values to a sorted array without sorting the
+    whole array again.
+
+    Parameters
+    ----------
+    b : array
+        Sorted 1d array.
+    x_leave : array
+        Values to be removed from b. Every value has to occur in b at least as
+        often as in x_leave.
+    x_enter : array
+        Values to be added to b.
+
+    Returns
+    -------
+    b : array
+        Sorted 1d array with the values of x_leave removed and the values of
+        x_enter added.
+
+    """
+    if x_leave.size:
+        x = np.sort(x_leave)
+        # remove repeated values at consecutive positions
+        i = np.searchsorted(b, x) + np.arange(x.size) - np.searchsorted(x, x)
+        b = np.delete(b, i)
+    if x_enter.size:
+        x = np.sort(x_enter)
+        b = np.insert(b, np.searchsorted(b, x), x)
+    return b
+
+
+
+def percentile2d(a, p, is_sorted=False):
+    """
+    Column-wise version of percentile1d for 2d arrays.
+
+    Parameters
+    ----------
+    a : ndarray
+        Input array.
+    p : array
+        Percentages expressed as real numbers in [0, 1] for which percentiles
+        are computed.
+    is_sorted : boolean, optional
+        If True then every column of a is assumed to be sorted already.
+
+    Returns
+    -------
+    percentiles : ndarray
+        Percentiles, one column per column of a.
+
+    """
+    n = a.shape[0] - 1
+    b = a if is_sorted else np.sort(a, axis=0)
+    i = n * p
+    i_below = np.floor(i).astype(int)
+    w_above = (i - i_below)[:,None]
+    return b[i_below] * (1. - w_above) + b[i_below + (i_below < n)] * w_above
+
+
+
+def interp2d(x, xp, fp):
+    """
+    Column-wise version of np.interp for 2d arrays, which gives the same
+    results as np.interp applied to every column of x, since it calls
+    np.interp once per column.
+
+    Parameters
+    ----------
+    x : ndarray
+        The x-coordinates at which to evaluate the interpolated values, one
+        column per interpolation.
+    xp : array or ndarray
+        The increasing x-coordinates of the data points, either shared by all
+        columns of x or one column per column of x.
+    fp : array or ndarray
+        The y-coordinates of the data points, either shared by all columns of
+        x or one column per column of x.
+
+    Returns
+    -------
+    y : ndarray
+        The interpolated values.
+
+    """
+    xp = np.asarray(xp)
+    fp = np.asarray(fp)
+    n = xp.shape[0]
+    assert n > 1 and fp.shape[0] == n, 'xp and fp differ in length or are short'
+
+    # np.interp searches and interpolates faster column by column than a
+    # search of all columns at once using numpy array operations, so store
+    # columns contiguously for subsequent column-wise interpolations
+    y = np.empty(x.shape, order='F')
+    for k in range(x.shape[1]):
+        y[:,k] = np.interp(x[:,k],
+            xp if xp.ndim == 1 else xp[:,k], fp if fp.ndim == 1 else fp[:,k])
+    return y
+
+
+
+def get_quantiles(x, p, x_sorted=None):
+    """
+    Returns the quantiles of x for the given percentages, column by column if
+    x is a 2d array.
+
+    Parameters
+    ----------
+    x : array or ndarray
+        Input data.
+    p : array
+        Percentages expressed as real numbers in [0, 1] for which quantiles
+        are computed.
+    x_sorted : array or ndarray, optional
+        Copy of x sorted column by column, used instead of sorting x again if
+        not None.
+
+    Returns
+    -------
+    q : array or ndarray
+        Quantiles, one column per column of x if x is a 2d array.
+
+    """
+    is_sorted = x_sorted is not None
+    if is_sorted: x = x_sorted
+    return percentile1d(x, p, is_sorted) if x.ndim == 1 \
+        else percentile2d(x, p, is_sorted)
+
+
+
+def get_quantile_delta_mapper(
+        x_obs_hist, x_sim_hist, n_quantiles=50, x_sorted=(None, None)):
+    """
+    Computes the quantiles of x_obs_hist and x_sim_hist needed for quantile
+    delta mapping once, such that these can be reused for the quantile delta
+    mapping of any number of arrays with apply_quantile_delta_mapper.
+
+    Parameters
+    ----------
+    x_obs_hist : array
+        Time series of observed climate data representing the historical or
+        training time period. If x_obs_hist and x_sim_hist are 2d arrays then
+        quantiles are computed for every column separately.
+    x_sim_hist : array
+        Time series of simulated climate data representing the historical or
+        training time period.
+    n_quantiles : int, optional
+        Number of quantile-quantile pairs used for non-parametric quantile
+        mapping.
+    x_sorted : tuple of arrays or Nones, optional
+        Sorted copies of x_obs_hist and x_sim_hist. Quantiles of 1d input data
+        are computed from these instead of sorting the input data again
+        wherever they are not None.
+
+    Returns
+    -------
+    mapper : dict
+        Keys 'x_obs_hist', 'x_sim_hist', 'x_sorted', and 'n_quantiles' hold
+        the input. Keys 'p_zeroone', 'q_obs_hist', and 'q_sim_hist' hold the
+        percentages and the corresponding quantiles of x_obs_hist and
+        x_sim_hist, or None if there are not enough input data.
+
+    """
+    assert n_quantiles > 0, 'n_quantiles <= 0'
+    mapper = {
+        'x_obs_hist': x_obs_hist,
+        'x_sim_hist': x_sim_hist,
+        'x_sorted': x_sorted,
+        'n_quantiles': n_quantiles,
+        'p_zeroone': None,
+        'q_obs_hist': None,
+        'q_sim_hist': None
+        }
+    n = min([n_quantiles + 1, x_obs_hist.shape[0], x_sim_hist.shape[0]])
+    if n > 1:
+        p_zeroone = np.linspace(0., 1., n)
+        mapper['p_zeroone'] = p_zeroone
+        mapper['q_obs_hist'] = get_quantiles(x_obs_hist, p_zeroone, x_sorted[0])
+        mapper['q_sim_hist'] = get_quantiles(x_sim_hist, p_zeroone, x_sorted[1])
+    return mapper
+
+
+
 def map_quantiles_non_parametric_trend_preserving(
         x_obs_hist, x_sim_hist, x_sim_fut, 
         trend_preservation='additive', n_quantiles=50,
         max_change_factor=100., max_adjustment_factor=9.,
-        adjust_obs=False, lower_bound=None, upper_bound=None):
+        adjust_obs=False, lower_bound=None, upper_bound=None,
+        x_sorted=(None, None, None)):
     """
     Adjusts biases with a modified version of the quantile delta mapping by
     Cannon (2015) <https://doi.org/10.1175/JCLI-D-14-00754.1> or uses this
@@ -1100,13 +2816,73 @@ def map_quantiles_non_parametric_trend_preserving(
     ----------
     x_obs_hist : array
         Time series of observed climate data representing the historical or
-        training time period.
+        training time period. If x_obs_hist, x_sim_hist, and x_sim_fut are 2d
+        arrays then every column is mapped separately.
     x_sim_hist : array
         Time series of simulated climate data representing the historical or
         training time period.
     x_sim_fut : array
         Time series of simulated climate data representing the future or
         application time period.
+    trend_preservation : str, optional
+        Kind of trend preservation, see apply_quantile_delta_mapper.
+    n_quantiles : int, optional
+        Number of quantile-quantile pairs used for non-parametric quantile
+        mapping.
+    max_change_factor : float, optional
+        Maximum change factor applied in non-parametric quantile mapping with
+        multiplicative or mixed trend preservation.
+    max_adjustment_factor : float, optional
+        Maximum adjustment factor applied in non-parametric quantile mapping
+        with mixed trend preservation.
+    adjust_obs : boolean, optional
+        If True then transfer simulated climate change signal to x_obs_hist,
+        otherwise apply non-parametric quantile mapping to x_sim_fut.
+    lower_bound : float, optional
+        Lower bound of values in x_obs_hist, x_sim_hist, and x_sim_fut. Used
+        for bounded trend preservation.
+    upper_bound : float, optional
+        Upper bound of values in x_obs_hist, x_sim_hist, and x_sim_fut. Used
+        for bounded trend preservation.
+    x_sorted : tuple of arrays or Nones, optional
+        Sorted copies of x_obs_hist, x_sim_hist, and x_sim_fut. Quantiles of
+        1d input data are computed from these instead of sorting the input
+        data again wherever they are not None.
+
+    Returns
+    -------
+    y : array
+        Result of quantile mapping or climate change signal transfer.
+
+    """
+    mapper = get_quantile_delta_mapper(
+        x_obs_hist, x_sim_hist, n_quantiles, x_sorted[:2])
+    return apply_quantile_delta_mapper(mapper, x_sim_fut,
+        trend_preservation, max_change_factor, max_adjustment_factor,
+        adjust_obs, lower_bound, upper_bound, x_sorted[2])
+
+
+
+def apply_quantile_delta_mapper(
+        mapper, x_sim_fut, trend_preservation='additive',
+        max_change_factor=100., max_adjustment_factor=9.,
+        adjust_obs=False, lower_bound=None, upper_bound=None,
+        x_sim_fut_sorted=None):
+    """
+    Adjusts biases with a modified version of the quantile delta mapping by
+    Cannon (2015) <https://doi.org/10.1175/JCLI-D-14-00754.1> or uses this
+    method to transfer a simulated climate change signal to observations,
+    using the quantiles of x_obs_hist and x_sim_hist computed by
+    get_quantile_delta_mapper.
+
+    Parameters
+    ----------
+    mapper : dict
+        Result of get_quantile_delta_mapper.
+    x_sim_fut : array
+        Time series of simulated climate data representing the future or
+        application time period. The quantiles of x_sim_hist are reused if
+        this is x_sim_hist of the mapper.
     trend_preservation : str, optional
         Kind of trend preservation:
         'additive'       # Preserve additive trend.
@@ -1122,9 +2898,6 @@ def map_quantiles_non_parametric_trend_preserving(
                          # specification of lower_bound and upper_bound. It is
                          # ensured that the resulting values stay within these
                          # bounds.
-    n_quantiles : int, optional
-        Number of quantile-quantile pairs used for non-parametric quantile
-        mapping.
     max_change_factor : float, optional
         Maximum change factor applied in non-parametric quantile mapping with
         multiplicative or mixed trend preservation.
@@ -1140,6 +2913,9 @@ def map_quantiles_non_parametric_trend_preserving(
     upper_bound : float, optional
         Upper bound of values in x_obs_hist, x_sim_hist, and x_sim_fut. Used
         for bounded trend preservation.
+    x_sim_fut_sorted : array, optional
+        Sorted copy of 1d x_sim_fut, used to compute its quantiles without
+        sorting it again if not None.
 
     Returns
     -------
@@ -1147,10 +2923,14 @@ def map_quantiles_non_parametric_trend_preserving(
         Result of quantile mapping or climate change signal transfer.
 
     """
+    x_obs_hist = mapper['x_obs_hist']
+    x_sim_hist = mapper['x_sim_hist']
+
     # make sure there are enough input data for quantile delta mapping
     # reduce n_quantiles if necessary
-    assert n_quantiles > 0, 'n_quantiles <= 0'
-    n = min([n_quantiles + 1, x_obs_hist.size, x_sim_hist.size, x_sim_fut.size])
+    n_quantiles = mapper['n_quantiles']
+    n = min([n_quantiles + 1, x_obs_hist.shape[0], x_sim_hist.shape[0],
+        x_sim_fut.shape[0]])
     if n < 2:
         if adjust_obs:
             msg = 'not enough input data: returning x_obs_hist'
@@ -1163,19 +2943,36 @@ def map_quantiles_non_parametric_trend_preserving(
     elif n < n_quantiles + 1:
         msg = 'due to little input data: reducing n_quantiles to %i'%(n-1)
         warnings.warn(msg)
-    p_zeroone = np.linspace(0., 1., n)
-
-    # compute quantiles of input data
-    q_obs_hist = percentile1d(x_obs_hist, p_zeroone)
-    q_sim_hist = percentile1d(x_sim_hist, p_zeroone)
-    q_sim_fut = percentile1d(x_sim_fut, p_zeroone)
+    interp = np.interp if x_obs_hist.ndim == 1 else interp2d
+
+    # compute quantiles of input data, reusing those of the mapper unless
+    # x_sim_fut is too short for these
+    p_zeroone = mapper['p_zeroone']
+    q_obs_hist = mapper['q_obs_hist']
+    q_sim_hist = mapper['q_sim_hist']
+    if n < p_zeroone.size:
+        p_zeroone = np.linspace(0., 1., n)
+        q_obs_hist, q_sim_hist = (get_quantiles(x, p_zeroone, s)
+            for x, s in zip((x_obs_hist, x_sim_hist), mapper['x_sorted']))
+
+    # map the values in ascending order, which makes the searches done by
+    # np.interp considerably faster, and restore their order in the end
+    x = x_obs_hist if adjust_obs else x_sim_fut
+    columns = (np.arange(x.shape[1]),) if x.ndim == 2 else ()
+    i_ascending = (np.argsort(x, axis=0),) + columns
+    x_ascending = x[i_ascending]
+    if x_sim_fut is x_sim_hist:
+        q_sim_fut = q_sim_hist
+    else:
+        if x_sim_fut_sorted is None and not adjust_obs:
+            x_sim_fut_sorted = x_ascending
+        q_sim_fut = get_quantiles(x_sim_fut, p_zeroone, x_sim_fut_sorted)
 
     # compute quantiles needed for quantile delta mapping
-    if adjust_obs: p = np.interp(x_obs_hist, q_obs_hist, p_zeroone)
-    else: p = np.interp(x_sim_fut, q_sim_fut, p_zeroone)
-    F_sim_fut_inv  = np.interp(p, p_zeroone, q_sim_fut)
-    F_sim_hist_inv = np.interp(p, p_zeroone, q_sim_hist)
-    F_obs_hist_inv = np.interp(p, p_zeroone, q_obs_hist)
+    p = interp(x_ascending, q_obs_hist if adjust_obs else q_sim_fut, p_zeroone)
+    F_sim_fut_inv  = interp(p, p_zeroone, q_sim_fut)
+    F_sim_hist_inv = interp(p, p_zeroone, q_sim_hist)
+    F_obs_hist_inv = interp(p, p_zeroone, q_obs_hist)
 
     # do augmented quantile delta mapping
     if trend_preservation == 'bounded':
@@ -1211,6 +3008,9 @@ def map_quantiles_non_parametric_trend_preserving(
         msg = 'trend_preservation = '+trend_preservation+' not supported'
         raise AssertionError(msg)
 
+    y_ascending = y
+    y = np.empty_like(y_ascending)
+    y[i_ascending] = y_ascending
     return y
 
 
@@ -1227,7 +3027,8 @@ def map_quantiles_non_parametric_with_constant_extrapolation(x, q_sim, q_obs):
     Parameters
     ----------
     x : array
-        Simulated time series.
+        Simulated time series. If x is a 2d array then every column is mapped
+        separately using the corresponding columns of q_sim and q_obs.
     q_sim : array
         Simulated quantiles.
     q_obs : array
@@ -1242,9 +3043,17 @@ def map_quantiles_non_parametric_with_constant_extrapolation(x, q_sim, q_obs):
     assert q_sim.size == q_obs.size
     lunder = x < q_sim[0]
     lover = x > q_sim[-1]
-    y = np.interp(x, q_sim, q_obs)
-    y[lunder] = x[lunder] + (q_obs[0] - q_sim[0])
-    y[lover] = x[lover] + (q_obs[-1] - q_sim[-1])
+    if x.ndim == 1:
+        y = np.interp(x, q_sim, q_obs)
+        y[lunder] = x[lunder] + (q_obs[0] - q_sim[0])
+        y[lover] = x[lover] + (q_obs[-1] - q_sim[-1])
+    else:
+        # cast offsets to the data type that is used when they are added as
+        # scalars to 1d arrays
+        dtype = np.result_type(x, q_obs.dtype.type(0))
+        y = interp2d(x, q_sim, q_obs)
+        y[lunder] = (x + (q_obs[0] - q_sim[0]).astype(dtype))[lunder]
+        y[lover] = (x + (q_obs[-1] - q_sim[-1]).astype(dtype))[lover]
     return y
 
 
@@ -1487,18 +3296,19 @@ def randomize_censored_values(x,
 
     """
     y = x if inplace else x.copy()
-    if seed is not None:
-        np.random.seed(seed)
+    with random_lock:
+        if seed is not None:
+            np.random.seed(seed)
 
-    # randomize lower values
-    if lower_bound is not None and lower_threshold is not None:
-        randomize_censored_values_core(
-            y, lower_bound, lower_threshold, inverse, lower_power, True)
+        # randomize lower values
+        if lower_bound is not None and lower_threshold is not None:
+            randomize_censored_values_core(
+                y, lower_bound, lower_threshold, inverse, lower_power, True)
 
-    # randomize upper values
-    if upper_bound is not None and upper_threshold is not None:
-        randomize_censored_values_core(
-            y, upper_bound, upper_threshold, inverse, upper_power, False)
+        # randomize upper values
+        if upper_bound is not None and upper_threshold is not None:
+            randomize_censored_values_core(
+                y, upper_bound, upper_threshold, inverse, upper_power, False)
 
     return y
 
@@ -1933,8 +3743,9 @@ def sample_invalid_values_core(d, seed, if_all_invalid_use, warn, l_invalid):
     if warn: warnings.warn(msg)
     l_valid = np.logical_not(l_invalid)
     d_valid = d[l_valid]
-    if seed is not None: np.random.seed(seed)
-    p_sampled = np.random.random_sample(n_invalid)
+    with random_lock:
+        if seed is not None: np.random.seed(seed)
+        p_sampled = np.random.random_sample(n_invalid)
     d_sampled = percentile1d(d_valid, p_sampled)
     d_replaced = d.copy()
     if n_valid == 1:
@@ -1978,6 +3789,49 @@ def convert_datetimes(datetimes, to):
 
 
 
+@lru_cache(maxsize=16)
+def get_normal_scores(n):
+    """
+    Returns the standard normal quantiles of the plotting positions of n
+    ranks, which are cached such that they are only computed once per sample
+    size.
+
+    Parameters
+    ----------
+    n : int
+        Sample size.
+
+    Returns
+    -------
+    scores : array
+        Read-only array of standard normal quantiles, one per rank.
+
+    """
+    scores = sps.norm.ppf((np.arange(n) + .5) / n)
+    scores.flags.writeable = False
+    return scores
+
+
+
+def get_ranks(x):
+    """
+    Returns the ranks of the values in every row of x.
+
+    Parameters
+    ----------
+    x : ndarray
+        Input data, one sample per row.
+
+    Returns
+    -------
+    r : ndarray
+        Ranks starting at 0, one row per row of x.
+
+    """
+    return np.argsort(np.argsort(x, axis=1), axis=1)
+
+
+
 def adjust_copula_mbcn(x, rotation_matrices=[], n_quantiles=50):
     """
     Applies the MBCn algorithm for an adjustment of the multivariate rank
@@ -2005,8 +3859,8 @@ def adjust_copula_mbcn(x, rotation_matrices=[], n_quantiles=50):
     # stack resulting arrays row wise
     y = {}
     for key in x:
-        y[key] = np.stack([sps.norm.ppf((np.argsort(np.argsort(xi))+.5)/xi.size)
-                           for xi in x[key]])
+        x_stacked = np.stack(x[key])
+        y[key] = get_normal_scores(x_stacked.shape[1])[get_ranks(x_stacked)]
 
     # initialize total rotation matrix
     n_variables = len(x['sim_fut'])
@@ -2020,26 +3874,24 @@ def adjust_copula_mbcn(x, rotation_matrices=[], n_quantiles=50):
         for key in y:
             y[key] = np.dot(o, y[key])
 
-        # do univariate non-parametric quantile delta mapping for every variable
-        for i in range(n_variables):
-            y_sim_hist_old = y['sim_hist'][i].copy()
-            y['sim_hist'][i] = map_quantiles_non_parametric_trend_preserving(
-                y['obs_hist'][i], y_sim_hist_old, y_sim_hist_old,
-                'additive', n_quantiles)
-            y['sim_fut'][i] = map_quantiles_non_parametric_trend_preserving(
-                y['obs_hist'][i], y_sim_hist_old, y['sim_fut'][i],
-                'additive', n_quantiles)
+        # do univariate non-parametric quantile delta mapping for all
+        # variables at once, with one column per variable
+        mapper = get_quantile_delta_mapper(
+            y['obs_hist'].T, y['sim_hist'].T, n_quantiles)
+        y['sim_hist'], y['sim_fut'] = (
+            np.ascontiguousarray(apply_quantile_delta_mapper(
+            mapper, y_T, 'additive').T)
+            for y_T in (mapper['x_sim_hist'], y['sim_fut'].T))
 
     # rotate back to original axes
     y['sim_fut'] = np.dot(o_total.T, y['sim_fut'])
 
     # shuffle x_sim_fut according to the result of the copula adjustment
-    x_sim_fut_ba = []
-    for i in range(n_variables):
-        r_sim_fut_ba = np.argsort(np.argsort(y['sim_fut'][i]))
-        x_sim_fut_ba.append(np.sort(x['sim_fut'][i])[r_sim_fut_ba])
-
-    return x_sim_fut_ba
+    x_sim_fut_sorted = np.sort(np.stack(x['sim_fut']), axis=1)
+    x_sim_fut_ba = x_sim_fut_sorted[np.arange(n_variables)[:,None],
+        get_ranks(y['sim_fut'])]
+    return [xi.astype(x['sim_fut'][i].dtype, copy=False)
+        for i, xi in enumerate(x_sim_fut_ba)]
 
 
 
@@ -2096,3 +3948,143 @@ def generate_rotation_matrix_fixed_first_axis(v, transpose=False):
     q, r = spl.qr(a)
 
     return -q.T if transpose else -q
+
+
+
+def generate_structured_rotation(n, n_rounds=1):
+    """
+    Returns a random orthogonal n x n transformation that can be applied to
+    vectors of length n in O(n log n) operations. It consists of n_rounds
+    rounds of a random permutation, random sign changes, and an orthonormal
+    discrete cosine transform, following the idea of randomized Hadamard
+    transforms, see Ailon and Chazelle (2009)
+    <https://doi.org/10.1137/060673096>.
+
+    Parameters
+    ----------
+    n : int
+        Number of rows and columns of the transformation.
+    n_rounds : int, optional
+        Number of rounds of permutation, sign changes, and discrete cosine
+        transform.
+
+    Returns
+    -------
+    o : list of dicts
+        Structured orthogonal transformation, see rotate.
+
+    """
+    return [{
+        'permutation': np.random.permutation(n),
+        'signs': np.random.choice([-1., 1.], n),
+        'transpose': False
+        } for i in range(n_rounds)]
+
+
+
+def generate_householder_reflection_fixed_first_axis(v):
+    """
+    Structured alternative to generate_rotation_matrix_fixed_first_axis that
+    returns the Householder reflection whose first row and column are equal to
+    v/|v|, which can be applied to vectors of length n in O(n) operations.
+
+    Parameters
+    ----------
+    v : (n,) array
+        Array of n non-zero numbers.
+
+    Returns
+    -------
+    o : list of dicts
+        Structured orthogonal transformation, see rotate.
+
+    """
+    assert np.all(v > 0), 'all elements of v have to be positive'
+    u = - v / np.sqrt(np.sum(np.square(v)))
+    u[0] += 1.
+    norm = np.sqrt(np.sum(np.square(u)))
+    return [{'householder': u / norm if norm > 0 else u}]
+
+
+
+def rotate(x, o):
+    """
+    Transforms the rows of x by the orthogonal transformation o, i.e.,
+    returns the product of x and o.
+
+    Parameters
+    ----------
+    x : (n,) array or (m,n) ndarray
+        Vector or matrix with rows to be transformed.
+    o : (n,n) ndarray or list of dicts
+        Orthogonal matrix or structured orthogonal transformation, i.e., a
+        sequence of steps generated by generate_structured_rotation and
+        generate_householder_reflection_fixed_first_axis, possibly composed
+        by compose_rotations and transposed by transpose_rotation.
+
+    Returns
+    -------
+    y : (n,) array or (m,n) ndarray
+        Transformed vector or matrix.
+
+    """
+    if isinstance(o, np.ndarray):
+        return np.dot(x, o)
+    for step in o:
+        if 'householder' in step:
+            u = step['householder']
+            x = x - 2. * np.multiply.outer(np.dot(x, u), u)
+        elif step['transpose']:
+            x = spfft.idct(x, 2, axis=-1, norm='ortho')
+            x *= step['signs']
+            x = np.take(x, np.argsort(step['permutation']), axis=-1)
+        else:
+            x = np.take(x, step['permutation'], axis=-1) * step['signs']
+            x = spfft.dct(x, 2, axis=-1, norm='ortho', overwrite_x=True)
+    return x
+
+
+
+def compose_rotations(o1, o2):
+    """
+    Returns the orthogonal transformation that transforms like o1 followed by
+    o2, i.e., the product of o1 and o2.
+
+    Parameters
+    ----------
+    o1 : (n,n) ndarray or list of dicts
+        Orthogonal matrix or structured orthogonal transformation, see rotate.
+    o2 : (n,n) ndarray or list of dicts
+        Orthogonal matrix or structured orthogonal transformation of the same
+        kind as o1.
+
+    Returns
+    -------
+    o : (n,n) ndarray or list of dicts
+        Composed orthogonal transformation.
+
+    """
+    return np.dot(o1, o2) if isinstance(o1, np.ndarray) else o1 + o2
+
+
+
+def transpose_rotation(o):
+    """
+    Returns the transpose, i.e., the inverse of an orthogonal transformation.
+
+    Parameters
+    ----------
+    o : (n,n) ndarray or list of dicts
+        Orthogonal matrix or structured orthogonal transformation, see rotate.
+
+    Returns
+    -------
+    o_transposed : (n,n) ndarray or list of dicts
+        Transposed orthogonal transformation.
+
+    """
+    if isinstance(o, np.ndarray):
+        return o.T
+    # Householder reflections are symmetric
+    return [step if 'householder' in step
+        else dict(step, transpose=not step['transpose']) for step in o[::-1]]